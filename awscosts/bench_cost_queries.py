@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""Benchmark common cost group-by queries, SQLite vs DuckDB vs Parquet
+
+    Loads the same synthetic rows into the SQLite and DuckDB schemas of
+    get_costs_sqlite.py, exports the DuckDB table to partitioned Parquet with
+    export_parquet, and times each query on all three.
+"""
+
+import argparse
+import csv
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import duckdb
+
+from bench_cost_writes import synthetic_response
+from get_costs_sqlite import (DuckDBCursor, cost_rows, create_table_if_not_exists,
+                              export_parquet, period_expression, store_rows)
+
+# name -> query with {table} and {month}, AmortizedCost only like the R notebook
+QUERIES = {
+    'monthly_by_service': ("SELECT {month} AS month, aws_service, SUM(amount) FROM {table} "
+                           "WHERE cost_type = 'AmortizedCost' GROUP BY 1, 2"),
+    'daily_by_account': ("SELECT account_id, time_period, SUM(amount) FROM {table} "
+                         "WHERE cost_type = 'AmortizedCost' GROUP BY 1, 2"),
+    'top_usage_types': ("SELECT usage_type, SUM(amount) AS total FROM {table} "
+                        "WHERE cost_type = 'AmortizedCost' GROUP BY 1 ORDER BY 2 DESC LIMIT 10"),
+}
+
+
+def synthetic_rows(accounts: int, days: int, services: int, usage_types: int) -> List[tuple]:
+    """Rows in COST_COLUMNS order for several accounts.
+
+    Args:
+        accounts: Number of accounts
+        days: DAILY results per account
+        services: Services per account
+        usage_types: Usage types per service
+
+    Returns:
+        List[tuple]: Rows for all accounts
+    """
+    rows = []
+    timestamp = int(time.time())
+    for account in range(accounts):
+        response = synthetic_response(days, services, usage_types, seed=account)
+        rows.extend(cost_rows(response, f'{100000000000 + account}', timestamp))
+    return rows
+
+
+def load_duckdb(rows: List[tuple], db_path: str, csv_path: str) -> Any:
+    """Create the DuckDB schema and bulk load rows through a CSV file.
+
+    Args:
+        rows: Rows in COST_COLUMNS order
+        db_path: DuckDB file
+        csv_path: Scratch CSV file
+
+    Returns:
+        DuckDBCursor: Cursor on the loaded database
+    """
+    with open(csv_path, 'w', newline='', encoding='utf-8') as csv_file:
+        csv.writer(csv_file).writerows(rows)
+    db_cursor = DuckDBCursor(duckdb.connect(db_path))
+    create_table_if_not_exists('costs', db_cursor, 'duckdb')
+    db_cursor.execute(f"COPY costs FROM '{csv_path}' (HEADER false)")
+    db_cursor.connection.commit()
+    return db_cursor
+
+
+def time_query(db_cursor: Any, sql: str, repeat: int) -> float:
+    """Best of repeat runs in seconds.
+
+    Args:
+        db_cursor: Cursor to run the query on
+        sql: Query
+        repeat: Number of runs
+
+    Returns:
+        float: Fastest run
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        db_cursor.execute(sql)
+        db_cursor.fetchall()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def dir_size_mb(path: str) -> float:
+    """Size of a file or directory tree in MB."""
+    if os.path.isfile(path):
+        return os.path.getsize(path) / 1048576
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names) / 1048576
+
+
+def main() -> None:
+    """Load the stores and time QUERIES on each."""
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Benchmark cost queries on SQLite, DuckDB and Parquet')
+    parser.add_argument('--accounts', type=int, default=2, help='Accounts (default: 2)')
+    parser.add_argument('--days', type=int, default=365, help='Days per account (default: 365)')
+    parser.add_argument('--services', type=int, default=30, help='Services (default: 30)')
+    parser.add_argument('--usage-types', type=int, default=10,
+                        help='Usage types per service (default: 10)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per query, best is kept')
+    args = parser.parse_args()
+
+    rows = synthetic_rows(args.accounts, args.days, args.services, args.usage_types)
+    logging.info(f"{len(rows)} rows")
+    first_day, last_day = min(row[2] for row in rows), max(row[2] for row in rows)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sqlite_path = os.path.join(tmp_dir, 'costs.db')
+        sqlite_conn = sqlite3.connect(sqlite_path)
+        sqlite_cur = sqlite_conn.cursor()
+        create_table_if_not_exists('costs', sqlite_cur)
+        store_rows(rows, 'costs', sqlite_cur)
+
+        duckdb_path = os.path.join(tmp_dir, 'costs.duckdb')
+        duck_cur = load_duckdb(rows, duckdb_path, os.path.join(tmp_dir, 'costs.csv'))
+        duck_cur.execute("CHECKPOINT")
+        duck_cur.connection.commit()
+        parquet_dir = os.path.join(tmp_dir, 'parquet')
+        for account_id in sorted({row[1] for row in rows}):
+            export_parquet('costs', duck_cur, account_id, first_day, last_day, parquet_dir)
+        logging.info(f"size MB - sqlite {dir_size_mb(sqlite_path):.1f}, "
+                     f"duckdb {dir_size_mb(duckdb_path):.1f}, parquet {dir_size_mb(parquet_dir):.1f}")
+
+        parquet_table = (f"read_parquet('{parquet_dir}/*/*/*.parquet', "
+                         f"hive_partitioning = true)")
+        results: Dict[str, Dict[str, float]] = {}
+        for name, sql in QUERIES.items():
+            results[name] = {
+                'sqlite': time_query(sqlite_cur, sql.format(
+                    table='costs', month=period_expression('month', 'sqlite')), args.repeat),
+                'duckdb': time_query(duck_cur, sql.format(
+                    table='costs', month=period_expression('month', 'duckdb')), args.repeat),
+                'parquet': time_query(duck_cur, sql.format(
+                    table=parquet_table, month=period_expression('month', 'duckdb')),
+                    args.repeat),
+            }
+            timings = results[name]
+            logging.info(f"{name:<20} sqlite {timings['sqlite']:.3f}s  duckdb {timings['duckdb']:.3f}s"
+                         f"  parquet {timings['parquet']:.3f}s  "
+                         f"({timings['sqlite'] / timings['duckdb']:.1f}x)")
+        duck_cur.duck_conn.close()
+        sqlite_conn.close()
+
+
+if __name__ == "__main__":
+    main()
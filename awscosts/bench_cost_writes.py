@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Benchmark cost inserts, one commit per row vs batched executemany
+
+    Builds a synthetic Cost Explorer response (DAILY, grouped by SERVICE and USAGE_TYPE)
+    and writes it to a scratch SQLite file both ways, reporting rows/second.
+"""
+
+import argparse
+import datetime
+import logging
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from typing import Any, Dict
+
+from get_costs_sqlite import (COST_COLUMNS, COST_TYPES, cost_rows,
+                              create_table_if_not_exists, store_rows)
+
+
+def synthetic_response(days: int, services: int, usage_types: int, seed: int = 0) -> Dict[str, Any]:
+    """Cost Explorer shaped response with days x services x usage_types groups.
+
+    Args:
+        days: Number of DAILY results
+        services: Distinct SERVICE keys
+        usage_types: USAGE_TYPE keys per service
+        seed: Seed for the amounts
+
+    Returns:
+        dict: Response with ResultsByTime like get_cost_and_usage
+    """
+    rng = random.Random(seed)
+    start = datetime.date(2023, 9, 1)
+    results = []
+    for day in range(days):
+        groups = []
+        for service in range(services):
+            for usage in range(usage_types):
+                groups.append({
+                    'Keys': [f'Service {service}', f'USE1-Usage{usage}'],
+                    'Metrics': {cost_type: {'Amount': f'{rng.random():.10f}', 'Unit': 'USD'}
+                                for cost_type in COST_TYPES}
+                })
+        period = start + datetime.timedelta(days=day)
+        results.append({'TimePeriod': {'Start': str(period),
+                                       'End': str(period + datetime.timedelta(days=1))},
+                        'Groups': groups})
+    return {'ResultsByTime': results}
+
+
+def write_row_by_row(rows: list, table_name: str, sqlite_cursor: Any) -> int:
+    """Previous behaviour - one INSERT and one commit per row.
+
+    Args:
+        rows: Tuples in COST_COLUMNS order
+        table_name: Name of the table
+        sqlite_cursor: SQLite cursor object
+
+    Returns:
+        int: Number of rows written
+    """
+    cols = ', '.join(COST_COLUMNS)
+    placeholders = ', '.join(['?' for _ in COST_COLUMNS])
+    for row in rows:
+        sqlite_cursor.execute(f"INSERT INTO {table_name} ({cols}) VALUES ({placeholders})", row)
+        sqlite_cursor.connection.commit()
+    return len(rows)
+
+
+def timed_write(method: str, rows: list, db_path: str) -> float:
+    """Write rows to a fresh table, returns rows/second.
+
+    Args:
+        method: 'row' or 'batch'
+        rows: Tuples in COST_COLUMNS order
+        db_path: SQLite file
+
+    Returns:
+        float: Rows per second
+    """
+    table_name = f'costs_{method}'
+    sqlite_conn = sqlite3.connect(db_path)
+    sqlite_cur = sqlite_conn.cursor()
+    create_table_if_not_exists(table_name, sqlite_cur)
+    start = time.perf_counter()
+    if method == 'row':
+        written = write_row_by_row(rows, table_name, sqlite_cur)
+    else:
+        written = store_rows(rows, table_name, sqlite_cur)
+    elapsed = time.perf_counter() - start
+    sqlite_conn.close()
+    rate = written / elapsed if elapsed else 0
+    logging.info(f"{method:>5}: {written} rows in {elapsed:.2f}s ({rate:.0f} rows/second)")
+    return rate
+
+
+def main() -> None:
+    """Run both write methods on the same rows."""
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Benchmark AWS cost inserts into SQLite')
+    parser.add_argument('--days', type=int, default=30, help='DAILY results (default: 30)')
+    parser.add_argument('--services', type=int, default=40, help='Services (default: 40)')
+    parser.add_argument('--usage-types', type=int, default=10,
+                        help='Usage types per service (default: 10)')
+    parser.add_argument('--db-path', type=str, default=None,
+                        help='SQLite file (default: a temporary file)')
+    args = parser.parse_args()
+
+    response = synthetic_response(args.days, args.services, args.usage_types)
+    rows = list(cost_rows(response, '123456789012', int(time.time())))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = args.db_path or os.path.join(tmp_dir, 'bench_costs.db')
+        row_rate = timed_write('row', rows, db_path)
+        batch_rate = timed_write('batch', rows, db_path)
+    logging.info(f"batched inserts are {batch_rate / row_rate if row_rate else 0:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
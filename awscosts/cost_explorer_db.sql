@@ -7,3 +7,33 @@ CREATE TABLE IF NOT EXISTS costs (
 	usage_type text  NOT NULL,
     amount decimal not null  --should be type money, but not supported by RPostgres
 );
+
+-- one row per account/day/service/usage/cost type, runs upsert on this key
+CREATE UNIQUE INDEX IF NOT EXISTS costs_cost_key ON costs (account_id, time_period, aws_service, usage_type, cost_type);
+
+-- rollups refreshed by get_costs.py for the days and months of each load
+CREATE TABLE IF NOT EXISTS costs_daily_service (
+	account_id text NOT NULL,
+	time_period DATE NOT NULL,
+	aws_service text NOT NULL,
+	cost_type text NOT NULL,
+	amount decimal NOT NULL,
+	PRIMARY KEY (account_id, time_period, aws_service, cost_type)
+);
+
+CREATE TABLE IF NOT EXISTS costs_monthly_service (
+	account_id text NOT NULL,
+	time_period DATE NOT NULL, -- first day of the month
+	aws_service text NOT NULL,
+	cost_type text NOT NULL,
+	amount decimal NOT NULL,
+	PRIMARY KEY (account_id, time_period, aws_service, cost_type)
+);
+
+CREATE TABLE IF NOT EXISTS costs_monthly_account (
+	account_id text NOT NULL,
+	time_period DATE NOT NULL, -- first day of the month
+	cost_type text NOT NULL,
+	amount decimal NOT NULL,
+	PRIMARY KEY (account_id, time_period, cost_type)
+);
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""Read AWS costs from the rollup tables kept by get_costs_sqlite.py
+
+    Dashboards query <table>_daily_service, <table>_monthly_service and
+    <table>_monthly_account instead of aggregating the raw costs rows.
+"""
+
+import argparse
+import csv
+import datetime
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+from get_costs_sqlite import ROLLUPS, db_connection, read_config, storage_backend
+
+
+def connect(config_path: str = 'setup.config') -> Tuple[Any, Any, str, str]:
+    """Connect to the configured costs database.
+
+    Args:
+        config_path: Path to configuration file
+
+    Returns:
+        Tuple[connection, cursor, table_name, backend]: As used by the query functions
+    """
+    p_config = read_config(config_path)
+    backend = storage_backend(p_config)
+    db_conn, db_cur, table_name = db_connection(p_config, backend)
+    return db_conn, db_cur, table_name, backend
+
+
+def query_rollup(
+    rollup: str,
+    db_cursor: Any,
+    table_name: str,
+    start_date: datetime.date,
+    end_date: datetime.date,
+    cost_type: str = 'AmortizedCost',
+    account_ids: Optional[List[str]] = None,
+    backend: str = 'sqlite'
+) -> List[Dict[str, Any]]:
+    """Rows of one rollup table for a date range.
+
+    Args:
+        rollup: Name in ROLLUPS, e.g. 'daily_service'
+        db_cursor: SQLite, PostgreSQL or DuckDB cursor object
+        table_name: Name of the costs table
+        start_date: First day (monthly rollups: any day of the first month)
+        end_date: End date (exclusive)
+        cost_type: AmortizedCost, BlendedCost or UnblendedCost
+        account_ids: Only these accounts (default: all)
+        backend: 'sqlite', 'postgres' or 'duckdb'
+
+    Returns:
+        List[dict]: Rows ordered by time_period, with account_id, time_period,
+        the rollup's grouping columns and amount
+    """
+    period, group_cols = ROLLUPS[rollup]
+    if period == 'month':
+        start_date = start_date.replace(day=1)
+    placeholder = '%s' if backend == 'postgres' else '?'
+    cols = ('account_id', 'time_period') + group_cols + ('amount',)
+    conditions = [f"time_period >= {placeholder}", f"time_period < {placeholder}",
+                  f"cost_type = {placeholder}"]
+    params = [str(start_date), str(end_date), cost_type]
+    if account_ids:
+        conditions.append(f"account_id IN ({', '.join(placeholder for _ in account_ids)})")
+        params += account_ids
+    db_cursor.execute(f"SELECT {', '.join(cols)} FROM {table_name}_{rollup} "
+                      f"WHERE {' AND '.join(conditions)} "
+                      f"ORDER BY time_period, account_id", params)
+    return [dict(zip(cols, row)) for row in db_cursor.fetchall()]
+
+
+def daily_service_costs(db_cursor: Any, table_name: str, start_date: datetime.date,
+                        end_date: datetime.date, **kwargs: Any) -> List[Dict[str, Any]]:
+    """Cost per account, day and service, see query_rollup."""
+    return query_rollup('daily_service', db_cursor, table_name, start_date, end_date, **kwargs)
+
+
+def monthly_service_costs(db_cursor: Any, table_name: str, start_date: datetime.date,
+                          end_date: datetime.date, **kwargs: Any) -> List[Dict[str, Any]]:
+    """Cost per account, month and service, see query_rollup."""
+    return query_rollup('monthly_service', db_cursor, table_name, start_date, end_date, **kwargs)
+
+
+def monthly_account_costs(db_cursor: Any, table_name: str, start_date: datetime.date,
+                          end_date: datetime.date, **kwargs: Any) -> List[Dict[str, Any]]:
+    """Cost per account and month, see query_rollup."""
+    return query_rollup('monthly_account', db_cursor, table_name, start_date, end_date, **kwargs)
+
+
+def main() -> None:
+    """Print a rollup as CSV."""
+    parser = argparse.ArgumentParser(description='Print AWS cost rollups as CSV')
+    parser.add_argument('--rollup', choices=list(ROLLUPS), default='daily_service',
+                        help='Rollup table (default: daily_service)')
+    parser.add_argument('--start-date', type=datetime.date.fromisoformat, required=True,
+                        help='Start date in YYYY-MM-DD format')
+    parser.add_argument('--end-date', type=datetime.date.fromisoformat, required=True,
+                        help='End date in YYYY-MM-DD format (exclusive)')
+    parser.add_argument('--cost-type', default='AmortizedCost',
+                        choices=['AmortizedCost', 'BlendedCost', 'UnblendedCost'],
+                        help='Cost type (default: AmortizedCost)')
+    parser.add_argument('--accounts', nargs='+', default=None,
+                        help='Account IDs (default: all)')
+    parser.add_argument('--config', default='setup.config',
+                        help='Path to configuration file (default: setup.config)')
+    args = parser.parse_args()
+
+    db_conn, db_cur, table_name, backend = connect(args.config)
+    try:
+        rows = query_rollup(args.rollup, db_cur, table_name, args.start_date, args.end_date,
+                            args.cost_type, args.accounts, backend)
+    finally:
+        db_conn.close()
+    if rows:
+        writer = csv.DictWriter(sys.stdout, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,28 +6,151 @@
 
 import argparse
 import boto3
+from botocore.config import Config
 import configparser
 import datetime
-import json
 import logging
+import os
 import pathlib
+import queue
 import sqlite3
 import sys
+import threading
 import time
-from typing import Dict, Any, Tuple, Optional
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterable, Iterator, List, Tuple, Optional
 
 
-def aws_account_id() -> str:
+COST_TYPES = ['AmortizedCost', 'BlendedCost', 'UnblendedCost']
+EXCLUDED_KEY = {'Tax'}
+
+# column order of the rows built by cost_rows
+COST_COLUMNS = ('timestamp', 'account_id', 'time_period', 'aws_service',
+                'cost_type', 'usage_type', 'amount')
+
+# rows per executemany / execute_values call, all calls share one transaction
+WRITE_BATCH_SIZE = 5000
+
+# month windows fetched concurrently from Cost Explorer
+FETCH_WORKERS = 4
+
+# pages a fetch thread can get ahead of the writer before it waits, and how often
+# a waiting thread checks whether the writer gave up
+PAGE_QUEUE_SIZE = 8
+QUEUE_POLL_SECONDS = 1.0
+
+# end of a page queue, a fetch error is queued instead
+QUEUE_DONE = object()
+
+# one row per account, day, service, usage type and cost type, rewritten on upsert
+COST_KEY = ('account_id', 'time_period', 'aws_service', 'usage_type', 'cost_type')
+
+# days before the latest stored day that --sync fetches again, Cost Explorer
+# keeps revising recent days until they settle
+SYNC_LOOKBACK_DAYS = 3
+
+# rows per multi-row INSERT for DuckDB, its executemany runs one statement per row
+DUCKDB_INSERT_ROWS = 1000
+
+# DuckDB amounts, Cost Explorer returns up to 10 decimal places
+DUCKDB_AMOUNT_TYPE = 'DECIMAL(20, 10)'
+
+# rollup tables <table>_<name>, keyed on account_id, time_period and the grouping
+# columns - (period, grouping columns), period is the day or the first of the month
+ROLLUPS = {
+    'daily_service': ('day', ('aws_service', 'cost_type')),
+    'monthly_service': ('month', ('aws_service', 'cost_type')),
+    'monthly_account': ('month', ('cost_type',)),
+}
+
+# accounts collected concurrently, and Cost Explorer calls per second per account
+ACCOUNT_WORKERS = 4
+REQUESTS_PER_SECOND = 2.0
+
+# back off and retry when Cost Explorer throttles (ThrottlingException, LimitExceeded)
+CE_CLIENT_CONFIG = Config(retries={'max_attempts': 10, 'mode': 'adaptive'})
+
+
+def aws_account_id(session: Any = None) -> str:
     """Get AWS account number.
     
+    Args:
+        session: boto3 Session of the account (default: the default session)
+    
     Returns:
         str: AWS account ID
     """
-    sts = boto3.client("sts")
+    sts = (session or boto3).client("sts")
     account_id = sts.get_caller_identity()["Account"]
     return account_id
 
 
+class RateLimiter:
+    """Spaces calls at least 1 / rate seconds apart, shared by threads."""
+
+    def __init__(self, rate: float) -> None:
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_call = 0.0
+
+    def wait(self) -> None:
+        """Block until the next call is allowed."""
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class ThrottledCostExplorer:
+    """Cost Explorer client that waits on a RateLimiter before each call."""
+
+    def __init__(self, client: Any, limiter: RateLimiter) -> None:
+        self.client = client
+        self.limiter = limiter
+
+    def get_cost_and_usage(self, **kwargs: Any) -> Dict[str, Any]:
+        """get_cost_and_usage once the limiter allows it."""
+        self.limiter.wait()
+        return self.client.get_cost_and_usage(**kwargs)
+
+
+def account_specs(profiles: List[str], role_arns: List[str]) -> List[Dict[str, Optional[str]]]:
+    """Accounts to collect, the caller's own account if none are given.
+    
+    Args:
+        profiles: AWS CLI profile names
+        role_arns: IAM roles assumed with the default credentials
+        
+    Returns:
+        List[dict]: {'name', 'profile', 'role_arn'} per account
+    """
+    specs = [{'name': profile, 'profile': profile, 'role_arn': None} for profile in profiles]
+    specs += [{'name': role_arn, 'profile': None, 'role_arn': role_arn} for role_arn in role_arns]
+    return specs or [{'name': 'default', 'profile': None, 'role_arn': None}]
+
+
+def account_session(spec: Dict[str, Optional[str]]) -> Any:
+    """boto3 Session for an account spec, created in the thread that uses it.
+    
+    Args:
+        spec: Account from account_specs
+        
+    Returns:
+        boto3.Session: Session with the profile or assumed role credentials
+    """
+    if spec['role_arn']:
+        # a Session per thread, boto3.client() shares the default Session, which isn't thread safe
+        credentials = boto3.Session().client('sts').assume_role(
+            RoleArn=spec['role_arn'], RoleSessionName='awscosts')['Credentials']
+        return boto3.Session(aws_access_key_id=credentials['AccessKeyId'],
+                             aws_secret_access_key=credentials['SecretAccessKey'],
+                             aws_session_token=credentials['SessionToken'])
+    return boto3.Session(profile_name=spec['profile'])
+
+
 def read_config(file_path: str) -> configparser.RawConfigParser:
     """Read configuration file.
     
@@ -68,6 +191,8 @@ def sqlite_connection(p_config: configparser.RawConfigParser) -> Tuple[Any, Any,
     # Validate that required fields are not empty
     if not db_path:
         raise ValueError("Missing required database configuration: db_path")
+    if not table_name:
+        raise ValueError("Missing required database configuration: tablename")
     
     try:
         sqlite_conn = sqlite3.connect(db_path)
@@ -78,36 +203,229 @@ def sqlite_connection(p_config: configparser.RawConfigParser) -> Tuple[Any, Any,
         raise
 
 
-def db_write(table_name: str, dataobject: Dict[str, Any], sqlite_cursor: Any) -> None:
-    """Write data to database table.
+def psql_connection(p_config: configparser.RawConfigParser) -> Tuple[Any, Any, str]:
+    """Connect to PostgreSQL database.
     
     Args:
-        table_name: Name of the table to insert data into
-        dataobject: Dictionary containing data to insert
-        sqlite_cursor: SQLite cursor object
+        p_config: Configuration object with a [psqldb] section
+        
+    Returns:
+        Tuple[connection, cursor, table_name]: PostgreSQL connection, cursor, and table name
         
     Raises:
-        sqlite3.Error: If database operation fails
+        psycopg2.Error: If connection fails
     """
-    cols = ', '.join(dataobject.keys())
-    placeholders = ', '.join(['?' for _ in dataobject.values()])
-    query = f"INSERT INTO {table_name} ({cols}) VALUES ({placeholders})"
+    import psycopg2
+
+    table_name = p_config.get('psqldb', 'tablename')
     try:
-        sqlite_cursor.execute(query, tuple(dataobject.values()))
-        sqlite_cursor.connection.commit()
-    except sqlite3.Error as e:
-        logging.error(f"Unable to execute query or commit for table {table_name} - {e}")
+        psql_conn = psycopg2.connect(host=p_config.get('psqldb', 'host'),
+                                     port=p_config.get('psqldb', 'port'),
+                                     dbname=p_config.get('psqldb', 'dbname'),
+                                     user=p_config.get('psqldb', 'dbuser'),
+                                     password=p_config.get('psqldb', 'dbuserpass'))
+        return psql_conn, psql_conn.cursor(), table_name
+    except psycopg2.Error as e:
+        logging.error(f"Error connecting to PostgreSQL: {e}")
         raise
 
 
+class DuckDBCursor:
+    """DuckDB connection with the cursor behaviour the writers rely on.
+    
+    Statements run in a transaction that is opened on first use and ended by
+    connection.commit() / connection.rollback(), like sqlite3 and psycopg2.
+    """
+
+    def __init__(self, duck_conn: Any) -> None:
+        self.duck_conn = duck_conn
+        self.connection = self
+        self.in_transaction = False
+
+    @property
+    def rowcount(self) -> int:
+        """Rows changed by the last statement, -1 if unknown."""
+        return self.duck_conn.rowcount
+
+    def execute(self, sql: str, params: Optional[Iterable[Any]] = None) -> 'DuckDBCursor':
+        """Run a statement inside the current transaction."""
+        if not self.in_transaction:
+            self.duck_conn.begin()
+            self.in_transaction = True
+        self.duck_conn.execute(sql, list(params or []))
+        return self
+
+    def fetchone(self) -> Optional[Tuple]:
+        """Next row of the last query."""
+        return self.duck_conn.fetchone()
+
+    def fetchall(self) -> List[Tuple]:
+        """Remaining rows of the last query."""
+        return self.duck_conn.fetchall()
+
+    def commit(self) -> None:
+        """Commit the open transaction, if any."""
+        if self.in_transaction:
+            self.duck_conn.commit()
+            self.in_transaction = False
+
+    def rollback(self) -> None:
+        """Roll back the open transaction, if any."""
+        if self.in_transaction:
+            self.duck_conn.rollback()
+            self.in_transaction = False
+
+    def close(self) -> None:
+        """Commit what is left, the connection is closed by its owner."""
+        self.commit()
+
+
+def duckdb_connection(p_config: configparser.RawConfigParser) -> Tuple[Any, Any, str]:
+    """Connect to DuckDB database file.
+    
+    Args:
+        p_config: Configuration object with a [duckdb] section
+        
+    Returns:
+        Tuple[connection, cursor, table_name]: DuckDB connection, DuckDBCursor, and table name
+        
+    Raises:
+        ValueError: If configuration values are missing
+    """
+    import duckdb
+
+    db_path = p_config.get('duckdb', 'db_path')
+    table_name = p_config.get('duckdb', 'tablename')
+    if not db_path or not table_name:
+        raise ValueError("Missing required database configuration: db_path, tablename")
+    duck_conn = duckdb.connect(db_path)
+    return duck_conn, DuckDBCursor(duck_conn), table_name
+
+
+def storage_backend(p_config: configparser.RawConfigParser) -> str:
+    """Backend selected in setup.config.
+    
+    Args:
+        p_config: Configuration object
+        
+    Returns:
+        str: 'sqlite' (default), 'postgres' or 'duckdb'
+    """
+    return p_config.get('storage', 'backend', fallback='sqlite')
+
+
+def db_connection(p_config: configparser.RawConfigParser, backend: str) -> Tuple[Any, Any, str]:
+    """Connect to the configured database.
+    
+    Args:
+        p_config: Configuration object containing database settings
+        backend: 'sqlite', 'postgres' or 'duckdb'
+        
+    Returns:
+        Tuple[connection, cursor, table_name]: Connection, cursor, and table name
+    """
+    if backend == 'postgres':
+        return psql_connection(p_config)
+    if backend == 'duckdb':
+        return duckdb_connection(p_config)
+    return sqlite_connection(p_config)
+
+
+def parquet_path(p_config: configparser.RawConfigParser, backend: str) -> Optional[str]:
+    """Directory for the Parquet copy of the costs table, DuckDB only.
+    
+    Args:
+        p_config: Configuration object
+        backend: Selected backend
+        
+    Returns:
+        Optional[str]: [duckdb] parquet_path, None if not set
+    """
+    if backend != 'duckdb':
+        return None
+    return p_config.get('duckdb', 'parquet_path', fallback='') or None
+
+
+def db_write_rows(
+    table_name: str,
+    rows: List[Tuple],
+    db_cursor: Any,
+    backend: str = 'sqlite'
+) -> int:
+    """Upsert rows in COST_COLUMNS order with one statement per batch, no commit.
+    
+    Rows already stored under COST_KEY get the new amount and timestamp.
+    
+    Args:
+        table_name: Name of the table to insert data into
+        rows: Tuples in COST_COLUMNS order
+        db_cursor: SQLite, PostgreSQL or DuckDB cursor object
+        backend: 'sqlite' (executemany), 'postgres' (execute_values)
+            or 'duckdb' (multi-row VALUES)
+        
+    Returns:
+        int: Number of rows inserted
+    """
+    if not rows:
+        return 0
+    cols = ', '.join(COST_COLUMNS)
+    upsert = (f"ON CONFLICT ({', '.join(COST_KEY)}) "
+              f"DO UPDATE SET amount = excluded.amount, timestamp = excluded.timestamp")
+    if backend in ('postgres', 'duckdb'):
+        # a key can only be upserted once per statement
+        key_index = [COST_COLUMNS.index(col) for col in COST_KEY]
+        rows = list({tuple(row[i] for i in key_index): row for row in rows}.values())
+    if backend == 'postgres':
+        from psycopg2.extras import execute_values
+        execute_values(db_cursor, f"INSERT INTO {table_name} ({cols}) VALUES %s {upsert}",
+                       rows, page_size=len(rows))
+    elif backend == 'duckdb':
+        placeholders = f"({', '.join(['?' for _ in COST_COLUMNS])})"
+        for i in range(0, len(rows), DUCKDB_INSERT_ROWS):
+            chunk = rows[i:i + DUCKDB_INSERT_ROWS]
+            db_cursor.execute(
+                f"INSERT INTO {table_name} ({cols}) VALUES "
+                f"{', '.join([placeholders] * len(chunk))} {upsert}",
+                [value for row in chunk for value in row])
+    else:
+        placeholders = ', '.join(['?' for _ in COST_COLUMNS])
+        db_cursor.executemany(
+            f"INSERT INTO {table_name} ({cols}) VALUES ({placeholders}) {upsert}", rows)
+    return len(rows)
+
+
+def month_windows(
+    start_date: datetime.date,
+    end_date: datetime.date
+) -> List[Tuple[datetime.date, datetime.date]]:
+    """Split [start_date, end_date) at month boundaries.
+    
+    Args:
+        start_date: Start date for cost data
+        end_date: End date for cost data (exclusive)
+        
+    Returns:
+        List[Tuple[date, date]]: (start, exclusive end) per calendar month
+    """
+    windows = []
+    window_start = start_date
+    while window_start < end_date:
+        next_month = (window_start.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+        window_end = min(next_month, end_date)
+        windows.append((window_start, window_end))
+        window_start = window_end
+    return windows
+
+
 def fetch_aws_costs(
     start_date: datetime.date, 
     end_date: datetime.date,
     granularity: str = 'DAILY',
     metrics: Optional[list] = None,
-    group_by: Optional[list] = None
-) -> Dict[str, Any]:
-    """Fetch AWS cost and usage data.
+    group_by: Optional[list] = None,
+    ce_client: Any = None
+) -> Iterator[Dict[str, Any]]:
+    """Fetch AWS cost and usage data one page at a time, following NextPageToken.
     
     Args:
         start_date: Start date for cost data
@@ -115,12 +433,13 @@ def fetch_aws_costs(
         granularity: Granularity of data (DAILY, MONTHLY, etc.)
         metrics: List of metrics to retrieve
         group_by: List of dimensions to group by
+        ce_client: Cost Explorer client (default: boto3.client('ce'))
         
-    Returns:
-        dict: AWS cost and usage response
+    Yields:
+        dict: AWS cost and usage response page
     """
     if metrics is None:
-        metrics = ['AmortizedCost', 'BlendedCost', 'UnblendedCost']
+        metrics = COST_TYPES
         
     if group_by is None:
         group_by = [
@@ -128,67 +447,299 @@ def fetch_aws_costs(
             {'Type': 'DIMENSION', 'Key': 'USAGE_TYPE'}
         ]
     
-    boto_client = boto3.client('ce')  # AWS cost explorer
-    time_period = {
-        'Start': str(start_date),
-        'End': str(end_date)  # exclusive
+    boto_client = ce_client or boto3.client('ce')  # AWS cost explorer
+    request = {
+        'TimePeriod': {
+            'Start': str(start_date),
+            'End': str(end_date)  # exclusive
+        },
+        'Granularity': granularity,
+        'Metrics': metrics,
+        'GroupBy': group_by
     }
     
-    response = boto_client.get_cost_and_usage(
-        TimePeriod=time_period,
-        Granularity=granularity,
-        Metrics=metrics,
-        GroupBy=group_by
-    )
+    pages = 0
+    while True:
+        response = boto_client.get_cost_and_usage(**request)
+        pages += 1
+        yield response
+        if not response.get('NextPageToken'):
+            break
+        request['NextPageToken'] = response['NextPageToken']
+    logging.info(f"Fetched {pages} page(s) for {start_date} to {end_date}")
+
+
+def put_page(page_queue: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    """Put an item on a bounded queue, waiting while it is full.
+    
+    Args:
+        page_queue: Queue read by the writer
+        item: Page, QUEUE_DONE or the exception that ended the fetch
+        stop: Set when the writer stops reading
+        
+    Returns:
+        bool: False if stop was set before there was room
+    """
+    while not stop.is_set():
+        try:
+            page_queue.put(item, timeout=QUEUE_POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def queue_pages(pages: Iterable[Any], page_queue: queue.Queue, stop: threading.Event) -> None:
+    """Run in a fetch thread - queue pages as they arrive, then QUEUE_DONE or the error.
     
-    return json.loads(json.dumps(response))
+    Args:
+        pages: Page iterator, e.g. fetch_aws_costs
+        page_queue: Bounded queue read with drain_pages
+        stop: Set when the writer stops reading
+    """
+    try:
+        for page in pages:
+            if not put_page(page_queue, page, stop):
+                return
+        end = QUEUE_DONE
+    except Exception as e:
+        end = e
+    put_page(page_queue, end, stop)
 
 
-def process_and_store_costs(
-    response: Dict[str, Any],
-    table_name: str,
-    account_id: str,
-    timestamp: int,
-    sqlite_cursor: Any
-) -> None:
-    """Process AWS cost response and store in database.
+def drain_pages(page_queue: queue.Queue) -> Iterator[Any]:
+    """Yield pages from a queue filled by queue_pages.
     
     Args:
-        response: AWS cost and usage response
-        table_name: Name of the database table
+        page_queue: Queue filled by queue_pages
+        
+    Yields:
+        Any: Pages in the order they were fetched
+        
+    Raises:
+        Exception: The error that ended the fetch
+    """
+    while True:
+        item = page_queue.get()
+        if item is QUEUE_DONE:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+def fetch_cost_pages(
+    start_date: datetime.date,
+    end_date: datetime.date,
+    workers: int = FETCH_WORKERS,
+    ce_client: Any = None,
+    **fetch_args: Any
+) -> Iterator[Dict[str, Any]]:
+    """Fetch a long range as month windows, up to workers windows at a time.
+    
+    Windows are yielded in date order and pages are streamed as they arrive. With
+    several workers each window is fetched into its own queue of PAGE_QUEUE_SIZE
+    pages, so at most workers x PAGE_QUEUE_SIZE pages wait for the writer.
+    
+    Args:
+        start_date: Start date for cost data
+        end_date: End date for cost data (exclusive)
+        workers: Month windows fetched concurrently
+        ce_client: Cost Explorer client shared by the threads (boto3 clients are thread safe)
+        **fetch_args: granularity, metrics, group_by for fetch_aws_costs
+        
+    Yields:
+        dict: AWS cost and usage response page
+    """
+    windows = month_windows(start_date, end_date)
+    if workers <= 1 or len(windows) <= 1:
+        for window_start, window_end in windows:
+            yield from fetch_aws_costs(window_start, window_end, ce_client=ce_client,
+                                       **fetch_args)
+        return
+
+    boto_client = ce_client or boto3.client('ce')
+    stop = threading.Event()
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ce_fetch') as executor:
+        try:
+            for window_start, window_end in windows:
+                page_queue = queue.Queue(maxsize=PAGE_QUEUE_SIZE)
+                executor.submit(queue_pages, fetch_aws_costs(window_start, window_end,
+                                                             ce_client=boto_client, **fetch_args),
+                                page_queue, stop)
+                in_flight.append(page_queue)
+                # keep at most workers windows fetched ahead of the writer
+                if len(in_flight) >= workers:
+                    yield from drain_pages(in_flight.popleft())
+            while in_flight:
+                yield from drain_pages(in_flight.popleft())
+        finally:
+            # a failed write or fetch releases the threads still waiting to queue pages
+            stop.set()
+
+
+def cost_rows(response: Dict[str, Any], account_id: str, timestamp: int) -> Iterator[Tuple]:
+    """Flatten an AWS cost response page into rows.
+    
+    Args:
+        response: AWS cost and usage response page
         account_id: AWS account ID
         timestamp: Timestamp for the data collection
-        sqlite_cursor: SQLite cursor object
+        
+    Yields:
+        Tuple: One row per group and cost type, in COST_COLUMNS order
     """
-    EXCLUDED_KEY = {'Tax'}
-    
     for groups_key in response['ResultsByTime']:
         time_period = groups_key['TimePeriod']['Start']
         for aws_service_key_name in groups_key['Groups']:
             if aws_service_key_name['Keys'][0] not in EXCLUDED_KEY:
                 aws_service = aws_service_key_name['Keys'][0]
                 usage_type = aws_service_key_name['Keys'][1]
-                for cost_type in ['AmortizedCost', 'BlendedCost', 'UnblendedCost']:
+                for cost_type in COST_TYPES:
                     amount_usd = aws_service_key_name['Metrics'][cost_type]['Amount']
-                    db_object = {
-                        'timestamp': timestamp,
-                        'account_id': account_id,
-                        'time_period': time_period,
-                        'aws_service': aws_service,
-                        'cost_type': cost_type,
-                        'usage_type': usage_type,
-                        'amount': amount_usd
-                    }
-                    db_write(table_name, db_object, sqlite_cursor)
-
-
-def create_table_if_not_exists(table_name: str, sqlite_cursor: Any) -> None:
+                    yield (timestamp, account_id, time_period, aws_service,
+                           cost_type, usage_type, amount_usd)
+
+
+def store_rows(
+    rows: Iterable[Tuple],
+    table_name: str,
+    db_cursor: Any,
+    backend: str = 'sqlite',
+    batch_size: int = WRITE_BATCH_SIZE,
+    commit: bool = True
+) -> int:
+    """Write rows in batches of batch_size, committed once at the end.
+    
+    Args:
+        rows: Tuples in COST_COLUMNS order
+        table_name: Name of the database table
+        db_cursor: SQLite, PostgreSQL or DuckDB cursor object
+        backend: 'sqlite', 'postgres' or 'duckdb'
+        batch_size: Rows per insert statement
+        commit: False to leave the transaction open for the caller
+        
+    Returns:
+        int: Number of rows written
+        
+    Raises:
+        Exception: If the insert fails, after rolling back the whole load
+    """
+    written = 0
+    batch = []
+    try:
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                written += db_write_rows(table_name, batch, db_cursor, backend)
+                batch = []
+        written += db_write_rows(table_name, batch, db_cursor, backend)
+        if commit:
+            db_cursor.connection.commit()
+    except Exception as e:
+        db_cursor.connection.rollback()
+        logging.error(f"Unable to insert or commit for table {table_name} - {e}")
+        raise
+    return written
+
+
+def process_and_store_costs(
+    pages: Iterable[Dict[str, Any]],
+    table_name: str,
+    account_id: str,
+    timestamp: int,
+    db_cursor: Any,
+    backend: str = 'sqlite',
+    parquet_dir: Optional[str] = None
+) -> int:
+    """Process AWS cost response pages and store in database in one transaction.
+    
+    The rollups of the days and months loaded are refreshed in the same transaction.
+    With parquet_dir (DuckDB), the months loaded are then exported to Parquet.
+    
+    Args:
+        pages: AWS cost and usage response pages, written as they arrive
+        table_name: Name of the database table
+        account_id: AWS account ID
+        timestamp: Timestamp for the data collection
+        db_cursor: SQLite, PostgreSQL or DuckDB cursor object
+        backend: 'sqlite', 'postgres' or 'duckdb'
+        parquet_dir: Directory for export_parquet
+        
+    Returns:
+        int: Number of rows written
+    """
+    start = time.perf_counter()
+    days = set()
+
+    def tracked_rows() -> Iterator[Tuple]:
+        for page in pages:
+            for row in cost_rows(page, account_id, timestamp):
+                days.add(row[2])
+                yield row
+
+    written = store_rows(tracked_rows(), table_name, db_cursor, backend, commit=False)
+    try:
+        if days:
+            refresh_rollups(table_name, db_cursor, backend, account_id, min(days), max(days))
+        db_cursor.connection.commit()
+    except Exception as e:
+        db_cursor.connection.rollback()
+        logging.error(f"Unable to refresh rollups of table {table_name} - {e}")
+        raise
+    if parquet_dir and days:
+        export_parquet(table_name, db_cursor, account_id, min(days), max(days), parquet_dir)
+    elapsed = time.perf_counter() - start
+    logging.info(f"Stored {written} rows in {table_name} in {elapsed:.2f}s "
+                 f"({written / elapsed if elapsed else 0:.0f} rows/second)")
+    return written
+
+
+def create_table_if_not_exists(table_name: str, db_cursor: Any, backend: str = 'sqlite') -> None:
     """Create the costs table if it doesn't exist.
     
     Args:
         table_name: Name of the table to create
-        sqlite_cursor: SQLite cursor object
+        db_cursor: SQLite, PostgreSQL or DuckDB cursor object
+        backend: 'sqlite', 'postgres' (schema of cost_explorer_db.sql) or 'duckdb'
     """
+    if backend == 'duckdb':
+        # columnar, DuckDB dictionary-compresses the repeated VARCHAR dimensions;
+        # the primary key is the COST_KEY the upserts use
+        db_cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table_name} (
+            timestamp BIGINT NOT NULL,
+            account_id VARCHAR NOT NULL,
+            time_period DATE NOT NULL,
+            aws_service VARCHAR NOT NULL,
+            cost_type VARCHAR NOT NULL,
+            usage_type VARCHAR NOT NULL,
+            amount {DUCKDB_AMOUNT_TYPE} NOT NULL,
+            PRIMARY KEY ({', '.join(COST_KEY)})
+        )
+        """)
+        db_cursor.connection.commit()
+        create_rollup_tables(table_name, db_cursor, backend)
+        return
+
+    if backend == 'postgres':
+        db_cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table_name} (
+            timestamp bigint NOT NULL,
+            account_id text NOT NULL,
+            time_period DATE NOT NULL,
+            aws_service text NOT NULL,
+            cost_type text NOT NULL,
+            usage_type text NOT NULL,
+            amount decimal NOT NULL
+        )
+        """)
+        db_cursor.connection.commit()
+        create_cost_key(table_name, db_cursor, backend)
+        create_rollup_tables(table_name, db_cursor, backend)
+        return
+
     create_table_sql = f"""
     CREATE TABLE IF NOT EXISTS {table_name} (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -203,11 +754,346 @@ def create_table_if_not_exists(table_name: str, sqlite_cursor: Any) -> None:
     )
     """
     try:
-        sqlite_cursor.execute(create_table_sql)
-        sqlite_cursor.connection.commit()
+        db_cursor.execute(create_table_sql)
+        db_cursor.connection.commit()
     except sqlite3.Error as e:
         logging.error(f"Error creating table {table_name} - {e}")
         raise
+    create_cost_key(table_name, db_cursor, backend)
+    create_rollup_tables(table_name, db_cursor, backend)
+
+
+def create_cost_key(table_name: str, db_cursor: Any, backend: str = 'sqlite') -> None:
+    """Add the COST_KEY unique index, removing duplicates left by earlier runs first.
+    
+    Of each set of duplicates the most recently written row is kept.
+    
+    Args:
+        table_name: Name of the costs table
+        db_cursor: SQLite, PostgreSQL or DuckDB cursor object
+        backend: 'sqlite', 'postgres' or 'duckdb'
+    """
+    index_name = f"{table_name}_cost_key"
+    key_cols = ', '.join(COST_KEY)
+    if backend == 'postgres':
+        db_cursor.execute("SELECT to_regclass(%s)", (index_name,))
+        if db_cursor.fetchone()[0]:
+            return
+        key_match = ' AND '.join(f"a.{col} = b.{col}" for col in COST_KEY)
+        db_cursor.execute(f"""
+        DELETE FROM {table_name} a USING {table_name} b
+        WHERE {key_match} AND (a.timestamp, a.ctid) < (b.timestamp, b.ctid)
+        """)
+    else:
+        db_cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?",
+                          (index_name,))
+        if db_cursor.fetchone():
+            return
+        db_cursor.execute(f"""
+        DELETE FROM {table_name} WHERE id NOT IN
+            (SELECT MAX(id) FROM {table_name} GROUP BY {key_cols})
+        """)
+    if db_cursor.rowcount > 0:
+        logging.info(f"Removed {db_cursor.rowcount} duplicate rows from {table_name}")
+    db_cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON {table_name} ({key_cols})")
+    db_cursor.connection.commit()
+
+
+def period_expression(period: str, backend: str = 'sqlite') -> str:
+    """SQL for the rollup time_period of a raw row.
+    
+    Args:
+        period: 'day' or 'month'
+        backend: 'sqlite' (ISO date text), 'postgres' or 'duckdb' (DATE)
+        
+    Returns:
+        str: time_period, or the first day of its month
+    """
+    if period == 'day':
+        return 'time_period'
+    if backend in ('postgres', 'duckdb'):
+        return "CAST(date_trunc('month', time_period) AS date)"
+    return "substr(time_period, 1, 7) || '-01'"
+
+
+def create_rollup_tables(table_name: str, db_cursor: Any, backend: str = 'sqlite') -> None:
+    """Create the ROLLUPS tables, filling them from the costs table when new.
+    
+    Each primary key starts with (account_id, time_period), which serves range
+    queries per account.
+    
+    Args:
+        table_name: Name of the costs table
+        db_cursor: SQLite, PostgreSQL or DuckDB cursor object
+        backend: 'sqlite', 'postgres' or 'duckdb'
+    """
+    date_type, amount_type = {'postgres': ('DATE', 'decimal'),
+                              'duckdb': ('DATE', DUCKDB_AMOUNT_TYPE)}.get(backend, ('TEXT', 'REAL'))
+    for rollup, (_, group_cols) in ROLLUPS.items():
+        key_cols = ', '.join(('account_id', 'time_period') + group_cols)
+        col_defs = ''.join(f"{col} TEXT NOT NULL, " for col in group_cols)
+        db_cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table_name}_{rollup} (
+            account_id TEXT NOT NULL,
+            time_period {date_type} NOT NULL,
+            {col_defs}amount {amount_type} NOT NULL,
+            PRIMARY KEY ({key_cols})
+        )
+        """)
+    db_cursor.execute(f"SELECT 1 FROM {table_name}_daily_service LIMIT 1")
+    if not db_cursor.fetchone():
+        db_cursor.execute(f"SELECT 1 FROM {table_name} LIMIT 1")
+        if db_cursor.fetchone():
+            logging.info(f"Building rollups of {table_name}")
+            refresh_rollups(table_name, db_cursor, backend)
+    db_cursor.connection.commit()
+
+
+def refresh_rollups(
+    table_name: str,
+    db_cursor: Any,
+    backend: str = 'sqlite',
+    account_id: Optional[str] = None,
+    first_day: Optional[str] = None,
+    last_day: Optional[str] = None
+) -> None:
+    """Recompute rollup rows of the days, and whole months, between first_day and last_day.
+    
+    Without account_id and days every rollup row is rebuilt. No commit.
+    
+    Args:
+        table_name: Name of the costs table
+        db_cursor: SQLite, PostgreSQL or DuckDB cursor object
+        backend: 'sqlite', 'postgres' or 'duckdb'
+        account_id: Account that was loaded, None for all accounts
+        first_day: First day loaded, YYYY-MM-DD
+        last_day: Last day loaded, YYYY-MM-DD
+    """
+    placeholder = '%s' if backend == 'postgres' else '?'
+    for rollup, (period, group_cols) in ROLLUPS.items():
+        conditions = []
+        params = []
+        if account_id is not None:
+            conditions.append(f"account_id = {placeholder}")
+            params.append(account_id)
+        if first_day is not None:
+            start = datetime.date.fromisoformat(str(first_day))
+            end = datetime.date.fromisoformat(str(last_day)) + datetime.timedelta(days=1)
+            if period == 'month':
+                # whole months, the exclusive end moves to the next first of a month
+                start = start.replace(day=1)
+                if end.day != 1:
+                    end = (end.replace(day=1) + datetime.timedelta(days=31)).replace(day=1)
+            conditions.append(f"time_period >= {placeholder} AND time_period < {placeholder}")
+            params += [str(start), str(end)]
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        cols = ', '.join(('account_id', 'time_period') + group_cols)
+        select_cols = ', '.join(('account_id', period_expression(period, backend)) + group_cols)
+        db_cursor.execute(f"DELETE FROM {table_name}_{rollup} {where}", params)
+        db_cursor.execute(f"""
+        INSERT INTO {table_name}_{rollup} ({cols}, amount)
+        SELECT {select_cols}, SUM(amount) FROM {table_name} {where}
+        GROUP BY {select_cols}
+        """, params)
+
+
+def export_parquet(
+    table_name: str,
+    db_cursor: Any,
+    account_id: str,
+    first_day: str,
+    last_day: str,
+    parquet_dir: str
+) -> List[str]:
+    """Rewrite the Parquet files of an account's months between first_day and last_day.
+    
+    One file per partition, <parquet_dir>/account_id=<id>/month=<YYYY-MM>/costs.parquet,
+    readable with read_parquet('<parquet_dir>/*/*/*.parquet', hive_partitioning = true).
+    Parquet dictionary-encodes the string columns and keeps amount as DECIMAL.
+    
+    Args:
+        table_name: Name of the DuckDB costs table
+        db_cursor: DuckDBCursor
+        account_id: AWS account ID
+        first_day: First day loaded, YYYY-MM-DD
+        last_day: Last day loaded, YYYY-MM-DD
+        parquet_dir: Root directory of the partitioned Parquet files
+        
+    Returns:
+        List[str]: Files written
+    """
+    files = []
+    last = datetime.date.fromisoformat(str(last_day))
+    first_month = datetime.date.fromisoformat(str(first_day)).replace(day=1)
+    for month_start, _ in month_windows(first_month, last + datetime.timedelta(days=1)):
+        # whole months, a partition file holds the entire month
+        month_end = (month_start + datetime.timedelta(days=31)).replace(day=1)
+        partition_dir = os.path.join(parquet_dir, f"account_id={account_id}",
+                                     f"month={month_start:%Y-%m}")
+        os.makedirs(partition_dir, exist_ok=True)
+        parquet_file = os.path.join(partition_dir, 'costs.parquet')
+        # COPY takes no parameters, the account ID is quoted as a literal
+        account_literal = account_id.replace("'", "''")
+        db_cursor.execute(f"""
+        COPY (SELECT timestamp, time_period, aws_service, cost_type, usage_type, amount
+              FROM {table_name}
+              WHERE account_id = '{account_literal}'
+                AND time_period >= DATE '{month_start}' AND time_period < DATE '{month_end}'
+              ORDER BY time_period, aws_service, usage_type, cost_type)
+        TO '{parquet_file.replace("'", "''")}' (FORMAT PARQUET, COMPRESSION ZSTD)
+        """)
+        files.append(parquet_file)
+    db_cursor.connection.commit()
+    logging.info(f"Exported {len(files)} Parquet partition(s) of {account_id} to {parquet_dir}")
+    return files
+
+
+def latest_time_periods(table_name: str, db_cursor: Any) -> Dict[str, datetime.date]:
+    """Latest day stored per account.
+    
+    Args:
+        table_name: Name of the costs table
+        db_cursor: SQLite, PostgreSQL or DuckDB cursor object
+        
+    Returns:
+        Dict[str, datetime.date]: Latest time_period by account_id
+    """
+    db_cursor.execute(f"SELECT account_id, MAX(time_period) FROM {table_name} GROUP BY account_id")
+    return {account_id: latest if isinstance(latest, datetime.date)
+            else datetime.date.fromisoformat(latest)
+            for account_id, latest in db_cursor.fetchall()}
+
+
+def sync_window(
+    latest: Optional[datetime.date],
+    today: datetime.date,
+    default_start: datetime.date,
+    lookback_days: int = SYNC_LOOKBACK_DAYS
+) -> Tuple[datetime.date, datetime.date]:
+    """Days to fetch so the table catches up to yesterday.
+    
+    Args:
+        latest: Latest stored time_period of the account, None if nothing is stored
+        today: Current date (UTC), the exclusive end
+        default_start: Start date when nothing is stored
+        lookback_days: Stored days before latest that are fetched again
+        
+    Returns:
+        Tuple[date, date]: (start, exclusive end), empty when start >= end
+    """
+    if latest is None:
+        return default_start, today
+    return latest - datetime.timedelta(days=lookback_days), today
+
+
+def fetch_account(
+    spec: Dict[str, Optional[str]],
+    start_date: datetime.date,
+    end_date: datetime.date,
+    options: Dict[str, Any]
+) -> Tuple[str, Iterator[Dict[str, Any]]]:
+    """Resolve an account and start fetching its pages.
+    
+    Args:
+        spec: Account from account_specs
+        start_date: Start date for cost data
+        end_date: End date for cost data (exclusive)
+        options: workers, requests_per_second, and for --sync latest, today, lookback_days
+        
+    Returns:
+        Tuple[str, Iterator[dict]]: AWS account ID and its response pages
+    """
+    session = account_session(spec)
+    account_id = aws_account_id(session)
+    if options.get('sync'):
+        start_date, end_date = sync_window(options['latest'].get(account_id), options['today'],
+                                           start_date, options['lookback_days'])
+    logging.info(f"Fetching costs for {spec['name']} ({account_id}) from {start_date} to {end_date}")
+    ce_client = ThrottledCostExplorer(session.client('ce', config=CE_CLIENT_CONFIG),
+                                      RateLimiter(options['requests_per_second']))
+    return account_id, fetch_cost_pages(start_date, end_date, options['workers'], ce_client)
+
+
+def collect_accounts(
+    specs: List[Dict[str, Optional[str]]],
+    start_date: datetime.date,
+    end_date: datetime.date,
+    table_name: str,
+    db_cursor: Any,
+    backend: str,
+    options: Dict[str, Any]
+) -> List[Dict[str, Any]]:
+    """Fetch accounts concurrently and store each one in its own transaction.
+    
+    Pages are fetched in up to account_workers threads, each into its own queue of
+    PAGE_QUEUE_SIZE pages, and written from this thread as they arrive, one account
+    at a time in the order given. A single account is streamed as before.
+    
+    Args:
+        specs: Accounts from account_specs
+        start_date: Start date for cost data
+        end_date: End date for cost data (exclusive)
+        table_name: Name of the database table
+        db_cursor: SQLite, PostgreSQL or DuckDB cursor object
+        backend: 'sqlite', 'postgres' or 'duckdb'
+        options: timestamp, account_workers and parquet_path, plus the fetch_account options
+        
+    Returns:
+        List[dict]: Status per account - name, account_id, status, rows, seconds, error
+    """
+    # per account fetch start, so seconds don't include the accounts written before it
+    starts: Dict[int, float] = {}
+
+    def fetch(index: int, spec: Dict[str, Optional[str]]) -> Iterator[Any]:
+        # account ID first, then the pages, all through the account's queue
+        starts[index] = time.perf_counter()
+        account_id, pages = fetch_account(spec, start_date, end_date, options)
+        yield account_id
+        yield from pages
+
+    def store(spec: Dict[str, Optional[str]], account_id: str, pages: Iterable[Dict[str, Any]],
+              start: float) -> Dict[str, Any]:
+        rows = process_and_store_costs(pages, table_name, account_id, options['timestamp'],
+                                       db_cursor, backend, options.get('parquet_path'))
+        return {'name': spec['name'], 'account_id': account_id, 'status': 'ok', 'rows': rows,
+                'seconds': round(time.perf_counter() - start, 2), 'error': None}
+
+    def failed(spec: Dict[str, Optional[str]], e: Exception, start: float) -> Dict[str, Any]:
+        logging.error(f"Error collecting costs for {spec['name']} - {e}")
+        return {'name': spec['name'], 'account_id': None, 'status': 'failed', 'rows': 0,
+                'seconds': round(time.perf_counter() - start, 2), 'error': str(e)}
+
+    statuses = []
+    if len(specs) == 1:
+        start = time.perf_counter()
+        try:
+            account_id, pages = fetch_account(specs[0], start_date, end_date, options)
+            statuses.append(store(specs[0], account_id, pages, start))
+        except Exception as e:
+            statuses.append(failed(specs[0], e, start))
+        return statuses
+
+    # one stop event per account, so a failed write only releases that account's thread
+    streams = [(spec, queue.Queue(maxsize=PAGE_QUEUE_SIZE), threading.Event()) for spec in specs]
+    with ThreadPoolExecutor(max_workers=options['account_workers'],
+                            thread_name_prefix='account') as executor:
+        try:
+            for index, (spec, page_queue, stop) in enumerate(streams):
+                executor.submit(queue_pages, fetch(index, spec), page_queue, stop)
+            for index, (spec, page_queue, stop) in enumerate(streams):
+                try:
+                    pages = drain_pages(page_queue)
+                    account_id = next(pages)
+                    statuses.append(store(spec, account_id, pages, starts[index]))
+                except Exception as e:
+                    # anything from the queue comes after the fetch thread started
+                    statuses.append(failed(spec, e, starts.get(index, time.perf_counter())))
+                finally:
+                    stop.set()
+        finally:
+            for _, _, stop in streams:
+                stop.set()
+    return statuses
 
 
 def parse_arguments() -> argparse.Namespace:
@@ -233,9 +1119,64 @@ def parse_arguments() -> argparse.Namespace:
         default='setup.config',
         help='Path to configuration file (default: setup.config)'
     )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=FETCH_WORKERS,
+        help=f'Month windows fetched concurrently (default: {FETCH_WORKERS})'
+    )
+    parser.add_argument(
+        '--sync',
+        action='store_true',
+        help='Only fetch days after the latest stored day, plus --lookback-days (ends yesterday)'
+    )
+    parser.add_argument(
+        '--lookback-days',
+        type=int,
+        default=SYNC_LOOKBACK_DAYS,
+        help=f'Stored days fetched again by --sync (default: {SYNC_LOOKBACK_DAYS})'
+    )
+    parser.add_argument(
+        '--profiles',
+        nargs='+',
+        default=None,
+        help='AWS CLI profiles to collect (default: [accounts] profiles in the config)'
+    )
+    parser.add_argument(
+        '--role-arns',
+        nargs='+',
+        default=None,
+        help='IAM roles to assume and collect (default: [accounts] role_arns in the config)'
+    )
+    parser.add_argument(
+        '--account-workers',
+        type=int,
+        default=None,
+        help=f'Accounts collected concurrently (default: {ACCOUNT_WORKERS})'
+    )
+    parser.add_argument(
+        '--requests-per-second',
+        type=float,
+        default=None,
+        help=f'Cost Explorer calls per second per account (default: {REQUESTS_PER_SECOND})'
+    )
     return parser.parse_args()
 
 
+def config_list(p_config: configparser.RawConfigParser, option: str) -> List[str]:
+    """Comma or newline separated [accounts] option.
+    
+    Args:
+        p_config: Configuration object
+        option: Option name in the [accounts] section
+        
+    Returns:
+        List[str]: Non-empty values
+    """
+    value = p_config.get('accounts', option, fallback='')
+    return [item.strip() for item in value.replace('\n', ',').split(',') if item.strip()]
+
+
 def main() -> None:
     """Main function to orchestrate AWS cost tracking."""
     # Setup logging
@@ -263,32 +1204,51 @@ def main() -> None:
     else:
         end_date = start_date + datetime.timedelta(days=30)  # Default 30 days
     
-    timestamp = int(time.time())
-    
     try:
-        # Get AWS account ID
-        account_id = aws_account_id()
-        logging.info(f"Processing AWS account: {account_id}")
-        
         # Read configuration
         p_config = read_config(args.config)
+        specs = account_specs(args.profiles or config_list(p_config, 'profiles'),
+                              args.role_arns or config_list(p_config, 'role_arns'))
+        options = {
+            'timestamp': int(time.time()),
+            'workers': args.workers,
+            'account_workers': args.account_workers or p_config.getint(
+                'accounts', 'workers', fallback=ACCOUNT_WORKERS),
+            'requests_per_second': args.requests_per_second or p_config.getfloat(
+                'accounts', 'requests_per_second', fallback=REQUESTS_PER_SECOND),
+            'sync': args.sync,
+            'lookback_days': args.lookback_days,
+            'today': datetime.datetime.now(datetime.timezone.utc).date(),
+        }
         
         # Connect to database and get table name
-        sqlite_conn, sqlite_cur, table_name = sqlite_connection(p_config)
+        backend = storage_backend(p_config)
+        db_conn, db_cur, table_name = db_connection(p_config, backend)
         
         # Create table if it doesn't exist
-        create_table_if_not_exists(table_name, sqlite_cur)
+        create_table_if_not_exists(table_name, db_cur, backend)
+        options['parquet_path'] = parquet_path(p_config, backend)
         
-        # Fetch AWS costs
-        logging.info(f"Fetching costs from {start_date} to {end_date}")
-        response = fetch_aws_costs(start_date, end_date)
+        if args.sync:
+            options['latest'] = latest_time_periods(table_name, db_cur)
         
-        # Process and store costs
-        process_and_store_costs(response, table_name, account_id, timestamp, sqlite_cur)
+        # Fetch and store AWS costs per account
+        logging.info(f"Processing {len(specs)} AWS account(s)")
+        statuses = collect_accounts(specs, start_date, end_date, table_name, db_cur, backend,
+                                    options)
         
         # Close database connection
-        sqlite_cur.close()
-        sqlite_conn.close()
+        db_cur.close()
+        db_conn.close()
+        
+        for status in statuses:
+            logging.info(f"{status['name']} ({status['account_id']}): {status['status']}, "
+                         f"{status['rows']} rows in {status['seconds']}s"
+                         + (f" - {status['error']}" if status['error'] else ''))
+        failed_accounts = [status['name'] for status in statuses if status['status'] != 'ok']
+        if failed_accounts:
+            logging.error(f"AWS cost tracking failed for: {', '.join(failed_accounts)}")
+            sys.exit(1)
         
         logging.info("Successfully completed AWS cost tracking")
         
@@ -0,0 +1,8 @@
+"""Shared setup - the cost scripts are imported from the awscosts directory
+"""
+
+import pathlib
+import sys
+
+COSTS_DIR = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(COSTS_DIR))
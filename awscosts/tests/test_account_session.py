@@ -0,0 +1,41 @@
+"""Assumed role sessions are built per thread, never from boto3's default Session
+"""
+
+import pytest
+
+import get_costs
+import get_costs_sqlite
+
+class FakeSts:
+    def assume_role(self, RoleArn, RoleSessionName):
+        return {'Credentials': {'AccessKeyId': 'AKIA', 'SecretAccessKey': 'secret',
+                                'SessionToken': 'token'}}
+
+class FakeSession:
+    """boto3.Session stand-in, records how each one was made
+    """
+
+    created = []
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        FakeSession.created.append(kwargs)
+
+    def client(self, service):
+        assert service == 'sts'
+        return FakeSts()
+
+@pytest.mark.parametrize('costs', [get_costs, get_costs_sqlite],
+                         ids=['get_costs', 'get_costs_sqlite'])
+def test_role_session_does_not_use_default_session(costs, monkeypatch):
+    FakeSession.created = []
+    monkeypatch.setattr(costs.boto3, 'Session', FakeSession)
+    monkeypatch.setattr(costs.boto3, 'client', None)
+
+    session = costs.account_session({'name': 'prod', 'profile': None,
+                                     'role_arn': 'arn:aws:iam::111111111111:role/costs'})
+
+    assert FakeSession.created == [{}, {'aws_access_key_id': 'AKIA',
+                                        'aws_secret_access_key': 'secret',
+                                        'aws_session_token': 'token'}]
+    assert session.kwargs['aws_session_token'] == 'token'
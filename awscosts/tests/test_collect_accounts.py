@@ -0,0 +1,38 @@
+"""Several accounts - each status reports that account's own time
+"""
+
+import datetime
+import time
+
+import pytest
+
+import get_costs
+import get_costs_sqlite
+
+@pytest.fixture(params=[get_costs, get_costs_sqlite], ids=['get_costs', 'get_costs_sqlite'])
+def costs(request):
+    return request.param
+
+def test_failed_account_seconds_are_its_own(costs, monkeypatch):
+    def fetch_account(spec, start_date, end_date, options):
+        if spec['name'] == 'broken':
+            raise RuntimeError('AccessDenied')
+        time.sleep(0.3)
+        return '111111111111', iter([{'ResultsByTime': []}])
+
+    # get_costs re-exports get_costs_sqlite, patch the module collect_accounts runs in
+    module_globals = costs.collect_accounts.__globals__
+    monkeypatch.setitem(module_globals, 'fetch_account', fetch_account)
+    monkeypatch.setitem(module_globals, 'process_and_store_costs',
+                        lambda pages, *args: len(list(pages)))
+
+    # one worker, so broken is fetched only after slow is done
+    specs = [{'name': 'slow'}, {'name': 'broken'}]
+    statuses = costs.collect_accounts(specs, datetime.date(2024, 1, 1), datetime.date(2024, 1, 2),
+                                      'costs', None, 'sqlite',
+                                      {'timestamp': 0, 'account_workers': 1})
+
+    assert [status['status'] for status in statuses] == ['ok', 'failed']
+    assert statuses[0]['seconds'] >= 0.3
+    assert statuses[1]['seconds'] < 0.2
+    assert statuses[1]['error'] == 'AccessDenied'
@@ -0,0 +1,89 @@
+"""Cost Explorer paging - every NextPageToken is followed, long ranges are
+    split into month windows, against a stub client
+"""
+
+import datetime
+import threading
+
+import pytest
+
+import get_costs
+import get_costs_sqlite
+
+class StubCostExplorer:
+    """get_cost_and_usage from canned pages per (Start, NextPageToken)
+        records every request, thread safe for the parallel windows
+    """
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def get_cost_and_usage(self, **request):
+        with self.lock:
+            self.requests.append(request)
+        return self.pages[(request['TimePeriod']['Start'], request.get('NextPageToken'))]
+
+def page(start, token=None):
+    group = {'Keys': ['Amazon EC2', 'BoxUsage'],
+             'Metrics': {cost_type: {'Amount': '1.5'} for cost_type in get_costs.COST_TYPES}}
+    response = {'ResultsByTime': [{'TimePeriod': {'Start': start}, 'Groups': [group]}]}
+    if token:
+        response['NextPageToken'] = token
+    return response
+
+@pytest.fixture(params=[get_costs, get_costs_sqlite], ids=['get_costs', 'get_costs_sqlite'])
+def costs(request):
+    return request.param
+
+def test_month_windows_split_at_boundaries(costs):
+    windows = costs.month_windows(datetime.date(2024, 1, 20), datetime.date(2024, 3, 5))
+
+    assert windows == [(datetime.date(2024, 1, 20), datetime.date(2024, 2, 1)),
+                       (datetime.date(2024, 2, 1), datetime.date(2024, 3, 1)),
+                       (datetime.date(2024, 3, 1), datetime.date(2024, 3, 5))]
+    assert costs.month_windows(datetime.date(2024, 1, 1), datetime.date(2024, 1, 1)) == []
+
+def test_follows_every_page_token(costs):
+    stub = StubCostExplorer({('2024-01-01', None): page('2024-01-01', 'p2'),
+                             ('2024-01-01', 'p2'): page('2024-01-01', 'p3'),
+                             ('2024-01-01', 'p3'): page('2024-01-01')})
+
+    pages = list(costs.fetch_aws_costs(datetime.date(2024, 1, 1), datetime.date(2024, 1, 10),
+                                       ce_client=stub))
+
+    assert len(pages) == 3
+    assert [request.get('NextPageToken') for request in stub.requests] == [None, 'p2', 'p3']
+    assert {request['TimePeriod']['End'] for request in stub.requests} == {'2024-01-10'}
+
+def test_empty_final_page(costs):
+    # Cost Explorer can return a token whose page has no results
+    stub = StubCostExplorer({('2024-01-01', None): page('2024-01-01', 'p2'),
+                             ('2024-01-01', 'p2'): {'ResultsByTime': []}})
+
+    pages = list(costs.fetch_aws_costs(datetime.date(2024, 1, 1), datetime.date(2024, 1, 10),
+                                       ce_client=stub))
+
+    assert len(pages) == 2
+    assert sum(len(list(costs.cost_rows(response, '123', 0))) for response in pages) == \
+        len(costs.COST_TYPES)
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_window_across_month_boundary(costs, workers):
+    stub = StubCostExplorer({('2024-01-25', None): page('2024-01-25', 'jan2'),
+                             ('2024-01-25', 'jan2'): page('2024-01-31'),
+                             ('2024-02-01', None): page('2024-02-01', 'feb2'),
+                             ('2024-02-01', 'feb2'): {'ResultsByTime': []}})
+
+    pages = list(costs.fetch_cost_pages(datetime.date(2024, 1, 25), datetime.date(2024, 2, 3),
+                                        workers=workers, ce_client=stub))
+
+    # windows come back in date order, each one paged to the end
+    assert [result['TimePeriod']['Start'] for response in pages
+            for result in response['ResultsByTime']] == ['2024-01-25', '2024-01-31', '2024-02-01']
+    assert sorted((request['TimePeriod']['Start'], request['TimePeriod']['End'])
+                  for request in stub.requests) == [('2024-01-25', '2024-02-01'),
+                                                    ('2024-01-25', '2024-02-01'),
+                                                    ('2024-02-01', '2024-02-03'),
+                                                    ('2024-02-01', '2024-02-03')]
@@ -0,0 +1,109 @@
+"""Rollups refreshed load by load must add up to the raw rows, also when a load
+    crosses a month boundary and overlaps the previous one
+"""
+
+import collections
+import datetime
+import sqlite3
+
+import pytest
+
+import get_costs_sqlite as costs
+from cost_queries import daily_service_costs, monthly_account_costs, monthly_service_costs
+
+ACCOUNT_ID = '111111111111'
+SERVICES = [('Amazon EC2', 'BoxUsage'), ('Amazon EC2', 'EBS:VolumeUsage'),
+            ('Amazon S3', 'TimedStorage')]
+
+def cost_page(start_date, end_date, run):
+    """one Cost Explorer page, every day of [start_date, end_date) for SERVICES
+        amounts differ per day, service and run, so a stale rollup shows
+    """
+
+    results = []
+    for day in range((end_date - start_date).days):
+        time_period = start_date + datetime.timedelta(days=day)
+        groups = [{'Keys': list(service),
+                   'Metrics': {cost_type: {'Amount': str(time_period.day + index + run * 0.5)}
+                               for cost_type in costs.COST_TYPES}}
+                  for index, service in enumerate(SERVICES)]
+        results.append({'TimePeriod': {'Start': str(time_period)}, 'Groups': groups})
+    return {'ResultsByTime': results}
+
+def raw_sums(db_cursor, period_key):
+    """SUM(amount) of the raw rows by (period_key(time_period), aws_service)
+        for AmortizedCost, computed in Python
+    """
+
+    db_cursor.execute("SELECT time_period, aws_service, amount FROM costs "
+                      "WHERE cost_type = 'AmortizedCost'")
+    sums = collections.defaultdict(float)
+    for time_period, aws_service, amount in db_cursor.fetchall():
+        sums[(period_key(datetime.date.fromisoformat(time_period)), aws_service)] += amount
+    return sums
+
+@pytest.fixture
+def db_cursor():
+    db_conn = sqlite3.connect(':memory:')
+    db_cursor = db_conn.cursor()
+    costs.create_table_if_not_exists('costs', db_cursor)
+    # two loads across the January/February boundary, the second overlaps the first
+    costs.process_and_store_costs([cost_page(datetime.date(2024, 1, 20),
+                                             datetime.date(2024, 2, 4), 0)],
+                                  'costs', ACCOUNT_ID, 0, db_cursor)
+    costs.process_and_store_costs([cost_page(datetime.date(2024, 1, 30),
+                                             datetime.date(2024, 2, 10), 1)],
+                                  'costs', ACCOUNT_ID, 1, db_cursor)
+    yield db_cursor
+    db_conn.close()
+
+def test_daily_rollup_matches_raw_rows(db_cursor):
+    rows = daily_service_costs(db_cursor, 'costs', datetime.date(2024, 1, 1),
+                               datetime.date(2024, 3, 1))
+
+    assert {(datetime.date.fromisoformat(row['time_period']), row['aws_service']): row['amount']
+            for row in rows} == pytest.approx(raw_sums(db_cursor, lambda day: day))
+
+def test_weekly_sums_of_daily_rollup_match_raw_rows(db_cursor):
+    # ISO weeks, the week of 2024-01-29 spans both months
+    def week(day):
+        return day - datetime.timedelta(days=day.weekday())
+
+    rows = daily_service_costs(db_cursor, 'costs', datetime.date(2024, 1, 1),
+                               datetime.date(2024, 3, 1))
+    weekly = collections.defaultdict(float)
+    for row in rows:
+        weekly[(week(datetime.date.fromisoformat(row['time_period'])), row['aws_service'])] += \
+            row['amount']
+
+    assert (datetime.date(2024, 1, 29), 'Amazon EC2') in weekly
+    assert weekly == pytest.approx(raw_sums(db_cursor, week))
+
+def test_monthly_rollups_match_raw_rows(db_cursor):
+    def month(day):
+        return day.replace(day=1)
+
+    service_rows = monthly_service_costs(db_cursor, 'costs', datetime.date(2024, 1, 1),
+                                         datetime.date(2024, 3, 1))
+    account_rows = monthly_account_costs(db_cursor, 'costs', datetime.date(2024, 1, 1),
+                                         datetime.date(2024, 3, 1))
+    expected = raw_sums(db_cursor, month)
+    account_expected = collections.defaultdict(float)
+    for (first_day, _), amount in expected.items():
+        account_expected[first_day] += amount
+
+    assert [row['time_period'] for row in account_rows] == ['2024-01-01', '2024-02-01']
+    assert {(datetime.date.fromisoformat(row['time_period']), row['aws_service']): row['amount']
+            for row in service_rows} == pytest.approx(expected)
+    assert {datetime.date.fromisoformat(row['time_period']): row['amount']
+            for row in account_rows} == pytest.approx(account_expected)
+
+def test_incremental_refresh_matches_full_rebuild(db_cursor):
+    def rollup_rows():
+        return {rollup: sorted(db_cursor.execute(f'SELECT * FROM costs_{rollup}').fetchall())
+                for rollup in costs.ROLLUPS}
+
+    incremental = rollup_rows()
+    costs.refresh_rollups('costs', db_cursor)
+
+    assert rollup_rows() == incremental
@@ -0,0 +1,104 @@
+"""Rows are keyed on COST_KEY - a --sync run over days already stored rewrites them,
+    and a table written before the key had its duplicates removed once
+"""
+
+import datetime
+import sqlite3
+
+import pytest
+
+import get_costs_sqlite as costs
+
+ACCOUNT_ID = '111111111111'
+SERVICES = [('Amazon EC2', 'BoxUsage'), ('Amazon S3', 'TimedStorage')]
+
+# costs table as created before COST_KEY, no unique index
+LEGACY_TABLE = """
+CREATE TABLE costs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp INTEGER NOT NULL,
+    account_id TEXT NOT NULL,
+    time_period TEXT NOT NULL,
+    aws_service TEXT NOT NULL,
+    cost_type TEXT NOT NULL,
+    usage_type TEXT NOT NULL,
+    amount REAL NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+def cost_page(start_date, end_date, amount):
+    """one Cost Explorer page, every day of [start_date, end_date) for SERVICES
+    """
+
+    days = (end_date - start_date).days
+    return {'ResultsByTime': [
+        {'TimePeriod': {'Start': str(start_date + datetime.timedelta(days=day))},
+         'Groups': [{'Keys': list(service),
+                     'Metrics': {cost_type: {'Amount': str(amount)}
+                                 for cost_type in costs.COST_TYPES}}
+                    for service in SERVICES]}
+        for day in range(days)]}
+
+def row_count(db_cursor):
+    db_cursor.execute('SELECT COUNT(*) FROM costs')
+    return db_cursor.fetchone()[0]
+
+@pytest.fixture
+def db_cursor():
+    db_conn = sqlite3.connect(':memory:')
+    yield db_conn.cursor()
+    db_conn.close()
+
+def test_sync_twice_over_the_same_window(db_cursor):
+    today = datetime.date(2024, 2, 3)
+    costs.create_table_if_not_exists('costs', db_cursor)
+
+    for run, amount in enumerate([1.5, 2.5]):
+        latest = costs.latest_time_periods('costs', db_cursor).get(ACCOUNT_ID)
+        start, end = costs.sync_window(latest, today, datetime.date(2024, 1, 25))
+        costs.process_and_store_costs([cost_page(start, end, amount)], 'costs', ACCOUNT_ID,
+                                      run, db_cursor)
+        if run == 0:
+            first_count = row_count(db_cursor)
+
+    # the second run refetched the lookback days, it rewrote them instead of adding rows
+    assert first_count == 9 * len(SERVICES) * len(costs.COST_TYPES)
+    assert row_count(db_cursor) == first_count
+    db_cursor.execute("SELECT DISTINCT amount FROM costs WHERE time_period >= '2024-01-30'")
+    assert db_cursor.fetchall() == [(2.5,)]
+    db_cursor.execute("SELECT DISTINCT amount FROM costs WHERE time_period < '2024-01-30'")
+    assert db_cursor.fetchall() == [(1.5,)]
+
+def test_write_rows_twice_keeps_row_count(db_cursor):
+    costs.create_table_if_not_exists('costs', db_cursor)
+    page = cost_page(datetime.date(2024, 1, 1), datetime.date(2024, 1, 3), 1.5)
+    rows = list(costs.cost_rows(page, ACCOUNT_ID, 0))
+
+    costs.db_write_rows('costs', rows, db_cursor)
+    costs.db_write_rows('costs', rows, db_cursor)
+
+    assert row_count(db_cursor) == len(rows)
+
+def test_duplicates_migrate_to_one_row_per_key(db_cursor):
+    db_cursor.execute(LEGACY_TABLE)
+    page = cost_page(datetime.date(2024, 1, 1), datetime.date(2024, 1, 3), 1.5)
+    rows = list(costs.cost_rows(page, ACCOUNT_ID, 0))
+    # three plain appends of the same days, the last one with the settled amounts
+    insert = f"INSERT INTO costs ({', '.join(costs.COST_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)"
+    for timestamp, amount in [(1, '1.5'), (2, '1.5'), (3, '2.0')]:
+        db_cursor.executemany(insert, [(timestamp,) + row[1:-1] + (amount,) for row in rows])
+    db_cursor.connection.commit()
+    assert row_count(db_cursor) == 3 * len(rows)
+
+    costs.create_table_if_not_exists('costs', db_cursor)
+
+    assert row_count(db_cursor) == len(rows)
+    db_cursor.execute(f"SELECT COUNT(*) FROM costs GROUP BY {', '.join(costs.COST_KEY)} "
+                      f"HAVING COUNT(*) > 1")
+    assert db_cursor.fetchall() == []
+    db_cursor.execute('SELECT DISTINCT timestamp, amount FROM costs')
+    assert db_cursor.fetchall() == [(3, 2.0)]
+    # the key is in place, a further write upserts
+    costs.db_write_rows('costs', rows, db_cursor)
+    assert row_count(db_cursor) == len(rows)
@@ -0,0 +1,71 @@
+"""DuckDB backend - upserts on COST_KEY, and the Parquet copy is one file per
+    account and month, rewritten when a load touches the month again
+"""
+
+import datetime
+import decimal
+
+import pytest
+
+import get_costs_sqlite as costs
+
+duckdb = pytest.importorskip('duckdb')
+
+ACCOUNT_ID = '111111111111'
+SERVICES = [('Amazon EC2', 'BoxUsage'), ('Amazon S3', 'TimedStorage')]
+
+def cost_page(start_date, end_date, amount):
+    """one Cost Explorer page, every day of [start_date, end_date) for SERVICES
+    """
+
+    return {'ResultsByTime': [
+        {'TimePeriod': {'Start': str(start_date + datetime.timedelta(days=day))},
+         'Groups': [{'Keys': list(service),
+                     'Metrics': {cost_type: {'Amount': amount} for cost_type in costs.COST_TYPES}}
+                    for service in SERVICES]}
+        for day in range((end_date - start_date).days)]}
+
+def load(db_cursor, start_date, end_date, amount, parquet_dir=None):
+    costs.process_and_store_costs([cost_page(start_date, end_date, amount)], 'costs', ACCOUNT_ID,
+                                  0, db_cursor, 'duckdb', parquet_dir)
+
+@pytest.fixture
+def db_cursor():
+    duck_conn = duckdb.connect(':memory:')
+    db_cursor = costs.DuckDBCursor(duck_conn)
+    costs.create_table_if_not_exists('costs', db_cursor, 'duckdb')
+    yield db_cursor
+    duck_conn.close()
+
+def test_duckdb_upsert_keeps_one_row_per_key(db_cursor):
+    load(db_cursor, datetime.date(2024, 1, 28), datetime.date(2024, 2, 3), '1.5')
+    load(db_cursor, datetime.date(2024, 2, 1), datetime.date(2024, 2, 5), '0.0000000001')
+
+    db_cursor.execute('SELECT COUNT(*) FROM costs')
+    assert db_cursor.fetchone()[0] == 8 * len(SERVICES) * len(costs.COST_TYPES)
+    db_cursor.execute("SELECT DISTINCT amount FROM costs WHERE time_period >= DATE '2024-02-01'")
+    # DECIMAL keeps Cost Explorer's ten decimal places
+    assert db_cursor.fetchall() == [(decimal.Decimal('0.0000000001'),)]
+    db_cursor.execute("SELECT DISTINCT amount FROM costs WHERE time_period < DATE '2024-02-01'")
+    assert db_cursor.fetchall() == [(decimal.Decimal('1.5'),)]
+
+def test_parquet_partition_layout(db_cursor, tmp_path):
+    load(db_cursor, datetime.date(2024, 1, 28), datetime.date(2024, 2, 3), '1.5', str(tmp_path))
+    load(db_cursor, datetime.date(2024, 2, 1), datetime.date(2024, 2, 5), '2.5', str(tmp_path))
+
+    files = sorted(path.relative_to(tmp_path).as_posix() for path in tmp_path.rglob('*.parquet'))
+    assert files == [f'account_id={ACCOUNT_ID}/month=2024-01/costs.parquet',
+                     f'account_id={ACCOUNT_ID}/month=2024-02/costs.parquet']
+
+    # the February file was rewritten by the second load, not appended to
+    parquet = duckdb.sql(f"""
+        SELECT account_id, month, COUNT(*), SUM(amount)
+        FROM read_parquet('{tmp_path}/*/*/*.parquet', hive_partitioning = true)
+        GROUP BY account_id, month ORDER BY month
+        """).fetchall()
+    db_cursor.execute("""
+        SELECT account_id, strftime(time_period, '%Y-%m'), COUNT(*), SUM(amount)
+        FROM costs GROUP BY ALL ORDER BY 2
+        """)
+    assert [(str(account_id), month, count, amount)
+            for account_id, month, count, amount in parquet] == db_cursor.fetchall()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""Benchmark the HL7 ETL end to end on one machine
+    Writes N synthetic messages from create_sample_data.py to a local NDJSON file,
+    runs read -> parse -> rename -> write with either plain Python or Spark local mode,
+    and reports seconds and records/second per stage.
+    Writes to SQLite by default, or to the etl.config PostgreSQL with --sink jdbc, copy
+    or copy-staging, the ETL's own write paths.
+   See README.md for more details
+"""
+
+import ast
+import argparse
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import time
+
+from faker import Faker
+
+import create_sample_data
+import s3_redis_json_to_psql_etl as etl
+from bench_hl7_parse import ignore_lists_from_config
+from hl7_local_engine import iter_records
+from hl7_schemas import hl7_json_schema
+
+STAGES = ('generate', 'read', 'parse', 'rename', 'write')
+# etl.write_df sinks, anything else is a SQLite file
+POSTGRES_SINKS = ('jdbc', 'copy', 'copy-staging')
+
+def generate_ndjson(ndjson_path, num_records, seed=0):
+    """write num_records synthetic messages, one JSON object per line
+        a single seeded Faker and word pool are reused, so runs are repeatable
+    """
+
+    rng = random.Random(seed)
+    fake = Faker()
+    fake.seed_instance(seed)
+    words = create_sample_data.word_pool(fake)
+    with open(ndjson_path, 'w', encoding='utf-8') as ndjson_file:
+        for _ in range(num_records):
+            ndjson_file.write(json.dumps(create_sample_data.sample_record(fake, words, rng)) + '\n')
+    return num_records
+
+def set_etl_globals(config_obj):
+    """the ETL reads its ignore lists from module globals set in its __main__
+    """
+
+    etl.IGNORE_SEG_FIELDS = ast.literal_eval(config_obj.get('constants', 'IGNORE_SEG_FIELDS'))
+    etl.IGNORE_COMPONENT_FIELDS = ast.literal_eval(config_obj.get('constants',
+                                                                  'IGNORE_COMPONENT_FIELDS'))
+    return ast.literal_eval(config_obj.get('constants', 'HL7_SEGMENTS'))
+
+def sqlite_write(db_path, tablename, rows):
+    """write dict rows to a SQLite table, all text columns like the feed tables
+        returns number of rows written
+    """
+
+    columns = list(dict.fromkeys(col for row in rows for col in row))
+    sqlite_conn = sqlite3.connect(db_path)
+    try:
+        existing = {row[1] for row in sqlite_conn.execute(f'PRAGMA table_info("{tablename}")')}
+        if not existing:
+            col_defs = ', '.join(f'"{col}" text' for col in columns)
+            sqlite_conn.execute(f'CREATE TABLE "{tablename}" ({col_defs})')
+        else:
+            for col in columns:
+                if col not in existing:
+                    sqlite_conn.execute(f'ALTER TABLE "{tablename}" ADD COLUMN "{col}" text')
+
+        col_list = ', '.join(f'"{col}"' for col in columns)
+        placeholders = ', '.join('?' for _ in columns)
+        sqlite_conn.executemany(f'INSERT INTO "{tablename}" ({col_list}) VALUES ({placeholders})',
+                                (tuple(row.get(col) for col in columns) for row in rows))
+        sqlite_conn.commit()
+    finally:
+        sqlite_conn.close()
+    return len(rows)
+
+def postgres_write(tablename, rows):
+    """write dict rows to the etl.config PostgreSQL with COPY, same path as --sink copy
+    """
+
+    p_config = etl.read_config('etl.config')
+    columns = list(dict.fromkeys(col for row in rows for col in row))
+    psql_conn, psql_cursor = etl.psql_connection(p_config)
+    try:
+        etl.create_table(tablename, columns, psql_cursor)
+    finally:
+        psql_conn.close()
+
+    chunk_rows = p_config.getint('reportdb', 'copy.chunkrows', fallback=10000)
+    values = (tuple(row.get(col) for col in columns) for row in rows)
+    return sum(etl.copy_partition(values, tablename, columns, etl.psql_db_config(p_config),
+                                  chunk_rows))
+
+def run_python(ndjson_path, segments, ignore_lists, feed, sink, timings):
+    """plain Python pipeline, one stage at a time
+        returns (records read, rows written)
+    """
+
+    tablename = etl.feed_table_name(feed)
+    start = time.perf_counter()
+    records = list(iter_records(ndjson_path))
+    timings['read'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parsed = []
+    for record in records:
+        if not etl.passes_state_prefilter(record, ignore_lists['states']):
+            continue
+        data_dict = etl.process_record(record, segments, ignore_lists)
+        if data_dict is not None:
+            parsed.append(data_dict)
+    timings['parse'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rows = [{etl.output_column_name(col): value for col, value in data_dict.items()}
+            for data_dict in parsed]
+    timings['rename'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if sink == 'copy':
+        written = postgres_write(tablename, rows)
+    else:
+        written = sqlite_write(sink, tablename, rows)
+    timings['write'] = time.perf_counter() - start
+    return len(records), written
+
+def run_spark(ndjson_path, segments, ignore_lists, feed, sink, timings):
+    """Spark local mode pipeline, each stage is cached and counted so it can be timed
+        returns (records read, rows written)
+    """
+
+    from pyspark.sql import SparkSession
+
+    tablename = etl.feed_table_name(feed)
+    spark = SparkSession.builder.master('local[*]').appName('HL7 ETL benchmark').getOrCreate()
+    spark.sparkContext.setLogLevel('WARN')
+    try:
+        start = time.perf_counter()
+        json_df = etl.lower_case_col_names(
+                    spark.read.json(ndjson_path, schema=hl7_json_schema(segments))).persist()
+        num_records = json_df.count()
+        timings['read'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        spark_context = spark.sparkContext
+        ignore_lists_bc = spark_context.broadcast(ignore_lists)
+        counters = (spark_context.accumulator(0), spark_context.accumulator(0))
+        parsed_rdd = json_df.rdd.mapPartitions(
+                        lambda rows: etl.process_partition(rows, segments, ignore_lists_bc,
+                                                           counters)).persist()
+        parsed_df = spark.read.json(parsed_rdd).persist()
+        parsed_df.count()
+        timings['parse'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        renamed_df = etl.rename_df_columns(parsed_df)
+        renamed_df.count()
+        timings['rename'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if sink in POSTGRES_SINKS:
+            etl.write_df(renamed_df, feed, sink)
+        else:
+            written = sqlite_write(sink, tablename,
+                                   [row.asDict() for row in renamed_df.toLocalIterator()])
+        timings['write'] = time.perf_counter() - start
+        if sink in POSTGRES_SINKS:
+            # renamed_df is cached, counted after the write so it isn't timed
+            written = renamed_df.count()
+    finally:
+        spark.stop()
+    return num_records, written
+
+def report(engine, sink, num_records, written, timings):
+    """log one line per stage and return the run as a dict
+    """
+
+    for stage in STAGES:
+        seconds = timings.get(stage, 0.0)
+        logging.info('**** %-8s %8.2fs %10.0f records/second ****', stage, seconds,
+                     num_records / seconds if seconds else 0)
+    total = sum(timings.get(stage, 0.0) for stage in STAGES if stage != 'generate')
+    logging.info('**** %s engine: %s records, %s rows written in %.2fs - '
+                 '%.0f records/second ****', engine, num_records, written, total,
+                 num_records / total if total else 0)
+    write_seconds = timings.get('write', 0.0)
+    rows_per_second = written / write_seconds if write_seconds else 0
+    logging.info('**** %s sink: %.0f rows/second ****', sink, rows_per_second)
+    return {
+        'engine': engine,
+        'sink': sink,
+        'records': num_records,
+        'rows': written,
+        'timings': timings,
+        'total': total,
+        'rows_per_second': rows_per_second,
+    }
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,format='%(asctime)s %(message)s',\
+            handlers=[logging.StreamHandler(sys.stdout)])
+
+    arg_parser = argparse.ArgumentParser(description='Benchmark the HL7 ETL on one machine')
+    arg_parser.add_argument('--records', dest='records', type=int, default=10000,
+                            help='Number of synthetic messages to generate')
+    arg_parser.add_argument('--ndjson', dest='ndjson', default='bench_hl7.ndjson',
+                            help='NDJSON file to generate, reused if it exists with --no-generate')
+    arg_parser.add_argument('--no-generate', dest='no_generate', action='store_true',
+                            help='Reuse an existing --ndjson file')
+    arg_parser.add_argument('--engine', dest='engine', default='python', choices=['python', 'spark'],
+                            help='plain Python, or Spark local mode')
+    arg_parser.add_argument('--sink', dest='sink', default='bench_hl7.sqlite',
+                            help='SQLite database file, or jdbc, copy or copy-staging for the '
+                                 'etl.config reportdb - jdbc and copy-staging need --engine spark')
+    arg_parser.add_argument('--feed', dest='feed', default='bench',
+                            help='Feed name, the table is v5_<feed>')
+    arg_parser.add_argument('--config', dest='config', default='etl.config',
+                            help='etl.config with the [constants] section')
+    arg_parser.add_argument('--seed', dest='seed', type=int, default=0,
+                            help='Seed for the synthetic data')
+    arg_parser.add_argument('--report', dest='report',
+                            help='Append the run as one JSON line to this file')
+    args = arg_parser.parse_args()
+    if args.engine == 'python' and args.sink in ('jdbc', 'copy-staging'):
+        arg_parser.error(f'--sink {args.sink} needs --engine spark')
+
+    config = etl.read_config(args.config)
+    hl7_segments = set_etl_globals(config)
+    stage_timings = {}
+
+    if not (args.no_generate and os.path.exists(args.ndjson)):
+        gen_start = time.perf_counter()
+        generate_ndjson(args.ndjson, args.records, args.seed)
+        stage_timings['generate'] = time.perf_counter() - gen_start
+
+    run_engine = run_spark if args.engine == 'spark' else run_python
+    num_read, num_written = run_engine(args.ndjson, hl7_segments,
+                                       ignore_lists_from_config(config),
+                                       args.feed, args.sink, stage_timings)
+
+    run_report = report(args.engine, args.sink, num_read, num_written, stage_timings)
+    if args.report:
+        with open(args.report, 'a', encoding='utf-8') as report_file:
+            report_file.write(json.dumps(run_report) + '\n')
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Benchmark HL7 segment parsing on synthetic data from create_sample_data.py
+    Reads either an NDJSON file or a directory of *.json files and reports records/second.
+    --check compares the fast pipe splitter against hl7apy for every segment, plus MSH.
+   See README.md for more details
+"""
+
+import ast
+import argparse
+import logging
+import sys
+import time
+
+import hl7_fast_parser
+import s3_redis_json_to_psql_etl as etl
+from hl7_local_engine import iter_records
+
+def ignore_lists_from_config(config_obj):
+    """build the same ignore lists the ETL broadcasts
+    """
+
+    return {
+        'fields': frozenset(etl.IGNORE_FIELDS),
+        'seg_fields': frozenset(ast.literal_eval(config_obj.get('constants', 'IGNORE_SEG_FIELDS'))),
+        'component_fields': frozenset(ast.literal_eval(config_obj.get('constants',
+                                                                      'IGNORE_COMPONENT_FIELDS'))),
+        'states': frozenset(etl.STATES),
+    }
+
+def run(records, segments, ignore_lists, limit, prefilter=True):
+    """parse records, return (count, kept, prefiltered, seconds)
+    """
+
+    count = kept = prefiltered = 0
+    elapsed = 0.0
+    for record in records:
+        start = time.perf_counter()
+        if prefilter and not etl.passes_state_prefilter(record, ignore_lists['states']):
+            prefiltered += 1
+        elif etl.process_record(record, segments, ignore_lists) is not None:
+            kept += 1
+        elapsed += time.perf_counter() - start
+        count += 1
+        if limit and count >= limit:
+            break
+    return count, kept, prefiltered, elapsed
+
+def check(records, segments, ignore_lists, limit):
+    """compare fast parser output to hl7apy output, return (segments, fast, mismatches)
+        msh is always checked, MSH-1/MSH-2 numbering is where a splitter goes wrong
+    """
+
+    segments = list(dict.fromkeys(['msh'] + list(segments)))
+    seg_args = (ignore_lists['seg_fields'], ignore_lists['component_fields'],
+                ignore_lists['fields'])
+    num_segments = num_fast = mismatches = 0
+    for count, record in enumerate(records, start=1):
+        for s_g in segments:
+            segment_data = record.get(s_g)
+            if not segment_data:
+                continue
+            num_segments += 1
+            fast = hl7_fast_parser.parse_segment_fields(segment_data, *seg_args)
+            if fast is None:
+                continue
+            num_fast += 1
+            expected, _ = hl7_fast_parser.parse_hl7apy_segment_fields(segment_data, *seg_args)
+            if dict(fast) != dict(expected):
+                mismatches += 1
+                logging.error('Mismatch for %s\n  fast:   %s\n  hl7apy: %s',
+                              segment_data, dict(fast), dict(expected))
+        if limit and count >= limit:
+            break
+    return num_segments, num_fast, mismatches
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,format='%(asctime)s %(message)s',\
+            handlers=[logging.StreamHandler(sys.stdout)])
+
+    arg_parser = argparse.ArgumentParser(description='Benchmark HL7 segment parsing')
+    arg_parser.add_argument('--input', dest='input', required=True,
+                            help='NDJSON file or directory of JSON files')
+    arg_parser.add_argument('--limit', dest='limit', type=int, default=0,
+                            help='Stop after this many records, 0 for all')
+    arg_parser.add_argument('--config', dest='config', default='etl.config',
+                            help='etl.config with the [constants] section')
+    arg_parser.add_argument('--no-cache', dest='no_cache', action='store_true',
+                            help='Disable the raw segment parse cache')
+    arg_parser.add_argument('--parser', dest='parser', default='fast', choices=['fast', 'hl7apy'],
+                            help='fast splitter with hl7apy fallback, or hl7apy only')
+    arg_parser.add_argument('--no-prefilter', dest='no_prefilter', action='store_true',
+                            help='Parse every message instead of pre-filtering on PID-11.4')
+    arg_parser.add_argument('--check', dest='check', action='store_true',
+                            help='Check fast parser output against hl7apy instead of timing')
+    args = arg_parser.parse_args()
+
+    config = etl.read_config(args.config)
+    hl7_segments = ast.literal_eval(config.get('constants', 'HL7_SEGMENTS'))
+
+    if args.check:
+        total, fast_count, bad = check(iter_records(args.input), hl7_segments,
+                                       ignore_lists_from_config(config), args.limit)
+        logging.info('**** %s segments, %s on the fast path, %s mismatches ****',
+                     total, fast_count, bad)
+        sys.exit(1 if bad else 0)
+
+    if args.parser == 'hl7apy':
+        hl7_fast_parser.parse_segment_fields = lambda *args: None
+    if args.no_cache:
+        etl.parse_hl7_segment_fields = hl7_fast_parser.parse_hl7_segment_fields.__wrapped__
+
+    num, num_kept, num_skipped, seconds = run(iter_records(args.input), hl7_segments,
+                                              ignore_lists_from_config(config), args.limit,
+                                              not args.no_prefilter)
+
+    logging.info('**** Parsed %s records (%s kept, %s skipped by the state pre-filter) '
+                 'in %.2fs - %.0f records/second ****',
+                 num, num_kept, num_skipped, seconds, num / seconds if seconds else 0)
+    if not args.no_cache:
+        logging.info('**** Segment cache: %s ****', hl7_fast_parser.parse_hl7_segment_fields.cache_info())
@@ -1,19 +1,34 @@
 #!/usr/bin/env python3
-import random
-from random import randrange
-from random_word import RandomWords
-from multiprocessing import Process
-import datetime
-from faker import Faker
+"""Generate anonymized synthetic HL7 JSON messages for the ETL
+    The row count is split across worker processes. Each worker reuses one seeded Faker
+    and word pool, builds batches in memory and loads each batch with one COPY or
+    execute_values (PostgreSQL JSONB), one pipeline of JSON.SET (RedisJSON), or one write
+    to its own NDJSON file. Reports rows/second.
+   See README.md for more details
+"""
+
+import argparse
+import configparser
+import csv
+import io
 import json
-import redis
+import logging
+import os
+import random
 import sys
+import time
 import uuid
-import configparser
-import json
-import psycopg2
-from psycopg2.extras import execute_values
-from psycopg2.extras import execute_batch
+from multiprocessing import Pool
+
+from faker import Faker
+
+US_STATES = ['AL', 'AK', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'FL', 'GA', 'HI', 'ID', 'IL', 'IN', 'IA', 'KS', 'KY', 'LA', 'ME', 'MD', 'MA', 'MI', 'MN', 'MS', 'MO', 'MT', 'NE', 'NV', 'NH', 'NJ', 'NM', 'NY', 'NC', 'ND', 'OH', 'OK', 'OR', 'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VT', 'VA', 'WA', 'WV', 'WI', 'WY']
+GENDER = ['M','F']
+INSURANCE = ['ALTADENA', 'BLUE SHIELD', 'KAISER', 'ANTHEM', "BLUE CROSS"]
+ADTS = ['08','01','02','04','32','64']
+
+# tenant ids are drawn from this many words, picked once per worker
+WORD_POOL_SIZE = 200
 
 def read_config(file_path):
     """ read config file
@@ -22,99 +37,189 @@ def read_config(file_path):
     config_obj.read(file_path)
     return config_obj
 
-#redishost=<redis host>
-#redisport=6379
-#R = redis.Redis(host=redishost, port=redisport, decode_responses=True)
+def word_pool(fake, size=WORD_POOL_SIZE):
+    """Words to pick tenant ids from, from the seeded Faker so runs are repeatable
+    """
+    return fake.words(size)
 
+def sample_record(fake, words, rng=random):
+    """One synthetic HL7 JSON message, as Mirth writes them
+        fake - Faker instance, words - word pool, rng - random.Random, all reusable across records
+    """
+    pid = str(rng.randrange(1000000,9999999))
+    updatedat = fake.date_time_between(start_date='-2y', end_date='now').strftime("%Y-%m-%d %H:%M")
+    dob = fake.date_time_between(start_date='-40y', end_date='-10y').strftime("%Y-%m-%d")
+    dobint = dob.replace('-','')
+    name = fake.name().split(' ')
+    adt = rng.choice(ADTS)
+
+    tenantid = rng.choice(words)
+
+    visitnum = str(rng.randrange(10000000,99999999))
+    somecode = 'S'+str(rng.randrange(10000,99999))
+
+    return {
+              'patientId': pid,
+              'tenantId': tenantid,
+              'dob': dob,
+              'id': pid,
+              'updatedAt': updatedat,
+              'createdAt': updatedat,
+              'visitNumber': visitnum,
+              'MSH': 'MSH|^~&|EPICCARE|WB^WBPC|||20230110144357|'+somecode+'|ADT^'+adt+'^ADT_A01|400815517|P|2.3',
+              'EVN': 'EVN|'+adt+'|20230110144357||REGCHECKCOMP_'+adt+'|'+somecode+'^'+name[-1].upper()+'^'+name[0].upper()+'^ANAME^^^^^WB^^^^^WBPC||WBPC^1740348929^SOMENAME',
+              'PID': 'PID|1||14891584^^^^EPI~62986117^^^^SOMERN||'+name[0].upper()+'^'+name[-1].upper()+'||'+dobint+'|'+rng.choice(GENDER)+'|||'+fake.street_address().upper()+'^^'+fake.city().upper()+'^'+rng.choice(US_STATES)+'^'+fake.postcode().upper()+'^USA^P^^SC',
+              'PV1': 'PV1||O|168 ~219~C~PMA^^^^^^^^^||||277^'+name[-1].upper()+'^BONNIE^^^^|||||||||| ||2688684|||||||||||||||||||||||||202211031408||||||002376853',
+              'IN1': 'IN1|1|PRE2||'+ rng.choice(INSURANCE) +'|PO BOX 23523^WELLINGTON^ON^98111|||19601||||||||'+name[-1].upper()+'^'+name[0].upper()+'^M|F|||||||||||||||||||ZKA'+visitnum+''
+             }
+
+def sample_key(record):
+    """RedisJSON key / file name for a record, matches key.pattern pid_*
+    """
+    return 'pid_'+record['patientId']+'_'+uuid.uuid4().hex+".json"
 
-US_STATES = ['AL', 'AK', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'FL', 'GA', 'HI', 'ID', 'IL', 'IN', 'IA', 'KS', 'KY', 'LA', 'ME', 'MD', 'MA', 'MI', 'MN', 'MS', 'MO', 'MT', 'NE', 'NV', 'NH', 'NJ', 'NM', 'NY', 'NC', 'ND', 'OH', 'OK', 'OR', 'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VT', 'VA', 'WA', 'WV', 'WI', 'WY']
-GENDER = ['M','F']
-INSURANCE = ['ALTADENA', 'BLUE SHIELD', 'KAISER', 'ANTHEM', "BLUE CROSS"]
-ADTS = ['08','01','02','04','32','64']
+def partition_counts(num_rows, num_workers):
+    """Split num_rows across num_workers, e.g. 10 rows / 3 workers -> [4, 3, 3]
+    """
+    base, extra = divmod(num_rows, num_workers)
+    return [base + (1 if index < extra else 0) for index in range(num_workers)]
 
-def insert_data(psql_cur, table, sample):
-    query = "INSERT INTO {} (patientjson) VALUES (%s);".format(table)
-    psql_cur.execute(query, (json.dumps(sample),))
-    psql_cur.connection.commit()
-
-def main():
-    config_obj = read_config('etl.config')
-    dbhost = config_obj.get('reportdb','host')
-    dbport = config_obj.get('reportdb','port')
-    dbname = config_obj.get('reportdb','dbname')
-    dbuser = config_obj.get('reportdb','dbuser')
-    dbpass = config_obj.get('reportdb','dbuserpass')
-
-    psql_conn = psycopg2.connect(database=dbname, host=dbhost, user=dbuser,\
-                                    password=dbpass, port=dbport)
+def postgres_writer(config_obj, table, method):
+    """Returns (write_batch, close) for PostgreSQL JSONB, one transaction per batch
+        method - copy or values (execute_values)
+    """
+    import psycopg2
+    from psycopg2.extras import execute_values
+
+    psql_conn = psycopg2.connect(database=config_obj.get('reportdb','dbname'),
+                                 host=config_obj.get('reportdb','host'),
+                                 user=config_obj.get('reportdb','dbuser'),
+                                 password=config_obj.get('reportdb','dbuserpass'),
+                                 port=config_obj.get('reportdb','port'))
     psql_cur = psql_conn.cursor()
+    psql_cur.execute(f"CREATE TABLE IF NOT EXISTS {table} (patientjson jsonb);")
+    psql_conn.commit()
+
+    def write_batch(batch):
+        if method == 'values':
+            execute_values(psql_cur, f"INSERT INTO {table} (patientjson) VALUES %s;",
+                           [(json.dumps(record),) for record in batch], page_size=len(batch))
+        else:
+            buffer = io.StringIO()
+            csv_writer = csv.writer(buffer)
+            for record in batch:
+                csv_writer.writerow([json.dumps(record)])
+            buffer.seek(0)
+            psql_cur.copy_expert(f"COPY {table} (patientjson) FROM STDIN WITH (FORMAT csv)", buffer)
+        psql_conn.commit()
+
+    return write_batch, psql_conn.close
+
+def redis_writer(config_obj):
+    """Returns (write_batch, close) for RedisJSON, one pipeline round trip per batch
+    """
+    import redis
 
-    # postgresql table
-    table = <psql table name here>
-    num_files = 2000000
-
-    for i in range(num_files):
-        pid = str(randrange(1000000,9999999))
-        filename = 'pid_'+pid+'_'+uuid.uuid4().hex+".json"
-
-        fake = Faker()
-        updatedat = fake.date_time_between(start_date='-2y', end_date='now').strftime("%Y-%m-%d %H:%M")
-        dob = fake.date_time_between(start_date='-40y', end_date='-10y').strftime("%Y-%m-%d")
-        dobint = dob.replace('-','')
-        name = fake.name().split(' ')
-        adt = random.choice(ADTS)
-
-        r = RandomWords()
-        tenantid = r.get_random_word()
-        ins_name = r.get_random_word().upper()
-
-        visitnum = str(randrange(10000000,99999999))
-        somecode = 'S'+str(randrange(10000,99999))
-
-        sample = json.dumps({
-                  'patientId': pid,
-                  'tenantId': tenantid,
-                  'dob': dob,
-                  'id': pid,
-                  'updatedAt': updatedat,
-                  'createdAt': updatedat,
-                  'visitNumber': visitnum,
-                  'MSH': 'MSH|^~&|EPICCARE|WB^WBPC|||20230110144357|'+somecode+'|ADT^'+adt+'^ADT_A01|400815517|P|2.3',
-                  'EVN': 'EVN|'+adt+'|20230110144357||REGCHECKCOMP_'+adt+'|'+somecode+'^'+name[-1].upper()+'^'+name[0].upper()+'^ANAME^^^^^WB^^^^^WBPC||WBPC^1740348929^SOMENAME',
-                  'PID': 'PID|1||14891584^^^^EPI~62986117^^^^SOMERN||'+name[0].upper()+'^'+name[-1].upper()+'||'+dobint+'|'+random.choice(GENDER)+'|||'+fake.street_address().upper()+'^^'+fake.city().upper()+'^'+random.choice(US_STATES)+'^'+fake.postcode().upper()+'^USA^P^^SC',
-                  'PV1': 'PV1||O|168 ~219~C~PMA^^^^^^^^^||||277^'+name[-1].upper()+'^BONNIE^^^^|||||||||| ||2688684|||||||||||||||||||||||||202211031408||||||002376853',
-                  'IN1': 'IN1|1|PRE2||'+ random.choice(INSURANCE) +'|PO BOX 23523^WELLINGTON^ON^98111|||19601||||||||'+name[-1].upper()+'^'+name[0].upper()+'^M|F|||||||||||||||||||ZKA'+visitnum+''
-                 })
-
-        # local files
-        #with open('sample_jsons/'+filename,"w") as json_file:
-        #    #json_file.write(json.dumps(sample))
-        #    json.dump(json.loads(json.dumps(sample)), json_file)
-
-        # RedisJSON
-        #R.json().set(filename, '$', json.dumps(sample))
-
-        # postgresql JSONB
-        insert_data(psql_cur, table, sample)
+    r_edis = redis.Redis(host=config_obj.get('redis','host'),
+                         port=config_obj.get('redis','port'), decode_responses=True)
+
+    def write_batch(batch):
+        pipe = r_edis.json().pipeline(transaction=False)
+        for record in batch:
+            pipe.set(sample_key(record), '$', record)
+        pipe.execute()
+
+    return write_batch, r_edis.close
+
+def ndjson_writer(output_dir, worker_index):
+    """Returns (write_batch, close) for one NDJSON file per worker
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    ndjson_file = open(os.path.join(output_dir, f'part-{worker_index:05d}.ndjson'), 'w',
+                       encoding='utf-8')
+
+    def write_batch(batch):
+        ndjson_file.write(''.join(json.dumps(record) + '\n' for record in batch))
+
+    return write_batch, ndjson_file.close
+
+def generate(worker_index, num_rows, options):
+    """Runs in a worker process - generate and write num_rows records in batches
+        returns number of rows written
+    """
+    seed = options['seed'] + worker_index
+    rng = random.Random(seed)
+    fake = Faker()
+    fake.seed_instance(seed)
+    words = word_pool(fake)
+
+    config_obj = read_config(options['config'])
+    if options['target'] == 'postgres':
+        write_batch, close = postgres_writer(config_obj, options['table'], options['pg_method'])
+    elif options['target'] == 'redis':
+        write_batch, close = redis_writer(config_obj)
+    else:
+        write_batch, close = ndjson_writer(options['output_dir'], worker_index)
+
+    start = time.perf_counter()
+    written = 0
+    try:
+        while written < num_rows:
+            batch = [sample_record(fake, words, rng)
+                     for _ in range(min(options['batch_size'], num_rows - written))]
+            write_batch(batch)
+            written += len(batch)
+    finally:
+        close()
+
+    elapsed = time.perf_counter() - start
+    logging.info('**** Worker %s wrote %s rows in %.2fs (%.0f rows/second) ****',
+                 worker_index, written, elapsed, written / elapsed if elapsed else 0)
+    return written
 
 if __name__ == '__main__':
-    p1 = Process(target=main)
-    p2 = Process(target=main)
-    p3 = Process(target=main)
-    p4 = Process(target=main)
-    p5 = Process(target=main)
-    p6 = Process(target=main)
-
-    p1.start()
-    p2.start()
-    p3.start()
-    p4.start()
-    p5.start()
-    p6.start()
-
-    p1.join()
-    p2.join()
-    p3.join()
-    p4.join()
-    p5.join()
-    p6.join()
+    logging.basicConfig(level=logging.INFO,format='%(asctime)s %(message)s',\
+            handlers=[logging.StreamHandler(sys.stdout)])
+
+    arg_parser = argparse.ArgumentParser(description='Generate synthetic HL7 JSON messages')
+    arg_parser.add_argument('--rows', dest='rows', type=int, default=2000000,
+                            help='Total number of messages, split across workers')
+    arg_parser.add_argument('--workers', dest='workers', type=int, default=6,
+                            help='Number of worker processes')
+    arg_parser.add_argument('--batch-size', dest='batch_size', type=int, default=5000,
+                            help='Messages per COPY / pipeline / file write')
+    arg_parser.add_argument('--target', dest='target', default='postgres',
+                            choices=['postgres', 'redis', 'ndjson'],
+                            help='PostgreSQL JSONB table, RedisJSON, or local NDJSON files')
+    arg_parser.add_argument('--pg-method', dest='pg_method', default='copy',
+                            choices=['copy', 'values'],
+                            help='COPY FROM STDIN or execute_values for --target postgres')
+    arg_parser.add_argument('--table', dest='table', default=None,
+                            help='PostgreSQL table, default [reportdb] sample.table or hl7_jsons')
+    arg_parser.add_argument('--output-dir', dest='output_dir', default='sample_jsons',
+                            help='Directory for --target ndjson, one part-NNNNN.ndjson per worker')
+    arg_parser.add_argument('--config', dest='config', default='etl.config',
+                            help='etl.config with the [reportdb] and [redis] sections')
+    arg_parser.add_argument('--seed', dest='seed', type=int, default=0,
+                            help='Base seed, worker N uses seed + N')
+    args = arg_parser.parse_args()
+
+    gen_options = {
+        'target': args.target,
+        'pg_method': args.pg_method,
+        'table': args.table or read_config(args.config).get('reportdb', 'sample.table',
+                                                              fallback='hl7_jsons'),
+        'output_dir': args.output_dir,
+        'batch_size': args.batch_size,
+        'config': args.config,
+        'seed': args.seed,
+    }
+
+    gen_start = time.perf_counter()
+    with Pool(args.workers) as pool:
+        total = sum(pool.starmap(generate,
+                                 [(index, count, gen_options) for index, count
+                                  in enumerate(partition_counts(args.rows, args.workers))]))
+    gen_elapsed = time.perf_counter() - gen_start
+    logging.info('**** Wrote %s rows to %s in %.2fs (%.0f rows/second) ****',
+                 total, args.target, gen_elapsed, total / gen_elapsed if gen_elapsed else 0)
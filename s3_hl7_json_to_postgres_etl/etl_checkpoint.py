@@ -0,0 +1,97 @@
+"""Checkpoint store for incremental HL7 ETL runs
+    One row per (feed, source object/key) with the updatedAt that was last loaded,
+    kept in a small PostgreSQL table next to the feed tables.
+   See README.md for more details
+"""
+
+import logging
+import psycopg2
+from psycopg2.extras import execute_values
+from pyspark.sql import functions as F
+
+CHECKPOINT_TABLE = 'etl_checkpoint'
+
+# column carrying the S3 object path / Redis key of each message
+SOURCE_COLUMN = 'sourcekey'
+
+def create_checkpoint_table(psql_cur):
+    """Create the checkpoint table
+    """
+
+    psql_cur.execute(f"""CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} (
+                            feed text NOT NULL,
+                            source text NOT NULL,
+                            updatedat text,
+                            loaded_at timestamptz NOT NULL DEFAULT now(),
+                            PRIMARY KEY (feed, source));""")
+    psql_cur.connection.commit()
+
+def read_checkpoints(sparksession, jdbc_url, properties, feed):
+    """Checkpoints for a feed as a DataFrame (source, updatedat)
+        the feed filter is pushed down to PostgreSQL with the value quoted by Spark,
+        feed is never formatted into the SQL
+    """
+
+    return (sparksession.read.jdbc(jdbc_url, CHECKPOINT_TABLE, properties=properties)
+            .filter(F.col('feed') == feed)
+            .select('source', 'updatedat'))
+
+def filter_new_messages(json_df, checkpoint_df):
+    """Drop messages no newer than the updatedAt checkpointed for their source
+        the checkpoint is a watermark - one S3 object can hold several messages and
+        only the latest updatedAt is kept. A message without updatedAt is only new
+        when its source has no checkpoint
+        json_df needs lower case sourcekey and updatedat columns
+    """
+
+    seen = checkpoint_df.select(F.col('source').alias('_cp_source'),
+                                F.col('updatedat').alias('_cp_updatedat'))
+    loaded = (json_df['updatedat'].isNull() |
+              (seen['_cp_updatedat'].isNotNull() &
+               (json_df['updatedat'] <= seen['_cp_updatedat'])))
+    condition = (json_df[SOURCE_COLUMN] == seen['_cp_source']) & loaded
+    return json_df.join(seen, condition, 'left_anti')
+
+def save_checkpoints(rows, feed, db_config, page_size=5000):
+    """Upsert (source, updatedat) pairs for a feed, returns number of sources
+        rows can be an executor partition or a driver side batch
+        one S3 object can hold several messages, only the latest updatedat of a
+        source is kept - ON CONFLICT can't update the same row twice in one statement.
+        A source's messages can land in several partitions, so GREATEST keeps a
+        checkpoint from moving back
+    """
+
+    latest = {}
+    for source, updatedat in rows:
+        if source not in latest or (updatedat is not None and
+                                    (latest[source] is None or updatedat > latest[source])):
+            latest[source] = updatedat
+    values = [(feed, source, updatedat) for source, updatedat in latest.items()]
+    if not values:
+        return 0
+
+    psql_conn = psycopg2.connect(**db_config)
+    try:
+        with psql_conn.cursor() as psql_cur:
+            execute_values(psql_cur,
+                           f"""INSERT INTO {CHECKPOINT_TABLE} (feed, source, updatedat)
+                               VALUES %s
+                               ON CONFLICT (feed, source)
+                               DO UPDATE SET updatedat = GREATEST({CHECKPOINT_TABLE}.updatedat,
+                                                                  EXCLUDED.updatedat),
+                                             loaded_at = now();""",
+                           values, page_size=page_size)
+        psql_conn.commit()
+    finally:
+        psql_conn.close()
+    return len(values)
+
+def save_df_checkpoints(json_df, feed, db_config):
+    """Upsert checkpoints for every message in json_df from the executors
+    """
+
+    saved = (json_df.select(SOURCE_COLUMN, 'updatedat').rdd
+             .mapPartitions(lambda rows: [save_checkpoints(rows, feed, db_config)])
+             .sum())
+    logging.info('**** Checkpointed %s sources for %s ****', saved, feed)
+    return saved
@@ -0,0 +1,162 @@
+"""Dead letters for HL7 messages that could not be fully parsed
+    One entry per (feed, source, segment) with the error and the raw record, kept in a
+    PostgreSQL table next to the feed tables or in NDJSON files. A replay run reads the
+    records back as its source and clears the ones that parse now.
+   See README.md for more details
+"""
+
+import json
+import logging
+import os
+import time
+import psycopg2
+from psycopg2.extras import execute_values
+from pyspark.sql import functions as F
+
+DEAD_LETTER_TABLE = 'etl_dead_letter'
+
+# column carrying the S3 object path / Redis key of each message, see etl_checkpoint.py
+SOURCE_COLUMN = 'sourcekey'
+
+def dead_letter_rows(adict, feed, errors):
+    """(feed, source, segment, error, record) for each failed segment of a record
+    """
+
+    record = json.dumps(adict, default=str)
+    return [(feed, adict.get(SOURCE_COLUMN) or '', segment, error, record)
+            for segment, error in errors]
+
+def create_dead_letter_table(psql_cur):
+    """Create the dead letter table
+    """
+
+    psql_cur.execute(f"""CREATE TABLE IF NOT EXISTS {DEAD_LETTER_TABLE} (
+                            feed text NOT NULL,
+                            source text NOT NULL,
+                            segment text NOT NULL,
+                            error text,
+                            record text,
+                            failed_at timestamptz NOT NULL DEFAULT now(),
+                            PRIMARY KEY (feed, source, segment));""")
+    psql_cur.connection.commit()
+
+def save_dead_letters(rows, db_config, page_size=1000):
+    """Upsert dead letter rows, returns number of rows
+        a message that fails again gets a new error and failed_at
+    """
+
+    # a key can only be upserted once per statement
+    rows = list({row[:3]: row for row in rows}.values())
+    if not rows:
+        return 0
+
+    psql_conn = psycopg2.connect(**db_config)
+    try:
+        with psql_conn.cursor() as psql_cur:
+            execute_values(psql_cur,
+                           f"""INSERT INTO {DEAD_LETTER_TABLE} (feed, source, segment, error, record)
+                               VALUES %s
+                               ON CONFLICT (feed, source, segment)
+                               DO UPDATE SET error = EXCLUDED.error, record = EXCLUDED.record,
+                                             failed_at = now();""",
+                           rows, page_size=page_size)
+        psql_conn.commit()
+    finally:
+        psql_conn.close()
+    return len(rows)
+
+def write_dead_letters_ndjson(rows, dead_letter_dir, name):
+    """Write dead letter rows to <dead_letter_dir>/<feed>/<name>.ndjson
+        rows of one call must share a feed, returns number of rows
+    """
+
+    if not rows:
+        return 0
+
+    feed_dir = os.path.join(dead_letter_dir, rows[0][0])
+    os.makedirs(feed_dir, exist_ok=True)
+    failed_at = time.time()
+    with open(os.path.join(feed_dir, f'{name}.ndjson'), 'w', encoding='utf-8') as ndjson_file:
+        for feed, source, segment, error, record in rows:
+            ndjson_file.write(json.dumps({'feed': feed, 'source': source, 'segment': segment,
+                                          'error': error, 'record': record,
+                                          'failed_at': failed_at}) + '\n')
+    return len(rows)
+
+def save_dead_letter_rows(rows, dead_letter, name):
+    """Save rows to the configured sink
+        dead_letter - {'sink': 'postgres'|'ndjson', 'db_config': ..., 'path': ...}
+        name - unique per writer, used for NDJSON file names
+    """
+
+    if dead_letter['sink'] == 'ndjson':
+        count = write_dead_letters_ndjson(rows, dead_letter['path'], name)
+    else:
+        count = save_dead_letters(rows, dead_letter['db_config'])
+    if count:
+        logging.info('**** Dead-lettered %s segments ****', count)
+    return count
+
+def dead_letter_files(dead_letter_dir, feed):
+    """NDJSON dead letter files of a feed
+    """
+
+    feed_dir = os.path.join(dead_letter_dir, feed)
+    if not os.path.isdir(feed_dir):
+        return []
+    return sorted(os.path.join(feed_dir, afile) for afile in os.listdir(feed_dir)
+                  if afile.endswith('.ndjson'))
+
+def read_dead_letter_records(sparksession, dead_letter, feed, jdbc_url=None, properties=None):
+    """Raw records of a feed's dead letters as an RDD of JSON strings
+        returns (rdd, replay marker) for clear_replayed - the NDJSON files read,
+        or the database time the replay started
+    """
+
+    if dead_letter['sink'] == 'ndjson':
+        files = dead_letter_files(dead_letter['path'], feed)
+        if not files:
+            return sparksession.sparkContext.emptyRDD(), files
+        letters = sparksession.read.json(files)
+        return letters.select('record').rdd.map(lambda row: row.record), files
+
+    psql_conn = psycopg2.connect(**dead_letter['db_config'])
+    try:
+        with psql_conn.cursor() as psql_cur:
+            create_dead_letter_table(psql_cur)
+            # database clock, failed_at is set with now()
+            psql_cur.execute('SELECT now();')
+            replay_started = psql_cur.fetchone()[0]
+    finally:
+        psql_conn.close()
+    # the feed filter is pushed down with the value quoted by Spark, see read_checkpoints
+    letters = (sparksession.read.jdbc(jdbc_url, DEAD_LETTER_TABLE, properties=properties)
+               .filter(F.col('feed') == feed)
+               .select('source', 'record')
+               .distinct())
+    return letters.select('record').rdd.map(lambda row: row.record), replay_started
+
+def clear_replayed(dead_letter, feed, replay_marker):
+    """Remove dead letters that were replayed and did not fail again
+        records that failed again were re-saved after the replay started
+    """
+
+    if dead_letter['sink'] == 'ndjson':
+        for afile in replay_marker:
+            os.remove(afile)
+        logging.info('**** Removed %s replayed dead letter files for %s ****',
+                     len(replay_marker), feed)
+        return len(replay_marker)
+
+    psql_conn = psycopg2.connect(**dead_letter['db_config'])
+    try:
+        with psql_conn.cursor() as psql_cur:
+            psql_cur.execute(f"""DELETE FROM {DEAD_LETTER_TABLE}
+                                 WHERE feed = %s AND failed_at < %s;""",
+                             (feed, replay_marker))
+            cleared = psql_cur.rowcount
+        psql_conn.commit()
+    finally:
+        psql_conn.close()
+    logging.info('**** Cleared %s replayed dead letters for %s ****', cleared, feed)
+    return cleared
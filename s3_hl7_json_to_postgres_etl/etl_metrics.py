@@ -0,0 +1,134 @@
+"""Per-stage timings, row counts and driver memory for df_etl
+    One RunReport per feed. Each stage is wrapped in RunReport.stage(), which logs
+    duration, rows in/out and driver RSS, and the report is written as JSON when the
+    feed is done. One stage can be run under cProfile.
+   See README.md for more details
+"""
+
+import contextlib
+import cProfile
+import json
+import logging
+import os
+import resource
+import time
+
+def driver_rss_mb():
+    """Resident set size of this process in MB
+        peak RSS where /proc is not available
+    """
+
+    try:
+        with open('/proc/self/statm', encoding='utf-8') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1048576
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class RunReport:
+    """Stage records for one feed
+        report_dir - write the JSON report here, rows are only counted when set
+        profile_stage - run the stage with this name under cProfile
+    """
+
+    def __init__(self, feed, report_dir=None, profile_stage=None):
+        self.feed = feed
+        self.report_dir = report_dir
+        self.profile_stage = profile_stage
+        # one profiler for all runs of the stage, e.g. one per driver batch
+        self.profiler = cProfile.Profile() if profile_stage else None
+        self.started = time.time()
+        self.stages = []
+
+    def rows(self, data):
+        """Row count of a DataFrame, a list of dicts or a list of batches
+            DataFrames are counted with an extra Spark job and not persisted, nothing
+            is left cached after the stage, None when no report is written
+        """
+
+        if not self.report_dir or data is None or data is False:
+            return None
+        if hasattr(data, 'persist'):
+            return data.count()
+        if data and not isinstance(data[0], dict):
+            return sum(len(batch) for batch in data)
+        return len(data)
+
+    @contextlib.contextmanager
+    def stage(self, name, rows_in=None):
+        """Time a stage, the caller can set stage['rows_out']
+        """
+
+        stage = {'stage': name, 'rows_in': rows_in, 'rows_out': None}
+        profiler = self.profiler if name == self.profile_stage else None
+        rss_before = driver_rss_mb()
+        start = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            yield stage
+        finally:
+            if profiler:
+                profiler.disable()
+                stage['profile'] = self.dump_profile(profiler, name)
+            stage['seconds'] = round(time.perf_counter() - start, 3)
+            stage['rss_mb'] = round(driver_rss_mb(), 1)
+            stage['rss_delta_mb'] = round(stage['rss_mb'] - rss_before, 1)
+            self.stages.append(stage)
+            logging.info('**** %s: %.2fs, rows in %s out %s, driver RSS %.0f MB ****',
+                         name, stage['seconds'], stage['rows_in'], stage['rows_out'],
+                         stage['rss_mb'])
+
+    def timed_batches(self, name, batches):
+        """Yield from a lazy batch iterator, each wait for the next batch is a stage
+        """
+
+        batches = iter(batches)
+        while True:
+            with self.stage(name) as stage:
+                batch = next(batches, None)
+                stage['rows_out'] = None if batch is None else len(batch)
+            if batch is None:
+                return
+            yield batch
+
+    def dump_profile(self, profiler, name):
+        """Write cProfile stats (all runs of the stage so far) next to the report,
+            returns the file name
+        """
+
+        profile_dir = self.report_dir or '.'
+        os.makedirs(profile_dir, exist_ok=True)
+        profile_path = os.path.join(profile_dir,
+                                    f'{self.feed}_{int(self.started)}_{name}.prof')
+        profiler.dump_stats(profile_path)
+        logging.info('**** cProfile for %s written to %s ****', name, profile_path)
+        return profile_path
+
+    def as_dict(self):
+        """Report with per stage totals, stages that run per batch are summed
+        """
+
+        totals = {}
+        for stage in self.stages:
+            totals[stage['stage']] = round(totals.get(stage['stage'], 0) + stage['seconds'], 3)
+        return {
+            'feed': self.feed,
+            'started': self.started,
+            'seconds': round(time.time() - self.started, 3),
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'totals': totals,
+            'stages': self.stages,
+        }
+
+    def write(self):
+        """Write the JSON run report, returns its path or None
+        """
+
+        if not self.report_dir:
+            return None
+        os.makedirs(self.report_dir, exist_ok=True)
+        report_path = os.path.join(self.report_dir, f'{self.feed}_{int(self.started)}.json')
+        with open(report_path, 'w', encoding='utf-8') as report_file:
+            json.dump(self.as_dict(), report_file, indent=2)
+        logging.info('**** Run report for %s written to %s ****', self.feed, report_path)
+        return report_path
@@ -0,0 +1,202 @@
+"""Lightweight pipe-delimited HL7 segment parser
+    Splits on |, ~ and ^ using a field-position map compiled once from the hl7apy
+    reference, and produces the same {field}_{long}_{comp}_{long} names as
+    process_hl7_segment. Returns None whenever a segment needs hl7apy
+    (unknown segment/field/component, escape sequences, subcomponents).
+    parse_hl7_segment_fields wraps both in the raw segment cache - it lives here and
+    not in the ETL script, so Spark executors import it instead of unpickling it.
+   See README.md for more details
+"""
+
+import functools
+from hl7apy import load_reference, get_default_version
+from hl7apy.exceptions import ChildNotFound
+from hl7apy.parser import parse_segment, parse_field
+
+# segments handled by the fast path, everything else goes to hl7apy
+FAST_SEGMENTS = ('MSH', 'EVN', 'PID', 'PV1', 'IN1')
+
+# hl7apy escapes these in MSH_1/MSH_2 values
+ESCAPES = {'|': '\\F\\', '^': '\\S\\', '~': '\\R\\', '&': '\\T\\', '\\': '\\E\\'}
+
+# raw segment strings kept in the parse cache (per process/executor)
+SEGMENT_CACHE_SIZE = 65536
+
+def assign_child_name(sgchild):
+    """ assign child names
+    """
+
+    short_name = "None" if sgchild.name is None else sgchild.name
+    long_name = "None" if sgchild.long_name is None else sgchild.long_name
+
+    return short_name.lower(), long_name.lower()
+
+def column_part(name, long_name):
+    """same naming as assign_child_name
+    """
+
+    short_name = "None" if name is None else name
+    long_name = "None" if long_name is None else long_name
+
+    return f'{short_name.lower()}_{long_name.lower()}'
+
+@functools.lru_cache(maxsize=None)
+def field_positions(segment_name, version=None):
+    """compile {field index: (field name, field column prefix, datatype, components)}
+        for a segment - components is None for primitive fields, else
+        {component index: (component name, component column suffix)}
+    """
+
+    version = version or get_default_version()
+    positions = {}
+    index = 1
+    while True:
+        field_name = f'{segment_name}_{index}'
+        try:
+            ref = load_reference(field_name, 'Field', version)
+        except ChildNotFound:
+            break
+
+        datatype, long_name = ref[2], ref[3]
+        components = None
+        if ref[0] != 'leaf':
+            components = {pos: (comp[0], column_part(comp[0], comp[1][3]))
+                          for pos, comp in enumerate(ref[1], start=1)}
+        positions[index] = (field_name, column_part(field_name, long_name), datatype, components)
+        index += 1
+
+    return positions
+
+def split_fields(segment_data):
+    """split a segment into (segment name, [(field index, raw value)])
+        MSH counts the field separator as MSH_1
+    """
+
+    values = segment_data.split('|')
+    if values[0] == 'MSH':
+        return values[0], [(1, '|')] + list(enumerate(values[1:], start=2))
+    return values[0], list(enumerate(values[1:], start=1))
+
+def parse_segment_fields(segment_data, seg_fields, component_fields, fields):
+    """fast equivalent of parse_hl7_segment_fields
+        returns a tuple of (field_name, value) pairs, or None to fall back to hl7apy
+    """
+
+    if not isinstance(segment_data, str) or '\\' in segment_data:
+        return None
+
+    segment_name, raw_fields = split_fields(segment_data.strip('\r'))
+    if segment_name not in FAST_SEGMENTS:
+        return None
+
+    positions = field_positions(segment_name)
+    pairs = []
+    for index, raw_value in raw_fields:
+        # hl7apy skips blank fields and components, but keeps every primitive repetition
+        if not raw_value.strip():
+            continue
+        if index not in positions:
+            return None
+
+        field_name, field_part, datatype, components = positions[index]
+        if segment_name == 'MSH' and index in (1, 2):
+            if index == 2 and raw_value != '^~&':
+                return None
+            repetitions = [''.join(ESCAPES[char] for char in raw_value)]
+        elif '&' in raw_value:
+            # subcomponents
+            return None
+        else:
+            repetitions = raw_value.split('~')
+
+        if field_name in seg_fields:
+            continue
+
+        for repetition in repetitions:
+            if components is None:
+                if '^' in repetition:
+                    return None
+                if datatype in component_fields:
+                    continue
+                column = f'{field_part}_{column_part(datatype, None)}'
+                if column not in fields:
+                    pairs.append((column, repetition))
+                continue
+
+            for position, value in enumerate(repetition.split('^'), start=1):
+                if not value.strip():
+                    continue
+                if position not in components:
+                    return None
+                comp_name, comp_part = components[position]
+                if comp_name in component_fields:
+                    continue
+                column = f'{field_part}_{comp_part}'
+                if column not in fields:
+                    pairs.append((column, value))
+
+    return tuple(pairs)
+
+def parse_hl7apy_segment_fields(segment_data, seg_fields, component_fields, fields):
+    """Parse a raw HL7 segment string with hl7apy into (field_name, value) pairs
+
+        returns (pairs, error) - error is None, or the exception text if hl7apy
+        gave up part way, pairs then holds whatever was extracted before the error
+    """
+
+    pairs = []
+    try:
+        asegment = parse_segment(segment_data)
+        for achild in asegment.children:
+            ac_name, ac_long_name = assign_child_name(achild)
+            if ac_name.upper() in seg_fields:
+                continue
+
+            field = parse_field(achild.value, name=achild.name)
+            for fchild in field.children:
+                if fchild.name.upper() in component_fields:
+                    continue
+
+                fc_name, fc_long_name = assign_child_name(fchild)
+                field_name = f'{ac_name}_{ac_long_name}_{fc_name}_{fc_long_name}'
+                if field_name not in fields:
+                    pairs.append((field_name, fchild.value))
+    # hl7apy raises its own exceptions and AttributeError on malformed input,
+    # a bad segment must not fail the whole partition
+    except Exception as e_error:  # pylint: disable=broad-except
+        return tuple(pairs), f'{type(e_error).__name__}: {e_error}'
+    return tuple(pairs), None
+
+@functools.lru_cache(maxsize=SEGMENT_CACHE_SIZE)
+def parse_hl7_segment_fields(segment_data, seg_fields, component_fields, fields):
+    """Parse a raw HL7 segment string once into (field_name, value) pairs
+        memoized on the raw string - MSH/EVN headers repeat across messages
+        tries the fast splitter first, hl7apy only for what it can't handle
+    """
+
+    pairs = parse_segment_fields(segment_data, seg_fields, component_fields, fields)
+    if pairs is not None:
+        return pairs, None
+
+    return parse_hl7apy_segment_fields(segment_data, seg_fields, component_fields, fields)
+
+def pid_state(pid_segment):
+    """state (PID-11.4) the parsed row ends up with, read from the raw PID segment
+        the parsers skip blank components and later address repetitions overwrite
+        earlier ones, so it's the state of the last repetition that has one
+        cheap enough to filter messages before any full parse, None without a state
+    """
+
+    if not isinstance(pid_segment, str):
+        return None
+
+    fields = pid_segment.split('|')
+    if len(fields) < 12:
+        return None
+
+    state = None
+    for repetition in fields[11].split('~'):
+        components = repetition.split('^')
+        if len(components) > 3 and components[3]:
+            state = components[3]
+    return state
@@ -0,0 +1,180 @@
+"""Pure-Python engine for small HL7 feeds, no Spark session
+    Streams JSON records from RedisJSON or local NDJSON/JSON files, parses HL7 in a
+    process pool with the same process_record logic as the Spark path, and loads
+    PostgreSQL with COPY into the same v5_<feed> tables.
+   See README.md for more details
+"""
+
+import itertools
+import json
+import logging
+import multiprocessing
+import pathlib
+import time
+
+import s3_redis_json_to_psql_etl as etl
+from hl7_schemas import DEDUP_KEY
+
+# lower case like lower_case_col_names, records are matched after lower casing keys
+RECORD_DEDUP_KEY = tuple(key.lower() for key in DEDUP_KEY)
+
+# set once per worker process by init_worker
+WORKER_STATE = {}
+
+def iter_records(input_path):
+    """yield records with lower case keys, same as lower_case_col_names does for the DF
+        handles double encoded JSON written by older create_sample_data.py versions
+    """
+
+    path = pathlib.Path(input_path)
+    if path.is_dir():
+        # one JSON doc per *.json file, one per line in *.ndjson files
+        lines = itertools.chain(
+                    (afile.read_text(encoding='utf-8') for afile in sorted(path.glob('*.json'))),
+                    itertools.chain.from_iterable(afile.open(encoding='utf-8')
+                                                  for afile in sorted(path.glob('*.ndjson'))))
+    else:
+        lines = path.open(encoding='utf-8')
+
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if isinstance(record, str):
+            record = json.loads(record)
+        yield {key.lower(): value for key, value in record.items()}
+
+def iter_redis_records(redishost, redisport):
+    """yield RedisJSON docs with lower case keys, one JSON.MGET per batch
+    """
+
+    settings = etl.redis_read_settings(etl.read_config('etl.config'))
+    for batch in etl.iter_redis_json_batches(redishost, redisport, settings):
+        for doc in batch:
+            yield {key.lower(): value for key, value in doc.items()}
+
+def iter_psql_records(source_table):
+    """yield PostgreSQL JSONB messages with lower case keys, streamed with one
+        server-side cursor, source.fetchsize rows per round trip
+    """
+
+    p_config = etl.read_config('etl.config')
+    settings = etl.psql_source_settings(p_config)
+    psql_conn, _ = etl.psql_connection(p_config)
+    try:
+        for doc in etl.iter_psql_docs(psql_conn, source_table, [(0, None)],
+                                      settings['fetch_size']):
+            yield {key.lower(): value for key, value in doc.items()}
+    finally:
+        psql_conn.close()
+
+def source_records(s3bucketprefix, redishost, redisport, psql_source_table=None):
+    """records for a run, psql_source_table or 'JSON' (RedisJSON) like the Spark path,
+        anything else is a local NDJSON file or a directory of JSON files
+    """
+
+    if psql_source_table:
+        return iter_psql_records(psql_source_table)
+    if s3bucketprefix == 'JSON':
+        return iter_redis_records(redishost, redisport)
+    return iter_records(s3bucketprefix)
+
+def dedup_records(records):
+    """drop repeated messages, same key as dropDuplicates(DEDUP_KEY)
+    """
+
+    seen = set()
+    for record in records:
+        key = tuple(record.get(field) for field in RECORD_DEDUP_KEY)
+        if key in seen:
+            continue
+        seen.add(key)
+        yield record
+
+def chunked(records, chunk_size):
+    """yield lists of chunk_size records
+    """
+
+    records = iter(records)
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def init_worker(segments, ignore_lists):
+    """Pool initializer - keep the segments and ignore lists in the worker
+    """
+
+    WORKER_STATE['segments'] = segments
+    WORKER_STATE['ignore_lists'] = ignore_lists
+
+def parse_chunk(records):
+    """Runs in a worker - parse a chunk of records
+        returns (rows with output column names, number of records, number pre-filtered)
+    """
+
+    segments = WORKER_STATE['segments']
+    ignore_lists = WORKER_STATE['ignore_lists']
+    rows = []
+    prefiltered = 0
+    for record in records:
+        if not etl.passes_state_prefilter(record, ignore_lists['states']):
+            prefiltered += 1
+            continue
+        data_dict = etl.process_record(record, segments, ignore_lists)
+        if data_dict is not None:
+            rows.append({etl.output_column_name(col): value for col, value in data_dict.items()})
+    return rows, len(records), prefiltered
+
+def copy_rows(rows, tablename, p_config):
+    """COPY dict rows into the feed table, adding any new columns first
+        returns number of rows written
+    """
+
+    columns = list(dict.fromkeys(col for row in rows for col in row))
+    psql_conn, psql_cursor = etl.psql_connection(p_config)
+    try:
+        etl.create_table(tablename, columns, psql_cursor)
+    finally:
+        psql_conn.close()
+
+    chunk_rows = p_config.getint('reportdb', 'copy.chunkrows', fallback=10000)
+    values = (tuple(row.get(col) for col in columns) for row in rows)
+    return sum(etl.copy_partition(values, tablename, columns, etl.psql_db_config(p_config),
+                                  chunk_rows))
+
+def run_feed(adtfeed, segments, records, ignore_lists, workers=None, chunk_size=1000):
+    """Parse records in a process pool and COPY the rows into v5_<feed>
+        rows are buffered up to copy.chunkrows before each COPY
+    """
+
+    logging.info('**** Start Processing HL7 with %s local workers ****',
+                 workers or multiprocessing.cpu_count())
+    start = time.perf_counter()
+
+    p_config = etl.read_config('etl.config')
+    load_rows = p_config.getint('reportdb', 'copy.chunkrows', fallback=10000)
+    tablename = etl.feed_table_name(adtfeed)
+
+    messages = prefiltered = written = 0
+    buffer = []
+    with multiprocessing.Pool(workers, initializer=init_worker,
+                              initargs=(segments, ignore_lists)) as pool:
+        for rows, num_records, num_prefiltered in pool.imap_unordered(
+                parse_chunk, chunked(dedup_records(records), chunk_size)):
+            messages += num_records
+            prefiltered += num_prefiltered
+            buffer.extend(rows)
+            if len(buffer) >= load_rows:
+                written += copy_rows(buffer, tablename, p_config)
+                buffer = []
+    if buffer:
+        written += copy_rows(buffer, tablename, p_config)
+
+    elapsed = time.perf_counter() - start
+    logging.info('**** State pre-filter skipped parsing %s of %s messages ****',
+                 prefiltered, messages)
+    logging.info('**** Stored %s rows in table %s in %.2fs (%.0f messages/second) ****',
+                 written, tablename, elapsed, messages / elapsed if elapsed else 0)
+    return written
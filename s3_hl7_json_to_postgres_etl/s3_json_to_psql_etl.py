@@ -8,28 +8,57 @@
 import ast
 import argparse
 import configparser
+import functools
 import sys
 import time
 from ast import literal_eval as make_tuple
-from datetime import datetime
-from hl7apy.parser import parse_segment, parse_field
+from datetime import datetime, timedelta
+from hl7_fast_parser import parse_hl7_segment_fields
+from etl_checkpoint import (create_checkpoint_table, filter_new_messages,
+                            read_checkpoints, save_df_checkpoints)
 from py4j.protocol import Py4JJavaError
 from pyspark.sql import SparkSession
 from pyspark.sql.utils import AnalysisException, ParseException
-from pyspark.sql.types import StructType,StructField, StringType
+from etl_metrics import RunReport
+from hl7_schemas import DEDUP_KEY, SOURCE_FIELD, hl7_json_schema
+from pyspark.sql import functions as F
+import psycopg2
 
 # transformed fields to ignore
 with open('hl7_field_names_to_ignore.txt', encoding='utf-8') as afile:
     IGNORE_FIELDS = [line.rstrip('\n') for line in afile]
+IGNORE_FIELDS_SET = frozenset(IGNORE_FIELDS)
 
-def date_to_prefix():
+# default states to keep, per feed overrides in etl.config [states]
+STATES = ['CA', 'OR', 'WA', 'ID', 'UT']
+
+# incremental runs replace rows with the same keys (pt_visit_number is PV1-19, visitNumber)
+UPSERT_KEYS = ('patientid', 'pt_visit_number')
+# MSH-7 date/time of message, the latest message wins when a run has several per key
+MESSAGE_TIME_FIELD = 'msh_7_date_time_of_message_ts_1_time'
+
+def date_to_prefix(a_date=None):
     """for lambda version - use this prefix to pick most recent
         json dump from mirth into s3 buckets
     """
 
-    date_prefix = '/' + datetime.today().strftime('%Y/%-m/%-d')
+    a_date = a_date or datetime.today()
+    date_prefix = '/' + a_date.strftime('%Y/%-m/%-d')
     return date_prefix
 
+def dated_s3_path(s3_full_path, days):
+    """only read the last N days of yyyy/m/d prefixes under s3_full_path
+        one Hadoop glob with {a,b} alternation, so days without files are skipped
+    """
+
+    if not days:
+        return s3_full_path
+
+    today = datetime.today()
+    day_prefixes = ','.join(date_to_prefix(today - timedelta(days=offset)).lstrip('/')
+                            for offset in range(days))
+    return f"{s3_full_path.rstrip('/')}/{{{day_prefixes}}}/*.json"
+
 def read_config(file_path):
     """ read config file
     """
@@ -38,66 +67,97 @@ def read_config(file_path):
     config_obj.read(file_path)
     return config_obj
 
-def get_s3_jsons(sparksession, s3_full_path):
+def get_s3_jsons(sparksession, s3_full_path, segments=None, days=0):
     """ get all jsons
     """
-    # predefining schema saved ~15 mins!!
-    schema = StructType(
-                        [StructField("patientId", StringType(), True),
-                        StructField("tenantId", StringType(), True),
-                        StructField("dob", StringType(), True),
-                        StructField("id", StringType(), True),
-                        StructField("updatedAt", StringType(), True),
-                        StructField("createdAt", StringType(), True),
-                        StructField("visitNumber", StringType(), True),
-                        StructField("MSH", StringType(), True),
-                        StructField("EVN", StringType(), True),
-                        StructField("PID", StringType(), True),
-                        StructField("PV1", StringType(), True)]
-                       )
+    # predefining schema saved ~15 mins!! - shared with the Redis/S3 v5 script
+    schema = hl7_json_schema(segments)
+    s3_full_path = dated_s3_path(s3_full_path, days)
     try:
-        a_d_f = sparksession.read.json("s3a://" + s3_full_path, multiLine=True, schema=schema).dropDuplicates()
+        a_d_f = sparksession.read.json("s3a://" + s3_full_path, multiLine=True, schema=schema)
+        # source object for checkpoints, must be taken before the dropDuplicates shuffle
+        a_d_f = a_d_f.withColumn(SOURCE_FIELD, F.input_file_name()).dropDuplicates(DEDUP_KEY)
         return a_d_f
     except (AnalysisException,ParseException, Py4JJavaError):
         print ("Unable to read JSON files at", s3_full_path)
         sys.exit(-1)
 
-def assign_child_name(sgchild):
-    """ assign child names
+def feed_states(config_obj, adtfeed):
+    """states to keep for a feed - [states] <feed> or default, else STATES
     """
 
-    short_name = "None" if sgchild.name is None else sgchild.name
-    long_name = "None" if sgchild.long_name is None else sgchild.long_name
+    if config_obj.has_option('states', adtfeed):
+        return ast.literal_eval(config_obj.get('states', adtfeed))
+    if config_obj.has_option('states', 'default'):
+        return ast.literal_eval(config_obj.get('states', 'default'))
+    return STATES
+
+def state_filter_column(states):
+    """cheap pre-filter on PID-11.4 of the raw pid column, before any HL7 parsing
+        keeps exactly the messages whose parsed pt_address_state_prov is in states,
+        the state of the last address repetition that has one
+    """
 
-    return short_name.lower(), long_name.lower()
+    pid_11 = F.regexp_extract(F.col('pid'), r'^(?:[^|]*\|){11}([^|]*)', 1)
+    # PID-11.4 of every address repetition, '' when it has none
+    rep_states = F.transform(F.split(pid_11, '~'),
+                             lambda rep: F.regexp_extract(rep, r'^(?:[^^]*\^){3}([^^]*)', 1))
+    # blank components are skipped and a later repetition overwrites an earlier one
+    state = F.aggregate(rep_states, F.lit(None).cast('string'),
+                        lambda last, rep_state: F.when(rep_state != '', rep_state)
+                                                 .otherwise(last))
+    return state.isin(list(states))
+
+def ignore_lists_from_globals():
+    """Ignore lists as the hashable sets hl7_fast_parser caches on
+    """
 
-def process_hl7_segment(hl7_segment, json_dict, new_data_dict):
+    return {
+        'fields': IGNORE_FIELDS_SET,
+        'seg_fields': frozenset(IGNORE_SEG_FIELDS),
+        'component_fields': frozenset(IGNORE_COMPONENT_FIELDS),
+    }
+
+def process_hl7_segment(hl7_segment, json_dict, new_data_dict, ignore_lists=None):
     """parse HL7 raw data - extract values for segments and associated fields, create a dictionary.
         Add dictironay to list of dictionarties.
     """
 
+    if ignore_lists is None:
+        ignore_lists = ignore_lists_from_globals()
+
     try:
         segment_data = json_dict[hl7_segment]
-        asegment = parse_segment(segment_data)
-        for achild in asegment.children:
-            ac_name, ac_long_name = assign_child_name(achild)
-            if ac_name.upper() not in IGNORE_SEG_FIELDS:
-                field = parse_field(achild.value, name=achild.name)
-                for fchild in field.children:
-                    if fchild.name.upper() not in IGNORE_COMPONENT_FIELDS:
-                        fc_name, fc_long_name = assign_child_name(fchild)
-                        field_name = f'{ac_name}_{ac_long_name}_{fc_name}_{fc_long_name}'
-                        if field_name not in IGNORE_FIELDS:
-                            new_data_dict[field_name] = fchild.value
-
-        return new_data_dict
     except (KeyError, ValueError):
         return False
+    # the explicit read schema has a column for every segment, missing ones are None
+    if not segment_data:
+        return False
+
+    pairs, error = parse_hl7_segment_fields(segment_data, ignore_lists['seg_fields'],
+                                            ignore_lists['component_fields'],
+                                            ignore_lists['fields'])
+    new_data_dict.update(pairs)
+    if error is not None:
+        return False
+    return new_data_dict
+
+def message_time(adict):
+    """MSH-7 date/time of message taken from the raw msh segment, no parsing
+        None if the message has no MSH-7
+    """
+
+    msh_fields = (adict['msh'] or '').split('|')
+    if len(msh_fields) <= 6:
+        return None
+    return msh_fields[6].split('^')[0] or None
 
-def process_data(json_df, segments, sparksession):
+def process_data(json_df, segments, sparksession, with_message_time=False):
     """process HL7 data
+        with_message_time - keep MSH-7 even when msh isn't in segments, upserts order on it
     """
     parsed_data = []
+    ignore_lists = ignore_lists_from_globals()
 
     for adict in json_df.collect():
         data_dict = {
@@ -105,45 +165,52 @@ def process_data(json_df, segments, sparksession):
             'dob': adict['dob']
         }
 
+        # each segment is parsed exactly once, data_dict is updated in place
         for s_g in segments:
-            if not process_hl7_segment(s_g, adict, data_dict):
-                continue
-            data_dict = process_hl7_segment(s_g, adict, data_dict)
+            process_hl7_segment(s_g, adict, data_dict, ignore_lists)
+
+        if with_message_time and MESSAGE_TIME_FIELD not in data_dict:
+            data_dict[MESSAGE_TIME_FIELD] = message_time(adict)
 
         parsed_data.append(data_dict)
+
+    # Spark can't infer a schema from no rows, e.g. an incremental run with nothing new
+    if not parsed_data:
+        return None
     print ('**** Create DF ****')
     a_d_f = sparksession.createDataFrame(parsed_data)
     return a_d_f
 
-def rename_df_columns(data_frame):
-    """read (orig, new) tuples from a file into list of tuples
-        rename columns to more readable format
+@functools.lru_cache(maxsize=None)
+def load_rename_map(map_file="field_map.txt"):
+    """read (orig, new) tuples from a file into a dict, once per process
     """
 
-    with open("field_map.txt", encoding='utf-8') as field_map_file:
-        rename_map = field_map_file.readlines()
+    with open(map_file, encoding='utf-8') as field_map_file:
+        return dict(make_tuple(arow) for arow in field_map_file if arow.strip())
 
-    for arow in rename_map:
-        atuple = make_tuple(arow)
-        orig = atuple[0]
-        new = atuple[-1]
-        data_frame = data_frame.withColumnRenamed(orig, new)
+def rename_df_columns(data_frame):
+    """rename columns to more readable format, in a single select
+    """
 
-    return data_frame
+    rename_map = load_rename_map()
+    return data_frame.select([F.col(f'`{col_name}`').alias(rename_map.get(col_name, col_name))
+                              for col_name in data_frame.columns])
 
 def truncate_col_name(a_df):
     """catch column names that are greater than 63 bytes
-        truncate them for postgres
+        truncate them for postgres, in a single select
     """
 
+    new_names = []
     for col_name in a_df.columns:
         size_bytes = len(col_name.encode('utf-8'))
         if size_bytes > 63:
             print ('Long column name',col_name)
-            truncated  = col_name[:62]
-            print ('Truncated column name',truncated)
-            a_df = a_df.withColumnRenamed(col_name, truncated)
-    return a_df
+            col_name = col_name[:62]
+            print ('Truncated column name',col_name)
+        new_names.append(col_name)
+    return a_df.toDF(*new_names)
 
 def lower_case_col_names(a_df):
     """lower case column names
@@ -152,21 +219,28 @@ def lower_case_col_names(a_df):
     a_df = a_df.toDF(*[c.lower() for c in a_df.columns]) #lowercase column names
     return a_df
 
-def df_to_jdbc(a_df, adtfeed):
-    """jdbc processed df into postgres
+def psql_db_config(config_obj):
+    """psycopg2 connection arguments, used for checkpoints
+    """
+
+    return {
+        'database': config_obj.get('reportdb','dbname'),
+        'host': config_obj.get('reportdb','host'),
+        'user': config_obj.get('reportdb','dbuser'),
+        'password': config_obj.get('reportdb','dbuserpass'),
+        'port': config_obj.get('reportdb','port'),
+    }
+
+def jdbc_settings(config_obj):
+    """jdbc url and properties for the report db
     """
 
-    config_obj = read_config('etl.config')
     dbhost = config_obj.get('reportdb','host')
     dbport = config_obj.get('reportdb','port')
     dbname = config_obj.get('reportdb','dbname')
     dbuser = config_obj.get('reportdb','dbuser')
     dbuserpass = config_obj.get('reportdb','dbuserpass')
 
-    # no - in tablename...
-    datamodel_ver = 'v4'
-    tablename = datamodel_ver + '_' + adtfeed.replace('-','_')
-
     url = "jdbc:postgresql://"+dbhost+":"+dbport+"/"+dbname
     properties = {
                     "user": dbuser,
@@ -174,6 +248,22 @@ def df_to_jdbc(a_df, adtfeed):
                     "driver": "org.postgresql.Driver",
                     "batchsize" : "2000"
                     }
+    return url, properties
+
+def feed_table_name(adtfeed):
+    """no - in tablename...
+    """
+
+    datamodel_ver = 'v4'
+    return datamodel_ver + '_' + adtfeed.replace('-','_')
+
+def df_to_jdbc(a_df, adtfeed):
+    """jdbc processed df into postgres
+    """
+
+    tablename = feed_table_name(adtfeed)
+
+    url, properties = jdbc_settings(read_config('etl.config'))
     try:
         # mode("ingore") is just NOOP if table (or another sink) already exists
         #  and writing modes cannot be combined. If you're looking for something
@@ -186,40 +276,138 @@ def df_to_jdbc(a_df, adtfeed):
         print (e_error)
         sys.exit(-1)
 
-def df_etl(sparksession, adtfeedname, segments, s3bucketprefix):
-    """Apache Spark Magic happens here
+def df_to_jdbc_upsert(a_df, adtfeed, db_config, upsert_keys=UPSERT_KEYS,
+                      order_by=MESSAGE_TIME_FIELD):
+    """jdbc processed df into a staging table, then replace the rows with the same
+        upsert_keys in the feed table in one transaction - incremental runs bring
+        changed messages back, a plain append would duplicate them
     """
 
-    df_jsons = ''
-    transformed = ''
-    d_f = ''
-
-    d_f = get_s3_jsons(sparksession, s3bucketprefix)
-    d_f = lower_case_col_names(d_f)
+    missing = [key for key in upsert_keys + (order_by,) if key not in a_df.columns]
+    if missing:
+        raise ValueError(f"Can't upsert {adtfeed}, missing columns {', '.join(missing)}")
 
-    # process HL7 segments
-    d_f = process_data(d_f, segments, sparksession)
+    tablename = feed_table_name(adtfeed)
+    staging = f'{tablename}_staging_{int(time.time())}'
+    url, properties = jdbc_settings(read_config('etl.config'))
+    a_df.write.jdbc(url, staging, mode="overwrite", properties=properties)
 
-    d_f = rename_df_columns(d_f)
+    # spark jdbc creates quoted column names
+    col_list = ', '.join(f'"{col}"' for col in a_df.columns)
+    key_list = ', '.join(f'"{key}"' for key in upsert_keys)
+    # a NULL visit number still matches the row it replaces
+    key_match = ' AND '.join(f'{tablename}."{key}" IS NOT DISTINCT FROM {staging}."{key}"'
+                             for key in upsert_keys)
 
-    d_f.createOrReplaceTempView("patients")
-    sql_query = "select * from patients where \
-                pt_address_state_prov in ('CA', 'OR', 'WA', 'ID', 'UT')"
+    psql_conn = psycopg2.connect(**db_config)
     try:
-        d_f = sparksession.sql(sql_query)
-    except AnalysisException as e_error:
-        print ("Query Failed", e_error)
-        sys.exit(-1)
+        with psql_conn.cursor() as psql_cur:
+            psql_cur.execute(f'CREATE TABLE IF NOT EXISTS {tablename} (LIKE {staging});')
+            # LIKE only applies to a new table, an existing one gets the new columns here
+            psql_cur.execute("""SELECT column_name FROM information_schema.columns
+                                WHERE table_schema = current_schema() AND table_name = %s;""",
+                             (tablename.lower(),))
+            existing = {row[0] for row in psql_cur.fetchall()}
+            new_columns = [col for col in a_df.columns if col not in existing]
+            if new_columns:
+                psql_cur.execute(f'ALTER TABLE {tablename} ' +
+                                 ', '.join(f'ADD COLUMN IF NOT EXISTS "{col}" text'
+                                           for col in new_columns) + ';')
+            psql_cur.execute(f'DELETE FROM {tablename} USING {staging} WHERE {key_match};')
+            psql_cur.execute(f'INSERT INTO {tablename} ({col_list}) '
+                             f'SELECT DISTINCT ON ({key_list}) {col_list} FROM {staging} '
+                             f'ORDER BY {key_list}, "{order_by}" DESC NULLS LAST;')
+        psql_conn.commit()
+    finally:
+        # a failed upsert leaves the transaction aborted
+        psql_conn.rollback()
+        with psql_conn.cursor() as psql_cur:
+            psql_cur.execute(f'DROP TABLE IF EXISTS {staging};')
+        psql_conn.commit()
+        psql_conn.close()
+    print ("**** Upserted data in table "+ tablename)
+    return True
+
+def df_etl(sparksession, adtfeedname, segments, s3bucketprefix, incremental=False, days=0,
+           report_dir=None, profile_parse=False):
+    """Apache Spark Magic happens here
+        incremental - skip messages no newer than their S3 object's checkpoint,
+            upsert on UPSERT_KEYS instead of appending, latest MSH-7 wins
+        days - only read the last N days of date prefixes
+        report_dir - write a JSON run report with per stage timings, rows and driver RSS
+        profile_parse - run process_data under cProfile
+    """
 
-    # don't go any further if DF is empty
-    if d_f.count() < 1:
-        print ('Skipping Empty dataframe',d_f.count())
-        sys.exit(-1)
+    df_jsons = ''
+    d_f = ''
+    report = RunReport(adtfeedname, report_dir, 'process_data' if profile_parse else None)
+
+    with report.stage('read') as stage:
+        d_f = get_s3_jsons(sparksession, s3bucketprefix, segments, days)
+        stage['rows_out'] = report.rows(d_f)
+
+    with report.stage('lower_case_col_names', stage['rows_out']) as stage:
+        d_f = lower_case_col_names(d_f)
+        stage['rows_out'] = stage['rows_in']
+
+    if incremental:
+        with report.stage('filter_new_messages', stage['rows_out']) as stage:
+            config_obj = read_config('etl.config')
+            db_config = psql_db_config(config_obj)
+            psql_conn = psycopg2.connect(**db_config)
+            create_checkpoint_table(psql_conn.cursor())
+            psql_conn.close()
+            url, properties = jdbc_settings(config_obj)
+            print ('**** Skipping S3 objects already checkpointed for', adtfeedname)
+            d_f = filter_new_messages(d_f, read_checkpoints(sparksession, url, properties,
+                                                            adtfeedname)).persist()
+            stage['rows_out'] = report.rows(d_f)
+    df_jsons = d_f
+
+    # drop out of state messages before they are collected and parsed
+    states = feed_states(read_config('etl.config'), adtfeedname)
+    d_f = d_f.filter(state_filter_column(states))
 
-    d_f = truncate_col_name(d_f)
-    df_to_jdbc(d_f, adtfeedname)
+    # process HL7 segments
+    with report.stage('process_data', stage['rows_out']) as stage:
+        d_f = process_data(d_f, segments, sparksession, with_message_time=incremental)
+        stage['rows_out'] = report.rows(d_f)
+
+    # no messages left is a normal incremental run, skip the write and go on
+    if d_f is not None:
+        with report.stage('rename_df_columns', stage['rows_out']) as stage:
+            d_f = rename_df_columns(d_f)
+            stage['rows_out'] = stage['rows_in']
+
+        d_f.createOrReplaceTempView("patients")
+        sql_query = "select * from patients where \
+                    pt_address_state_prov in (" + ', '.join(f"'{state}'" for state in states) + ")"
+        try:
+            d_f = sparksession.sql(sql_query)
+        except AnalysisException as e_error:
+            print ("Query Failed", e_error)
+            sys.exit(-1)
+
+    # don't write an empty DF, checkpoints are still saved
+    if d_f is None or d_f.count() < 1:
+        print ('Skipping Empty dataframe for', adtfeedname)
+    else:
+        with report.stage('truncate_col_name', report.rows(d_f)) as stage:
+            d_f = truncate_col_name(d_f)
+            stage['rows_out'] = stage['rows_in']
+        with report.stage('df_to_jdbc', stage['rows_out']):
+            if incremental:
+                df_to_jdbc_upsert(d_f, adtfeedname, db_config)
+            else:
+                df_to_jdbc(d_f, adtfeedname)
     d_f = ''
 
+    if incremental:
+        with report.stage('save_checkpoints'):
+            save_df_checkpoints(df_jsons, adtfeedname, db_config)
+        df_jsons.unpersist()
+    report.write()
+
 if __name__ == "__main__":
     arg_parser = argparse.ArgumentParser(description="Process JSON to PostgreSQL")
     arg_parser.add_argument (
@@ -240,6 +428,38 @@ if __name__ == "__main__":
                              help="Full path - <bucket-name>/prefix/",
                             )
 
+    arg_parser.add_argument (
+                             '--days',
+                             dest='days',
+                             action='store',
+                             type=int,
+                             default=0,
+                             required=False,
+                             help="Only read the last N days of yyyy/m/d prefixes under --s3-bucket-prefix",
+                            )
+    arg_parser.add_argument (
+                             '--incremental',
+                             dest='incremental',
+                             action='store_true',
+                             required=False,
+                             help="Only load S3 objects that are new or changed since the last checkpoint",
+                            )
+    arg_parser.add_argument (
+                             '--report-dir',
+                             dest='report_dir',
+                             action='store',
+                             default=None,
+                             required=False,
+                             help="Write a JSON run report per feed here - stage timings, rows in/out and driver RSS",
+                            )
+    arg_parser.add_argument (
+                             '--profile-parse',
+                             dest='profile_parse',
+                             action='store_true',
+                             required=False,
+                             help="Run process_data under cProfile, stats go to --report-dir",
+                            )
+
     args = arg_parser.parse_args()
 
     # since I had to deal with several adt feeds, I chose to
@@ -273,11 +493,14 @@ if __name__ == "__main__":
                          /var/tmp/sparkjars/hadoop-aws-3.3.4.jar")
              .getOrCreate())
 
+    spark.sparkContext.addPyFile('etl_checkpoint.py')
+
 
     # can pass more than one name
     for adt_feed in adt_feed_name.split(','):
         print ("**** Starting for", adt_feed)
-        df_etl(spark, adt_feed, HL7_SEGMENTS, s3_bucket_full_path)
+        df_etl(spark, adt_feed, HL7_SEGMENTS, s3_bucket_full_path, args.incremental, args.days,
+               args.report_dir, args.profile_parse)
         print ("**** Completed for", adt_feed)
 
     spark.stop()
@@ -7,18 +7,35 @@
 import ast
 import argparse
 import configparser
+import functools
+import io
+import json
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 import sys
+import threading
 import time
+import traceback
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from ast import literal_eval as make_tuple
-from hl7apy.parser import parse_segment, parse_field
+from hl7_fast_parser import parse_hl7_segment_fields, pid_state
+from etl_metrics import RunReport
+from hl7_schemas import DEDUP_KEY, SOURCE_FIELD, hl7_json_schema
+from etl_dead_letter import (clear_replayed, create_dead_letter_table, dead_letter_rows,
+                             read_dead_letter_records, save_dead_letter_rows)
+from etl_checkpoint import (SOURCE_COLUMN, create_checkpoint_table, filter_new_messages,
+                            read_checkpoints, save_checkpoints, save_df_checkpoints)
 from py4j.protocol import Py4JJavaError
+from pyspark import TaskContext
 from pyspark.sql import SparkSession
+from pyspark.sql import functions as F
 from pyspark.sql.utils import AnalysisException, ParseException
 import psycopg2
 import redis
-import numpy
+from redis.commands.json.path import Path
+from redis.crc import key_slot
 
 # transformed fields to ignore
 with open('hl7_field_names_to_ignore.txt', encoding='utf-8') as afile:
@@ -26,15 +43,40 @@ with open('hl7_field_names_to_ignore.txt', encoding='utf-8') as afile:
 
 # Constants
 STATES = ['CA', 'OR', 'WA', 'ID', 'UT']
+# incremental runs replace rows with the same keys (pt_visit_number is PV1-19, visitNumber)
+UPSERT_KEYS = ('patientid', 'pt_visit_number')
 
-def date_to_prefix():
+# JSONB column written by create_sample_data.py --target postgres
+PSQL_SOURCE_COLUMN = 'patientjson'
+
+# MSH-7 date/time of message, Parquet output is partitioned by its date
+MESSAGE_TIME_FIELD = 'msh_7_date_time_of_message_ts_1_time'
+
+# table name -> set of column names already in PostgreSQL, filled once per run
+TABLE_COLUMNS = {}
+
+def date_to_prefix(a_date=None):
     """for lambda version - use this prefix to pick most recent
         json dump from mirth into s3 buckets
     """
 
-    date_prefix = '/' + datetime.today().strftime('%Y/%-m/%-d')
+    a_date = a_date or datetime.today()
+    date_prefix = '/' + a_date.strftime('%Y/%-m/%-d')
     return date_prefix
 
+def dated_s3_path(s3_full_path, days):
+    """Limit the read to the last N days of yyyy/m/d prefixes under s3_full_path
+        one Hadoop glob with {a,b} alternation, so days without files are skipped
+    """
+
+    if not days:
+        return s3_full_path
+
+    today = datetime.today()
+    day_prefixes = ','.join(date_to_prefix(today - timedelta(days=offset)).lstrip('/')
+                            for offset in range(days))
+    return f"{s3_full_path.rstrip('/')}/{{{day_prefixes}}}/*.json"
+
 def read_config(file_path):
     """ read config file
     """
@@ -43,117 +85,452 @@ def read_config(file_path):
     config_obj.read(file_path)
     return config_obj
 
-def get_s3_jsons(sparksession, s3_full_path):
+def get_s3_jsons(sparksession, s3_full_path, segments=None, days=0):
     """ get all jsons
+        predefined schema - no inference pass, days - only the last N date prefixes
+        raises when the prefix is missing or unreadable so run_feed marks the feed failed
     """
 
+    s3_full_path = dated_s3_path(s3_full_path, days)
     try:
-        a_d_f = sparksession.read.json('s3a://' + s3_full_path, multiLine=True).dropDuplicates()
+        a_d_f = sparksession.read.json('s3a://' + s3_full_path, multiLine=True,
+                                       schema=hl7_json_schema(segments))
+        # input_file_name must be taken before the dropDuplicates shuffle
+        a_d_f = (a_d_f.withColumn(SOURCE_FIELD, F.input_file_name())
+                 .dropDuplicates(DEDUP_KEY))
         return a_d_f
     except (AnalysisException, ParseException, Py4JJavaError):
         logging.error('Unable to read JSON files at %s', s3_full_path)
-        sys.exit(-1)
+        raise
+
+def redis_read_settings(config_obj):
+    """Redis read tuning from etl.config [redis], with defaults
+    """
+
+    return {
+        'search_for': config_obj.get('redis', 'key.pattern', fallback='pid_*'),
+        'scan_count': config_obj.getint('redis', 'scan.count', fallback=1000),
+        'batch_size': config_obj.getint('redis', 'mget.batchsize', fallback=500),
+        'partitions': config_obj.getint('redis', 'read.partitions', fallback=840),
+    }
+
+def scan_redis_keys(r_edis, search_for, scan_count):
+    """SCAN for matching keys, scan_count keys per round trip
+    """
+
+    return r_edis.scan_iter(match=search_for, count=scan_count)
 
-def get_redis_jsons(redishost, redisport):
+def mget_redis_jsons(r_edis, keys):
+    """One JSON.MGET round trip, docs are tagged with their key as sourceKey
+        keys that disappeared since the SCAN are skipped
+    """
+
+    docs = []
+    for key, doc in zip(keys, r_edis.json().mget(keys, Path.root_path())):
+        if doc is None:
+            continue
+        # older create_sample_data.py versions stored the JSON as a string
+        if isinstance(doc, str):
+            doc = json.loads(doc)
+        doc['sourceKey'] = key
+        docs.append(doc)
+    return docs
+
+def fetch_redis_jsons(r_edis, keys, batch_size):
+    """Fetch RedisJSON docs with one JSON.MGET per batch of keys
+        yields lists of docs
+    """
+
+    batch = []
+    for key in keys:
+        batch.append(key)
+        if len(batch) >= batch_size:
+            yield mget_redis_jsons(r_edis, batch)
+            batch = []
+    if batch:
+        yield mget_redis_jsons(r_edis, batch)
+
+def iter_redis_json_batches(redishost, redisport, settings):
+    """Stream RedisJSON docs in batches without holding them all in memory
+    """
+
+    r_edis = redis.Redis(host=redishost, port=redisport, decode_responses=True)
+    keys = scan_redis_keys(r_edis, settings['search_for'], settings['scan_count'])
+    yield from fetch_redis_jsons(r_edis, keys, settings['batch_size'])
+
+def redis_jsons_to_ndjson(redishost, redisport, ndjson_path, settings):
+    """Spool RedisJSON docs to a local NDJSON file, one doc per line
+    """
+
+    count = 0
+    with open(ndjson_path, 'w', encoding='utf-8') as ndjson_file:
+        for batch in iter_redis_json_batches(redishost, redisport, settings):
+            for doc in batch:
+                ndjson_file.write(json.dumps(doc) + '\n')
+            count += len(batch)
+    logging.info('**** Wrote %s RedisJSON docs to %s ****', count, ndjson_path)
+    return count
+
+def fetch_redis_partition(keys, redishost, redisport, batch_size):
+    """Runs on executors - fetch one partition of keys with JSON.MGET
+        yields JSON strings
+    """
+
+    r_edis = redis.Redis(host=redishost, port=redisport, decode_responses=True)
+    for batch in fetch_redis_jsons(r_edis, keys, batch_size):
+        for doc in batch:
+            yield json.dumps(doc)
+
+def get_redis_jsons(sparksession, redishost, redisport, ndjson_path=None, segments=None):
     """Read JSON files from RedisJSON doc store
         expects key names starting with "pid_"
 
+        Only the keys are collected on the driver, sorted by hash slot so each
+        partition covers a contiguous slot range; executors fetch the docs.
+        With ndjson_path the docs are streamed to a local NDJSON file instead.
+
         Tested this against RedisJSON/Redis-Stack-Server v7.2.0
     """
 
-    jsons = []
+    settings = redis_read_settings(read_config('etl.config'))
+    schema = hl7_json_schema(segments, with_source=True)
+
+    logging.info('**** Getting following RedisJSON keys: %s ****', settings['search_for'])
+
+    if ndjson_path:
+        redis_jsons_to_ndjson(redishost, redisport, ndjson_path, settings)
+        return sparksession.read.json(ndjson_path, schema=schema).dropDuplicates(DEDUP_KEY)
 
     r_edis = redis.Redis(host=redishost, port=redisport, decode_responses=True)
+    json_keys = sorted(scan_redis_keys(r_edis, settings['search_for'], settings['scan_count']),
+                       key=lambda akey: key_slot(akey.encode('utf-8')))
 
-    #get keys as list
-    search_for = 'pid_*'
+    batch_size = settings['batch_size']
+    jsons_rdd = (sparksession.sparkContext
+                 .parallelize(json_keys, numSlices=settings['partitions'])
+                 .mapPartitions(lambda keys: fetch_redis_partition(keys, redishost,
+                                                                   redisport, batch_size)))
 
-    logging.info('**** Getting following RedisJSON keys: %s ****', search_for)
+    adf = sparksession.read.json(jsons_rdd, schema=schema).dropDuplicates(DEDUP_KEY)
+
+    return adf
 
-    json_keys = list(r_edis.scan_iter(search_for))
+def driver_batch_settings(config_obj):
+    """Driver mode batch sizing from etl.config [spark], with defaults
+    """
 
-    for ajson in json_keys:
-        a_json = r_edis.json().get(ajson)
-        jsons.append(a_json)
+    return {
+        'rows': config_obj.getint('spark', 'driver.batchrows', fallback=20000),
+        'bytes': config_obj.getint('spark', 'driver.batchmb', fallback=64) * 1048576,
+        'inflight': config_obj.getint('spark', 'driver.inflight', fallback=2),
+    }
 
-    adf = spark.read.json(spark.sparkContext.parallelize(jsons,numSlices=840) \
-            , multiLine=True).dropDuplicates()
+def record_size(adict):
+    """Approximate size of a record in bytes, its string values dominate
+    """
 
-    return adf
+    return sum(len(value) for value in adict.values() if isinstance(value, str))
 
-def df_to_dict_batches(json_df):
-    """Break list of dicts into smaller chunks
-        speeds up data processing
+def psql_source_settings(config_obj):
+    """PostgreSQL JSONB source tuning from etl.config [reportdb], with defaults
+    """
+
+    return {
+        'table': config_obj.get('reportdb', 'sample.table', fallback='hl7_jsons'),
+        'partitions': config_obj.getint('reportdb', 'source.partitions', fallback=64),
+        'fetch_size': config_obj.getint('reportdb', 'source.fetchsize', fallback=5000),
+    }
+
+def psql_block_ranges(psql_cur, source_table, partitions):
+    """Split a table into page (ctid block) ranges, one per partition
+        the last range is open ended so rows added since are still read
+    """
+
+    psql_cur.execute("SELECT pg_relation_size(%s) / current_setting('block_size')::int;",
+                     (source_table,))
+    num_blocks = psql_cur.fetchone()[0]
+    step = max(-(-num_blocks // max(partitions, 1)), 1)
+    starts = list(range(0, max(num_blocks, 1), step))
+    return [(start, starts[index + 1] if index + 1 < len(starts) else None)
+            for index, start in enumerate(starts)]
+
+def iter_psql_docs(psql_conn, source_table, block_ranges, fetch_size):
+    """Stream JSON messages from the patientjson JSONB column with a named
+        (server-side) cursor, fetch_size rows per round trip - memory stays flat
+        docs are tagged with <table>/<ctid> as sourceKey
+    """
+
+    for start_block, end_block in block_ranges:
+        query = (f"SELECT ctid::text, {PSQL_SOURCE_COLUMN}::text FROM {source_table} "
+                 f"WHERE ctid >= '({start_block},0)'::tid")
+        if end_block is not None:
+            query += f" AND ctid < '({end_block},0)'::tid"
+        with psql_conn.cursor(name=f'hl7_source_{start_block}') as psql_cur:
+            psql_cur.itersize = fetch_size
+            psql_cur.execute(query)
+            for ctid, message in psql_cur:
+                doc = json.loads(message)
+                # older create_sample_data.py versions stored the JSON as a string
+                if isinstance(doc, str):
+                    doc = json.loads(doc)
+                doc['sourceKey'] = f'{source_table}/{ctid}'
+                yield doc
+
+def fetch_psql_partition(block_ranges, source_table, db_config, fetch_size):
+    """Runs on executors - stream one partition of page ranges
+        yields JSON strings
+    """
+
+    psql_conn = psycopg2.connect(**db_config)
+    try:
+        for doc in iter_psql_docs(psql_conn, source_table, block_ranges, fetch_size):
+            yield json.dumps(doc)
+    finally:
+        psql_conn.close()
+
+def get_psql_jsons(sparksession, source_table, segments=None):
+    """Read JSON messages from a PostgreSQL JSONB table (see create_sample_data.py)
+        The driver only splits the table into page ranges, each executor streams
+        its ranges with a server-side cursor.
+    """
+
+    p_config = read_config('etl.config')
+    settings = psql_source_settings(p_config)
+    db_config = psql_db_config(p_config)
+
+    psql_conn, psql_cursor = psql_connection(p_config)
+    try:
+        block_ranges = psql_block_ranges(psql_cursor, source_table, settings['partitions'])
+    finally:
+        psql_conn.close()
+
+    logging.info('**** Reading %s in %s page ranges ****', source_table, len(block_ranges))
+    fetch_size = settings['fetch_size']
+    jsons_rdd = (sparksession.sparkContext
+                 .parallelize(block_ranges, numSlices=len(block_ranges))
+                 .mapPartitions(lambda ranges: fetch_psql_partition(ranges, source_table,
+                                                                    db_config, fetch_size)))
+
+    return (sparksession.read.json(jsons_rdd, schema=hl7_json_schema(segments, with_source=True))
+            .dropDuplicates(DEDUP_KEY))
+
+def df_to_dict_batches(json_df, batch_rows=20000, batch_bytes=64 * 1048576):
+    """Stream the DataFrame to the driver one partition at a time
+        and yield lists of dicts, a batch ends at batch_rows rows or
+        batch_bytes of record data, whichever comes first
     """
 
     logging.info('**** Json DF to Dict  ****')
-    dicts = json_df.toPandas().to_dict('records')
-    dicts_batches = numpy.array_split(dicts, 100)
+    batch = []
+    size = 0
+    for row in json_df.toLocalIterator(prefetchPartitions=True):
+        adict = row.asDict()
+        batch.append(adict)
+        size += record_size(adict)
+        if len(batch) >= batch_rows or size >= batch_bytes:
+            logging.info('**** Batch of %s records, %.1f MB ****', len(batch), size / 1048576)
+            yield batch
+            batch = []
+            size = 0
+    if batch:
+        logging.info('**** Batch of %s records, %.1f MB ****', len(batch), size / 1048576)
+        yield batch
+
+def feed_states(config_obj, adtfeed):
+    """States to keep for a feed, from the etl.config [states] section
+        falls back to the 'default' option, then to STATES
+    """
 
-    return dicts_batches
+    if config_obj.has_option('states', adtfeed):
+        return ast.literal_eval(config_obj.get('states', adtfeed))
+    if config_obj.has_option('states', 'default'):
+        return ast.literal_eval(config_obj.get('states', 'default'))
+    return STATES
+
+def ignore_lists_from_globals(states=None, message_time=False):
+    """Bundle the ignore lists into one dict so they can be broadcast
+        to executors or passed to worker functions
+        message_time - add the MSH-7 column even when msh or the field is left out,
+        Parquet partitioning and upsert ordering need it
+    """
 
-def assign_child_name(sgchild):
-    """ assign child names
+    return {
+        'fields': frozenset(IGNORE_FIELDS),
+        'seg_fields': frozenset(IGNORE_SEG_FIELDS),
+        'component_fields': frozenset(IGNORE_COMPONENT_FIELDS),
+        'states': frozenset(STATES if states is None else states),
+        'message_time': message_time,
+    }
+
+def passes_state_prefilter(adict, states):
+    """Cheap check on the raw PID segment before any parsing
+        keeps exactly the messages the STATES check in process_record keeps
     """
 
-    short_name = "None" if sgchild.name is None else sgchild.name
-    long_name = "None" if sgchild.long_name is None else sgchild.long_name
+    return pid_state(adict.get('pid')) in states
 
-    return short_name.lower(), long_name.lower()
+def state_filter_column(states):
+    """Spark column version of passes_state_prefilter on the raw pid column
+        same rule as hl7_fast_parser.pid_state
+    """
 
-def process_hl7_segment(hl7_segment, json_dict, new_data_dict):
+    pid_11 = F.regexp_extract(F.col('pid'), r'^(?:[^|]*\|){11}([^|]*)', 1)
+    # PID-11.4 of every address repetition, '' when it has none
+    rep_states = F.transform(F.split(pid_11, '~'),
+                             lambda rep: F.regexp_extract(rep, r'^(?:[^^]*\^){3}([^^]*)', 1))
+    # blank components are skipped and a later repetition overwrites an earlier one
+    state = F.aggregate(rep_states, F.lit(None).cast('string'),
+                        lambda last, rep_state: F.when(rep_state != '', rep_state)
+                                                 .otherwise(last))
+    return state.isin(list(states))
+
+def process_hl7_segment(hl7_segment, json_dict, new_data_dict, ignore_lists=None, errors=None):
     """
     Parse HL7 raw data to extract values for segments and associated fields and create a dictionary.
     Add the dictionary to a list of dictionaries.
+    errors - if given, (segment, error) is appended for a segment that failed to parse
     """
 
+    if ignore_lists is None:
+        ignore_lists = ignore_lists_from_globals()
+
+    segment_data = json_dict.get(hl7_segment)
+    if not segment_data:
+        return False
+
     try:
-        segment_data = json_dict.get(hl7_segment)
-        if not segment_data:
-            return False
-
-        asegment = parse_segment(segment_data)
-        for achild in asegment.children:
-            ac_name, ac_long_name = assign_child_name(achild)
-            if ac_name.upper() in IGNORE_SEG_FIELDS:
-                continue
-
-            field = parse_field(achild.value, name=achild.name)
-            for fchild in field.children:
-                if fchild.name.upper() in IGNORE_COMPONENT_FIELDS:
-                    continue
-
-                fc_name, fc_long_name = assign_child_name(fchild)
-                field_name = f'{ac_name}_{ac_long_name}_{fc_name}_{fc_long_name}'
-                if field_name not in IGNORE_FIELDS:
-                    new_data_dict[field_name] = fchild.value
-        return new_data_dict
-    except (TypeError, KeyError, ValueError):
+        pairs, error = parse_hl7_segment_fields(segment_data,
+                                                 ignore_lists['seg_fields'],
+                                                 ignore_lists['component_fields'],
+                                                 ignore_lists['fields'])
+    except TypeError:
+        # unhashable segment value, nothing to parse
+        if errors is not None:
+            errors.append((hl7_segment, f'not a segment string: {type(segment_data).__name__}'))
+        return False
+
+    new_data_dict.update(pairs)
+    if error:
+        if errors is not None:
+            errors.append((hl7_segment, error))
         return False
+    return new_data_dict
+
+def message_time(adict):
+    """MSH-7 date/time of message taken from the raw msh segment, no parsing
+        None if the message has no MSH-7
+    """
+
+    msh_fields = (adict.get('msh') or '').split('|')
+    if len(msh_fields) <= 6:
+        return None
+    return msh_fields[6].split('^')[0] or None
+
+def process_record(adict, segments, ignore_lists, errors=None):
+    """Parse all HL7 segments of a single record
+        returns None if the record is filtered out by STATES
+        errors - collects (segment, error) for segments that failed to parse
+    """
+
+    data_dict = {
+        'patientid': adict['patientid'],
+        'dob': adict['dob']
+    }
+
+    # each segment is parsed exactly once, process_hl7_segment updates data_dict in place
+    for s_g in segments:
+        process_hl7_segment(s_g, adict, data_dict, ignore_lists, errors)
+
+    # Parquet is partitioned and upserts are ordered on MSH-7, taken from the raw segment
+    if ignore_lists.get('message_time') and MESSAGE_TIME_FIELD not in data_dict:
+        data_dict[MESSAGE_TIME_FIELD] = message_time(adict)
+
+    # filter out STATES
+    if data_dict.get('pid_11_patient_address_xad_4_state_or_province') in ignore_lists['states']:
+        return data_dict
+    return None
+
+def process_partition(rows, segments, ignore_lists_bc, counters, dead_letter=None):
+    """Runs on executors - parse HL7 for every row in a partition
+        and yield JSON strings, so Spark can infer the union of all columns
+        messages outside the feed's states are dropped before parsing
+        with dead_letter, records with segments that failed to parse are saved
+    """
+
+    ignore_lists = ignore_lists_bc.value
+    messages, prefiltered = counters
+    dead_rows = []
+    for row in rows:
+        adict = row.asDict()
+        messages.add(1)
+        if not passes_state_prefilter(adict, ignore_lists['states']):
+            prefiltered.add(1)
+            continue
+        errors = [] if dead_letter else None
+        data_dict = process_record(adict, segments, ignore_lists, errors)
+        if errors:
+            dead_rows.extend(dead_letter_rows(adict, dead_letter['feed'], errors))
+        if data_dict is not None:
+            yield json.dumps(data_dict)
+
+    if dead_rows:
+        # same name if the partition is recomputed, the file is replaced
+        save_dead_letter_rows(dead_rows, dead_letter,
+                              f"{dead_letter['run']}_{TaskContext.get().partitionId():05d}")
+
+def process_data_on_executors(json_df, segments, sparksession, states=None, dead_letter=None,
+                              message_time=False):
+    """process HL7 data on executors - filter STATES
+        ignore lists are broadcast once, nothing is collected to the driver
+        returns (DataFrame or False, parsed RDD) - unpersist the RDD once the
+        DataFrame is written
+    """
+
+    logging.info('**** Start Processing HL7 on executors ****')
+
+    spark_context = sparksession.sparkContext
+    ignore_lists_bc = spark_context.broadcast(ignore_lists_from_globals(states, message_time))
+    counters = (spark_context.accumulator(0), spark_context.accumulator(0))
+    # read.json makes a schema pass over the RDD, cache it so HL7 is parsed once
+    parsed_rdd = json_df.rdd.mapPartitions(
+                    lambda rows: process_partition(rows, segments, ignore_lists_bc,
+                                                   counters, dead_letter)).persist()
+
+    a_d_f = sparksession.read.json(parsed_rdd)
+
+    messages, prefiltered = counters[0].value, counters[1].value
+    logging.info('**** State pre-filter skipped parsing %s of %s messages (%.1f%%) ****',
+                 prefiltered, messages, 100.0 * prefiltered / messages if messages else 0)
+
+    if not a_d_f.columns:
+        logging.info('**** Empty DF ****')
+        return False, parsed_rdd
 
-def process_data(dict_batch, segments, sparksession):
+    a_d_f = rename_df_columns(a_d_f)
+    return a_d_f, parsed_rdd
+
+def process_data(dict_batch, segments, sparksession, states=None, dead_letter=None,
+                 message_time=False):
     """process HL7 data - filter STATES
+        with dead_letter, records with segments that failed to parse are saved
+        message_time - always add the MSH-7 column, see ignore_lists_from_globals
     """
 
     parsed_data = []
+    dead_rows = []
+    ignore_lists = ignore_lists_from_globals(states, message_time)
 
     logging.info('**** Start Processing HL7 ****')
 
     for adict in dict_batch:
-
-        data_dict = {
-            'patientid': adict['patientid'],
-            'dob': adict['dob']
-        }
-
-        for s_g in segments:
-            if not process_hl7_segment(s_g, adict, data_dict):
-                continue
-            data_dict = process_hl7_segment(s_g, adict, data_dict)
-
-        # filter out STATES
-        if data_dict['pid_11_patient_address_xad_4_state_or_province'] in STATES:
+        errors = [] if dead_letter else None
+        data_dict = process_record(adict, segments, ignore_lists, errors)
+        if errors:
+            dead_rows.extend(dead_letter_rows(adict, dead_letter['feed'], errors))
+        if data_dict is not None:
             parsed_data.append(data_dict)
+    if dead_rows:
+        save_dead_letter_rows(dead_rows, dead_letter, f"{dead_letter['run']}_{uuid.uuid4().hex}")
     if parsed_data:
         logging.info('**** Creating DF ****')
         a_d_f = sparksession.createDataFrame(parsed_data)
@@ -163,33 +540,36 @@ def process_data(dict_batch, segments, sparksession):
     logging.info('**** Empty DF ****')
     return False
 
-def rename_df_columns(data_frame):
-    """Rename columns using a mapping from a file
+@functools.lru_cache(maxsize=None)
+def load_rename_map(map_file='field_map.txt'):
+    """Read the (orig, new) mapping from a file, once per process
     """
 
-    logging.info('**** Rename Column Names ****')
-
-    with open('field_map.txt', encoding='utf-8') as field_map_file:
-        rename_map = [make_tuple(line) for line in field_map_file]
+    with open(map_file, encoding='utf-8') as field_map_file:
+        return dict(make_tuple(line) for line in field_map_file if line.strip())
 
-    for orig, new in rename_map:
-        data_frame = data_frame.withColumnRenamed(orig, new)
+@functools.lru_cache(maxsize=None)
+def output_column_name(col_name):
+    """Final column name: renamed using the field map, lower case and
+        truncated if greater than 63 bytes for PostgreSQL - cached per name
+    """
 
-    return data_frame
+    new_name = load_rename_map().get(col_name, col_name).lower()
+    if len(new_name.encode('utf-8')) > 63:
+        logging.info('Long column name %s', new_name)
+        new_name = new_name[:62]
+        logging.info('Truncated column name %s', new_name)
+    return new_name
 
-def truncate_col_name(a_df):
-    """Truncate column names that are greater than 63 bytes for PostgreSQL
+def rename_df_columns(data_frame):
+    """Rename, lowercase and truncate all columns in a single select
+        instead of one withColumnRenamed (and one logical plan) per column
     """
 
-    logging.info('**** Truncate Column Names ****')
-    for col_name in a_df.columns:
-        size_bytes = len(col_name.encode('utf-8'))
-        if size_bytes > 63:
-            logging.info('Long column name %s', col_name)
-            truncated  = col_name[:62]
-            logging.info('Truncated column name %s', truncated)
-            a_df = a_df.withColumnRenamed(col_name, truncated)
-    return a_df
+    logging.info('**** Rename Column Names ****')
+
+    return data_frame.select([F.col(f'`{col_name}`').alias(output_column_name(col_name))
+                              for col_name in data_frame.columns])
 
 def lower_case_col_names(a_df):
     """lower case column names
@@ -199,23 +579,24 @@ def lower_case_col_names(a_df):
     a_df = a_df.toDF(*[c.lower() for c in a_df.columns]) #lowercase column names
     return a_df
 
-def df_to_jdbc(a_df, adtfeed):
-    """Write DataFrame to PostgreSQL using JDBC
+def feed_table_name(adtfeed):
+    """PostgreSQL table name for a feed
     """
 
-    logging.info('**** Adding rows to PostgreSQL ****')
+    # Replace "-" with "_" in adtfeed for tablename
+    datamodel_ver = 'v5'
+    return f"{datamodel_ver}_{adtfeed.replace('-', '_')}"
+
+def jdbc_settings(config_obj):
+    """JDBC url and properties for the report database
+    """
 
-    config_obj = read_config('etl.config')
     dbhost = config_obj.get('reportdb', 'host')
     dbport = config_obj.get('reportdb', 'port')
     dbname = config_obj.get('reportdb', 'dbname')
     dbuser = config_obj.get('reportdb', 'dbuser')
     dbuserpass = config_obj.get('reportdb', 'dbuserpass')
 
-    # Replace "-" with "_" in adtfeed for tablename
-    datamodel_ver = 'v5'
-    tablename = f"{datamodel_ver}_{adtfeed.replace('-', '_')}"
-
     url = f'jdbc:postgresql://{dbhost}:{dbport}/{dbname}'
     properties = {
         'user': dbuser,
@@ -223,25 +604,190 @@ def df_to_jdbc(a_df, adtfeed):
         'driver': 'org.postgresql.Driver',
         'batchsize': '2000'
     }
+    return url, properties
 
+def df_to_jdbc(a_df, adtfeed):
+    """Write DataFrame to PostgreSQL using JDBC
+    """
+
+    logging.info('**** Adding rows to PostgreSQL ****')
+    start = time.perf_counter()
+
+    tablename = feed_table_name(adtfeed)
+    p_config = read_config('etl.config')
+    url, properties = jdbc_settings(p_config)
+
+    # add any new columns up front instead of retrying after a failed write
+    psql_conn, psql_cursor = psql_connection(p_config)
     try:
-        # Use "append" mode, which adds data to the existing table
-        a_df.write.jdbc(url, tablename, mode='append', properties=properties)
-        logging.info('**** Stored %s rows in table %s', str(a_df.count()), tablename)
-        return True
-    except AnalysisException as e_error:
-        if "not found in schema" in str(e_error):
-            p_config = read_config('etl.config')
-            _, psql_cursor = psql_connection(p_config)
-            create_table(tablename, a_df.columns, psql_cursor)
-            a_df.write.jdbc(url, tablename, mode='append', properties=properties)
-        return True
+        create_table(tablename, a_df.columns, psql_cursor)
+    finally:
+        psql_conn.close()
+
+    # Use "append" mode, which adds data to the existing table
+    a_df.write.jdbc(url, tablename, mode='append', properties=properties)
+    # no count() here, it would run the whole parse again - --report-dir counts the rows
+    logging.info('**** JDBC write to %s took %.2fs ****', tablename, time.perf_counter() - start)
+    return True
+
+def copy_escape(value):
+    """Escape a value for COPY ... FROM STDIN text format
+    """
 
-def psql_connection(p_config):
-    """Connect to PostgreSQL server
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+def copy_partition(rows, tablename, columns, db_config, chunk_rows):
+    """Runs on executors - stream one partition into PostgreSQL with COPY FROM STDIN
+        one transaction per partition, chunk_rows rows per COPY buffer
+        yields the number of rows written
     """
 
-    db_config = {
+    copy_query = f"COPY {tablename} ({', '.join(columns)}) FROM STDIN"
+    psql_conn = psycopg2.connect(**db_config)
+    count = 0
+    try:
+        with psql_conn.cursor() as psql_cur:
+            buffer = io.StringIO()
+            for row in rows:
+                buffer.write('\t'.join(copy_escape(value) for value in row) + '\n')
+                count += 1
+                if count % chunk_rows == 0:
+                    buffer.seek(0)
+                    psql_cur.copy_expert(copy_query, buffer)
+                    buffer = io.StringIO()
+            if buffer.tell():
+                buffer.seek(0)
+                psql_cur.copy_expert(copy_query, buffer)
+        psql_conn.commit()
+    finally:
+        psql_conn.close()
+    yield count
+
+def df_to_copy(a_df, adtfeed, staging=False, upsert_keys=None, order_by=None):
+    """Write DataFrame to PostgreSQL with COPY FROM STDIN from each executor
+        row count comes from the write itself, no extra count() pass
+
+        With staging, rows are copied into an UNLOGGED staging table and moved
+        into the feed table with a single INSERT ... SELECT. With upsert_keys,
+        rows with the same keys are replaced in that same transaction, keeping
+        the row with the highest order_by column.
+    """
+
+    logging.info('**** Copying rows to PostgreSQL ****')
+    start = time.perf_counter()
+
+    p_config = read_config('etl.config')
+    db_config = psql_db_config(p_config)
+    chunk_rows = p_config.getint('reportdb', 'copy.chunkrows', fallback=10000)
+    tablename = feed_table_name(adtfeed)
+    columns = a_df.columns
+
+    psql_conn, psql_cursor = psql_connection(p_config)
+    create_table(tablename, columns, psql_cursor)
+
+    target = tablename
+    if staging:
+        target = f'{tablename}_staging_{int(time.time())}'
+        psql_cursor.execute(f'CREATE UNLOGGED TABLE {target} (LIKE {tablename});')
+        psql_conn.commit()
+
+    try:
+        num_rows = sum(a_df.rdd.mapPartitions(
+                        lambda rows: copy_partition(rows, target, columns,
+                                                    db_config, chunk_rows)).collect())
+
+        if staging:
+            col_list = ', '.join(columns)
+            if upsert_keys:
+                key_list = ', '.join(upsert_keys)
+                # a NULL visit number still matches the row it replaces
+                key_match = ' AND '.join(f'{tablename}.{key} IS NOT DISTINCT FROM {target}.{key}'
+                                         for key in upsert_keys)
+                # the latest message wins when a batch has several for the same keys
+                latest = f', {order_by} DESC NULLS LAST' if order_by in columns else ''
+                psql_cursor.execute(f'DELETE FROM {tablename} USING {target} WHERE {key_match};')
+                psql_cursor.execute(f'INSERT INTO {tablename} ({col_list}) '
+                                    f'SELECT DISTINCT ON ({key_list}) {col_list} FROM {target} '
+                                    f'ORDER BY {key_list}{latest};')
+            else:
+                psql_cursor.execute(f'INSERT INTO {tablename} ({col_list}) '
+                                    f'SELECT {col_list} FROM {target};')
+            psql_conn.commit()
+    finally:
+        if staging:
+            # a failed DELETE/INSERT leaves the transaction aborted
+            psql_conn.rollback()
+            psql_cursor.execute(f'DROP TABLE IF EXISTS {target};')
+            psql_conn.commit()
+        psql_conn.close()
+
+    elapsed = time.perf_counter() - start
+    logging.info('**** Stored %s rows in table %s in %.2fs (%.0f rows/second) ****',
+                 num_rows, tablename, elapsed, num_rows / elapsed if elapsed else 0)
+    return True
+
+def df_to_parquet(a_df, adtfeed, parquet_path):
+    """Append DataFrame to Parquet under parquet_path (local path or s3a:// URI)
+        partitioned by feed and message date (MSH-7), so queries can prune both
+    """
+
+    logging.info('**** Writing Parquet to %s ****', parquet_path)
+    start = time.perf_counter()
+
+    time_col = output_column_name(MESSAGE_TIME_FIELD)
+    if time_col in a_df.columns:
+        message_date = F.to_date(F.substring(F.col(time_col), 1, 8), 'yyyyMMdd')
+    else:
+        message_date = F.lit(None).cast('date')
+
+    (a_df.withColumn('feed', F.lit(adtfeed))
+         .withColumn('message_date', message_date)
+         .write.mode('append')
+         .partitionBy('feed', 'message_date')
+         .parquet(parquet_path))
+
+    logging.info('**** Parquet write for %s took %.2fs ****', adtfeed, time.perf_counter() - start)
+    return True
+
+def write_df(a_df, adtfeed, sink='jdbc', incremental=False, parquet_path=None):
+    """Write DataFrame to the selected sink
+        incremental runs always upsert on UPSERT_KEYS through a staging table
+        with parquet_path the rows are also written to Parquet first,
+        sink parquet writes only Parquet
+    """
+
+    if parquet_path:
+        if sink == 'parquet':
+            return df_to_parquet(a_df, adtfeed, parquet_path)
+        # both writes read the same parsed rows
+        a_df = a_df.persist()
+        try:
+            df_to_parquet(a_df, adtfeed, parquet_path)
+            return write_df(a_df, adtfeed, sink, incremental)
+        finally:
+            a_df.unpersist()
+
+    if incremental:
+        missing = [key for key in UPSERT_KEYS if key not in a_df.columns]
+        if missing:
+            # appending would duplicate every row loaded before
+            raise ValueError(f"Can't upsert {adtfeed}, missing key columns {', '.join(missing)}")
+        return df_to_copy(a_df, adtfeed, staging=True, upsert_keys=UPSERT_KEYS,
+                          order_by=output_column_name(MESSAGE_TIME_FIELD))
+    if sink == 'copy':
+        return df_to_copy(a_df, adtfeed)
+    if sink == 'copy-staging':
+        return df_to_copy(a_df, adtfeed, staging=True)
+    return df_to_jdbc(a_df, adtfeed)
+
+def psql_db_config(p_config):
+    """psycopg2 connection arguments from etl.config
+    """
+
+    return {
         'database': p_config.get('reportdb', 'dbname'),
         'host': p_config.get('reportdb', 'host'),
         'user': p_config.get('reportdb', 'dbuser'),
@@ -249,6 +795,12 @@ def psql_connection(p_config):
         'port': p_config.get('reportdb', 'port'),
     }
 
+def psql_connection(p_config):
+    """Connect to PostgreSQL server
+    """
+
+    db_config = psql_db_config(p_config)
+
     try:
         psql_conn = psycopg2.connect(**db_config)
         psql_cur = psql_conn.cursor()
@@ -257,17 +809,36 @@ def psql_connection(p_config):
         print(f"Error connecting to PostgreSQL: {e}")
         raise 
 
+def table_columns(table, psql_cur):
+    """Column names of a table, read from information_schema once per run
+        an empty set means the table does not exist yet
+    """
+
+    if table not in TABLE_COLUMNS:
+        psql_cur.execute("""SELECT column_name FROM information_schema.columns
+                            WHERE table_schema = current_schema() AND table_name = %s;""",
+                         (table.lower(),))
+        TABLE_COLUMNS[table] = {row[0] for row in psql_cur.fetchall()}
+    return TABLE_COLUMNS[table]
+
 def create_table(table, df_columns, psql_cur):
-    """Create Table
+    """Create Table, and add the DataFrame columns it is missing
+        in a single ALTER TABLE / transaction
     """
-    create_query = f"CREATE TABLE IF NOT EXISTS {table} ();"
-    psql_cur.execute(create_query)
+
+    existing = table_columns(table, psql_cur)
+    missing = [db_col for db_col in dict.fromkeys(df_columns) if db_col.lower() not in existing]
+    if existing and not missing:
+        return
+
+    psql_cur.execute(f"CREATE TABLE IF NOT EXISTS {table} ();")
+    if missing:
+        add_columns = ', '.join(f'ADD COLUMN IF NOT EXISTS {db_col} text' for db_col in missing)
+        psql_cur.execute(f"ALTER TABLE {table} {add_columns};")
     psql_cur.connection.commit()
 
-    for db_col in df_columns:
-        add_column_query = f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {db_col} text;"
-        psql_cur.execute(add_column_query)
-        psql_cur.connection.commit()
+    existing.update(db_col.lower() for db_col in missing)
+    logging.info('**** Added %s columns to %s ****', len(missing), table)
 
 def filter_df(unfiltered_df, spark_session):
     """Filter rows
@@ -284,33 +855,213 @@ def filter_df(unfiltered_df, spark_session):
         logging.error('Query Failed %s', e_error)
         raise
 
-def df_etl(sparksession, adtfeedname, segments, s3bucketprefix):
+def df_etl(sparksession, adtfeedname, segments, s3bucketprefix, options=None):
     """Apache Spark Magic happens here
-    """
 
-    if s3bucketprefix == 'JSON':
-        logging.info('**** Get Redis JSONs ****')
-        d_f = get_redis_jsons(redis_host, redis_port)
-    else:
-        logging.info('**** Get S3 JSONs ****')
-        d_f = get_s3_jsons(sparksession, s3bucketprefix)
+        options - parse_mode, redis_ndjson_path, psql_source_table, sink, parquet_path,
+                  incremental, days, report_dir, profile_parse, dead_letter,
+                  dead_letter_path, replay_dead_letters (see __main__ arguments)
+    """
 
-    d_f = lower_case_col_names(d_f)
+    options = options or {}
+    sink = options.get('sink', 'jdbc')
+    incremental = options.get('incremental', False)
+    replay = options.get('replay_dead_letters', False)
+    # replayed messages may already be loaded in part, always upsert them
+    upsert = incremental or replay
+    db_config = psql_db_config(read_config('etl.config'))
+    dead_letter = dead_letter_settings(options, adtfeedname)
+    parquet_path = options.get('parquet_path')
+    parse_mode = options.get('parse_mode', 'executor')
+    parse_stage = 'process_data' if parse_mode == 'driver' else 'process_data_on_executors'
+    report = RunReport(adtfeedname, options.get('report_dir'),
+                       parse_stage if options.get('profile_parse') else None)
+
+    with report.stage('read') as stage:
+        if replay:
+            logging.info('**** Replaying dead letters for %s ****', adtfeedname)
+            url, properties = jdbc_settings(read_config('etl.config'))
+            records_rdd, replay_marker = read_dead_letter_records(sparksession, dead_letter,
+                                                                  adtfeedname, url, properties)
+            d_f = (sparksession.read.json(records_rdd, schema=hl7_json_schema(segments, True, True))
+                   .dropDuplicates(DEDUP_KEY))
+        elif options.get('psql_source_table'):
+            logging.info('**** Get PostgreSQL JSONs ****')
+            d_f = get_psql_jsons(sparksession, options['psql_source_table'], segments)
+        elif s3bucketprefix == 'JSON':
+            logging.info('**** Get Redis JSONs ****')
+            d_f = get_redis_jsons(sparksession, redis_host, redis_port,
+                                  options.get('redis_ndjson_path'), segments)
+        else:
+            logging.info('**** Get S3 JSONs ****')
+            d_f = get_s3_jsons(sparksession, s3bucketprefix, segments, options.get('days', 0))
+        stage['rows_out'] = report.rows(d_f)
 
-    dict_batches = df_to_dict_batches(d_f)
+    with report.stage('lower_case_col_names', stage['rows_out']) as stage:
+        d_f = lower_case_col_names(d_f)
+        stage['rows_out'] = stage['rows_in']
 
-    for dict_batch in dict_batches:
-        # process HL7 segments
-        d_f = process_data(dict_batch, segments, sparksession)
-        if d_f:
-            d_f = truncate_col_name(d_f)
-            df_to_jdbc(d_f, adtfeedname)
-            d_f = ''
+    # replayed messages were checkpointed when they were first loaded
+    if incremental and not replay:
+        with report.stage('filter_new_messages', stage['rows_out']) as stage:
+            p_config = read_config('etl.config')
+            psql_conn, psql_cursor = psql_connection(p_config)
+            try:
+                create_checkpoint_table(psql_cursor)
+            finally:
+                psql_conn.close()
+            url, properties = jdbc_settings(p_config)
+            logging.info('**** Skipping messages already checkpointed for %s ****', adtfeedname)
+            d_f = filter_new_messages(d_f, read_checkpoints(sparksession, url, properties,
+                                                            adtfeedname)).persist()
+            stage['rows_out'] = report.rows(d_f)
+
+    states = feed_states(read_config('etl.config'), adtfeedname)
+    # the MSH-7 column is only added when Parquet or the upsert ordering needs it
+    parse_args = (segments, sparksession, states, dead_letter, bool(parquet_path) or upsert)
+    try:
+        if parse_mode == 'executor':
+            parse_on_executors(d_f, adtfeedname, parse_args, report,
+                               (sink, upsert, parquet_path), stage['rows_out'])
         else:
-            pass
+            parse_on_driver(d_f, adtfeedname, parse_args, report, (sink, upsert, parquet_path),
+                            db_config if incremental else None)
+        if incremental:
+            # out of state messages too, so they aren't read and parsed again
+            with report.stage('save_checkpoints'):
+                save_df_checkpoints(d_f, adtfeedname, db_config)
+    finally:
+        if incremental:
+            d_f.unpersist()
+    if replay:
+        clear_replayed(dead_letter, adtfeedname, replay_marker)
+    report.write()
+
+def parse_on_executors(d_f, adtfeedname, parse_args, report, write_args, rows_in=None):
+    """Parse HL7 on executors and write the result
+        parse_args - (segments, sparksession, states, dead_letter, message_time)
+        write_args - (sink, incremental, parquet_path) for write_df
+    """
+
+    # process HL7 segments on executors, renamed in the same select
+    with report.stage('process_data_on_executors', rows_in) as stage:
+        parsed_df, parsed_rdd = process_data_on_executors(d_f, *parse_args)
+        stage['rows_out'] = report.rows(parsed_df)
+    try:
+        if parsed_df:
+            with report.stage('write', stage['rows_out']):
+                write_df(parsed_df, adtfeedname, *write_args)
+    finally:
+        parsed_rdd.unpersist()
+
+def parse_on_driver(d_f, adtfeedname, parse_args, report, write_args, db_config=None):
+    """Parse HL7 in driver batches, the next batch is parsed while the previous one
+        is written - with db_config each written batch is checkpointed
+        parse_args - (segments, sparksession, states, dead_letter, message_time)
+        write_args - (sink, incremental, parquet_path) for write_df
+    """
+
+    sparksession, states = parse_args[1], parse_args[2]
+
+    # drop out of state messages before they are collected to the driver
+    batch_settings = driver_batch_settings(read_config('etl.config'))
+    dict_batches = df_to_dict_batches(d_f.filter(state_filter_column(states)),
+                                      batch_settings['rows'], batch_settings['bytes'])
+
+    # at most driver.inflight parsed batches wait for the writer
+    spark_context = sparksession.sparkContext
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'{adtfeedname}_write',
+                            initializer=spark_context.setLocalProperty,
+                            initargs=('spark.scheduler.pool',
+                                      spark_context.getLocalProperty('spark.scheduler.pool'))
+                            ) as writer:
+        for dict_batch in report.timed_batches('df_to_dict_batches', dict_batches):
+            # process HL7 segments
+            with report.stage('process_data', len(dict_batch)) as stage:
+                parsed_df = process_data(dict_batch, *parse_args)
+                stage['rows_out'] = report.rows(parsed_df)
+            in_flight.append(writer.submit(write_batch, parsed_df, dict_batch, adtfeedname,
+                                           write_args, report, db_config))
+            parsed_df = ''
+            while len(in_flight) > batch_settings['inflight']:
+                in_flight.popleft().result()
+        while in_flight:
+            in_flight.popleft().result()
+
+def dead_letter_settings(options, adtfeed):
+    """Dead letter sink for a feed from the df_etl options, None when off
+    """
+
+    if not options.get('dead_letter'):
+        return None
+
+    dead_letter = {
+        'sink': options['dead_letter'],
+        'path': options.get('dead_letter_path') or 'dead_letters',
+        'db_config': psql_db_config(read_config('etl.config')),
+        'feed': adtfeed,
+        'run': str(int(time.time())),
+    }
+    if dead_letter['sink'] == 'postgres':
+        psql_conn, psql_cursor = psql_connection(read_config('etl.config'))
+        try:
+            create_dead_letter_table(psql_cursor)
+        finally:
+            psql_conn.close()
+    return dead_letter
+
+def write_batch(a_df, dict_batch, adtfeed, write_args, report, db_config=None):
+    """Write one driver mode batch, then checkpoint it when db_config is set
+        write_args - (sink, incremental, parquet_path) for write_df
+    """
+
+    if a_df:
+        with report.stage('write', report.rows(a_df)):
+            write_df(a_df, adtfeed, *write_args)
+    if db_config:
+        # batch is committed, a rerun resumes after it
+        with report.stage('save_checkpoints', len(dict_batch)):
+            save_checkpoints(((adict[SOURCE_COLUMN], adict['updatedat'])
+                              for adict in dict_batch), adtfeed, db_config)
+
+def run_feed(sparksession, adtfeed, segments, s3bucketprefix, options):
+    """Run df_etl for one feed in its own FAIR scheduler pool
+        returns (feed, error), error is None on success - one bad feed
+        does not stop the others
+    """
+
+    threading.current_thread().name = adtfeed
+    # jobs submitted from this thread share the feed's pool
+    sparksession.sparkContext.setLocalProperty('spark.scheduler.pool', f'feed_{adtfeed}')
+    start = time.perf_counter()
+    logging.info('**** Starting for %s', adtfeed)
+    try:
+        df_etl(sparksession, adtfeed, segments, s3bucketprefix, options)
+    except Exception as e_error:  # pylint: disable=broad-except
+        logging.error('**** Failed for %s after %.0fs: %s\n%s', adtfeed,
+                      time.perf_counter() - start, e_error, traceback.format_exc())
+        return adtfeed, str(e_error)
+    logging.info('**** Completed for %s in %.0fs', adtfeed, time.perf_counter() - start)
+    return adtfeed, None
+
+def run_feeds(sparksession, adtfeeds, segments, s3bucketprefix, options, parallel=1):
+    """Run up to parallel feeds at a time in the same SparkSession
+        returns the list of feeds that failed
+    """
+
+    with ThreadPoolExecutor(max_workers=max(parallel, 1)) as executor:
+        results = list(executor.map(lambda feed: run_feed(sparksession, feed, segments,
+                                                          s3bucketprefix, options),
+                                    adtfeeds))
+
+    failed = [feed for feed, error in results if error is not None]
+    logging.info('**** %s of %s feeds completed%s', len(results) - len(failed), len(results),
+                 f", failed: {', '.join(failed)}" if failed else '')
+    return failed
 
 if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO,format='%(asctime)s %(message)s',\
+    logging.basicConfig(level=logging.INFO,format='%(asctime)s [%(threadName)s] %(message)s',\
             handlers=[logging.StreamHandler(sys.stdout)])
 
     config = read_config('etl.config')
@@ -344,13 +1095,203 @@ if __name__ == "__main__":
                              help='Full path - <bucket-name>/prefix/',
                             )
 
+    arg_parser.add_argument (
+                             '--parse-mode',
+                             dest='parse_mode',
+                             action='store',
+                             default='executor',
+                             choices=['executor', 'driver'],
+                             required=False,
+                             help='Parse HL7 on Spark executors (default) \
+                                    or in batches on the driver',
+                            )
+
+    arg_parser.add_argument (
+                             '--redis-ndjson-path',
+                             dest='redis_ndjson_path',
+                             action='store',
+                             default=None,
+                             required=False,
+                             help='Spool RedisJSON docs to this NDJSON file and read it, \
+                                    instead of reading Redis from the executors',
+                            )
+
+    arg_parser.add_argument (
+                             '--psql-source-table',
+                             dest='psql_source_table',
+                             action='store',
+                             nargs='?',
+                             const=config.get('reportdb', 'sample.table', fallback='hl7_jsons'),
+                             default=None,
+                             required=False,
+                             help='Read messages from this PostgreSQL JSONB table instead of \
+                                    S3/Redis, default [reportdb] sample.table',
+                            )
+
+    arg_parser.add_argument (
+                             '--sink',
+                             dest='sink',
+                             action='store',
+                             default='jdbc',
+                             choices=['jdbc', 'copy', 'copy-staging', 'parquet'],
+                             required=False,
+                             help='Spark JDBC write (default), COPY FROM STDIN from each executor, \
+                                    COPY into an UNLOGGED staging table then INSERT ... SELECT, \
+                                    or only Parquet (needs --parquet-path)',
+                            )
+
+    arg_parser.add_argument (
+                             '--parquet-path',
+                             dest='parquet_path',
+                             action='store',
+                             default=None,
+                             required=False,
+                             help='Also write Parquet partitioned by feed/message_date here, \
+                                    local path or s3a://<bucket-name>/prefix/',
+                            )
+
+    arg_parser.add_argument (
+                             '--engine',
+                             dest='engine',
+                             action='store',
+                             default='spark',
+                             choices=['spark', 'python'],
+                             required=False,
+                             help='Spark (default), or a local process pool for small feeds - \
+                                    --s3-bucket-prefix is then JSON or a local NDJSON file/directory',
+                            )
+    arg_parser.add_argument (
+                             '--workers',
+                             dest='workers',
+                             action='store',
+                             type=int,
+                             default=None,
+                             required=False,
+                             help='Number of worker processes for --engine python, default CPU count',
+                            )
+
+    arg_parser.add_argument (
+                             '--days',
+                             dest='days',
+                             action='store',
+                             type=int,
+                             default=0,
+                             required=False,
+                             help='Only read the last N days of yyyy/m/d prefixes \
+                                    under --s3-bucket-prefix',
+                            )
+    arg_parser.add_argument (
+                             '--incremental',
+                             dest='incremental',
+                             action='store_true',
+                             required=False,
+                             help='Only load messages that are new or changed since the last \
+                                    checkpoint, upsert on (patientid, pt_visit_number)',
+                            )
+
+    arg_parser.add_argument (
+                             '--dead-letter',
+                             dest='dead_letter',
+                             action='store',
+                             default=None,
+                             choices=['postgres', 'ndjson'],
+                             required=False,
+                             help='Save messages with segments that failed to parse \
+                                    to the etl_dead_letter table or to NDJSON files',
+                            )
+    arg_parser.add_argument (
+                             '--dead-letter-path',
+                             dest='dead_letter_path',
+                             action='store',
+                             default=None,
+                             required=False,
+                             help='Directory for --dead-letter ndjson, shared by the executors, \
+                                    default dead_letters',
+                            )
+    arg_parser.add_argument (
+                             '--replay-dead-letters',
+                             dest='replay_dead_letters',
+                             action='store_true',
+                             required=False,
+                             help='Only re-run the dead-lettered messages of each feed, \
+                                    upserting them and clearing the ones that parse now',
+                            )
+    arg_parser.add_argument (
+                             '--report-dir',
+                             dest='report_dir',
+                             action='store',
+                             default=None,
+                             required=False,
+                             help='Write a JSON run report per feed here - stage timings, \
+                                    rows in/out (counted, so each stage is materialized) and driver RSS',
+                            )
+    arg_parser.add_argument (
+                             '--profile-parse',
+                             dest='profile_parse',
+                             action='store_true',
+                             required=False,
+                             help='Run the HL7 parse stage under cProfile, stats go to --report-dir. \
+                                    Only the driver is profiled, use with --parse-mode driver',
+                            )
+
+    arg_parser.add_argument (
+                             '--parallel-feeds',
+                             dest='parallel_feeds',
+                             action='store',
+                             type=int,
+                             default=1,
+                             required=False,
+                             help='Run up to N feeds at a time in one Spark session, \
+                                    each in its own FAIR scheduler pool',
+                            )
+
     args = arg_parser.parse_args()
 
     # since I had to deal with several adt feeds, I chose to
     #  do it this way.
     adt_feed_name = args.adt_feed_name
     s3_bucket_full_path = args.s3_bucket_prefix
+    etl_options = {
+        'parse_mode': args.parse_mode,
+        'redis_ndjson_path': args.redis_ndjson_path,
+        'psql_source_table': args.psql_source_table,
+        'sink': args.sink,
+        'parquet_path': args.parquet_path,
+        'incremental': args.incremental,
+        'days': args.days,
+        'report_dir': args.report_dir,
+        'dead_letter': args.dead_letter,
+        'dead_letter_path': args.dead_letter_path,
+        'replay_dead_letters': args.replay_dead_letters,
+        'profile_parse': args.profile_parse,
+    }
 
+    if args.replay_dead_letters and not args.dead_letter:
+        arg_parser.error('--replay-dead-letters needs --dead-letter')
+    if args.sink == 'parquet' and not args.parquet_path:
+        arg_parser.error('--sink parquet needs --parquet-path')
+
+    if args.engine == 'python':
+        if args.incremental:
+            arg_parser.error('--incremental needs --engine spark')
+        if args.parquet_path:
+            arg_parser.error('--parquet-path needs --engine spark')
+        # hl7_local_engine has no dead letter sink, failed messages would be silently dropped
+        if args.dead_letter or args.dead_letter_path or args.replay_dead_letters:
+            arg_parser.error('--dead-letter, --dead-letter-path and --replay-dead-letters '
+                             'need --engine spark')
+
+        # no Spark session, same config, tables and column names
+        import hl7_local_engine
+        for adt_feed in adt_feed_name.split(','):
+            logging.info('**** Starting for %s', adt_feed)
+            hl7_local_engine.run_feed(
+                adt_feed, HL7_SEGMENTS,
+                hl7_local_engine.source_records(s3_bucket_full_path, redis_host, redis_port,
+                                                args.psql_source_table),
+                ignore_lists_from_globals(feed_states(config, adt_feed)), args.workers)
+            logging.info('**** Completed for %s', adt_feed)
+        sys.exit(0)
 
     spark = (SparkSession.builder
              .appName('adt_feed' + '_' + adt_feed_name + '_' + str(int(time.time())))
@@ -362,17 +1303,22 @@ if __name__ == "__main__":
              .config('spark.hadoop.fs.s3a.access.key', aws_access_key)
              .config('spark.hadoop.fs.s3a.secret.key', aws_secret_key)
              .config('spark.debug.maxToStringFields','200')
+             .config('spark.scheduler.mode', 'FAIR' if args.parallel_feeds > 1 else 'FIFO')
              .config('spark.jars',
                         '/var/tmp/sparkjars/postgresql-42.6.0.jar,\
                          /var/tmp/sparkjars/aws-java-sdk-bundle-1.12.262.jar,\
                          /var/tmp/sparkjars/hadoop-aws-3.3.4.jar')
              .getOrCreate())
 
+    # executors import the fast parser too
+    spark.sparkContext.addPyFile('hl7_fast_parser.py')
+    spark.sparkContext.addPyFile('etl_checkpoint.py')
+    spark.sparkContext.addPyFile('etl_dead_letter.py')
 
     # can pass more than one name
-    for adt_feed in adt_feed_name.split(','):
-        logging.info('**** Starting for %s', adt_feed)
-        df_etl(spark, adt_feed, HL7_SEGMENTS, s3_bucket_full_path)
-        logging.info('**** Completed for %s', adt_feed)
-
-    spark.stop()
+    try:
+        failed_feeds = run_feeds(spark, adt_feed_name.split(','), HL7_SEGMENTS,
+                                 s3_bucket_full_path, etl_options, args.parallel_feeds)
+    finally:
+        spark.stop()
+    sys.exit(1 if failed_feeds else 0)
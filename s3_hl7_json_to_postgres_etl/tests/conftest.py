@@ -0,0 +1,45 @@
+"""Shared fixtures - the ETL scripts read their config files from the working directory
+"""
+
+import ast
+import configparser
+import json
+import pathlib
+import sys
+
+import pytest
+
+ETL_DIR = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ETL_DIR))
+
+@pytest.fixture
+def etl_dir(monkeypatch):
+    """run from the ETL directory, where field_map.txt and the ignore lists live
+    """
+
+    monkeypatch.chdir(ETL_DIR)
+    return ETL_DIR
+
+@pytest.fixture
+def template_config():
+    """etl.config.template, the shipped defaults
+    """
+
+    config = configparser.RawConfigParser()
+    config.read(ETL_DIR / 'etl.config.template')
+    return config
+
+@pytest.fixture
+def template_segments(template_config):
+    """HL7_SEGMENTS of the shipped config
+    """
+
+    return ast.literal_eval(template_config.get('constants', 'HL7_SEGMENTS'))
+
+@pytest.fixture
+def sample_record():
+    """sample.json with lower case keys, as after lower_case_col_names
+    """
+
+    record = json.loads((ETL_DIR / 'sample.json').read_text(encoding='utf-8'))
+    return {key.lower(): value for key, value in record.items()}
@@ -0,0 +1,82 @@
+"""Checkpoint upserts with several messages from the same source
+"""
+
+import shutil
+
+import pytest
+
+import etl_checkpoint
+
+SOURCE_A = 's3a://bucket/JSON/acme/2024/1/2/a.json'
+SOURCE_B = 's3a://bucket/JSON/acme/2024/1/2/b.json'
+
+class FakeConnection:
+    """psycopg2 connection that keeps nothing
+    """
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+def test_one_row_per_source(monkeypatch):
+    pages = []
+    statements = []
+    monkeypatch.setattr(etl_checkpoint.psycopg2, 'connect', lambda **_: FakeConnection())
+
+    def execute_values(cur, sql, values, page_size):
+        statements.append(sql)
+        pages.append(list(values))
+
+    monkeypatch.setattr(etl_checkpoint, 'execute_values', execute_values)
+
+    # one S3 object with three messages, and a second object
+    rows = [(SOURCE_A, '2024-01-02T10:00:00'),
+            (SOURCE_A, '2024-01-02T12:00:00'),
+            (SOURCE_A, None),
+            (SOURCE_B, None)]
+
+    assert etl_checkpoint.save_checkpoints(rows, 'acme', {}) == 2
+    assert sorted(pages[0]) == [
+        ('acme', SOURCE_A, '2024-01-02T12:00:00'),
+        ('acme', SOURCE_B, None)]
+    # another partition with an older message of a.json must not move its checkpoint back
+    assert 'GREATEST(etl_checkpoint.updatedat' in statements[0]
+
+def test_no_rows_no_connection(monkeypatch):
+    monkeypatch.setattr(etl_checkpoint.psycopg2, 'connect', None)
+
+    assert etl_checkpoint.save_checkpoints(iter([]), 'acme', {}) == 0
+
+@pytest.mark.skipif(shutil.which('java') is None, reason='Spark needs a JVM')
+def test_checkpoint_is_a_watermark():
+    from pyspark.sql import SparkSession
+
+    spark = SparkSession.builder.master('local[1]').appName('checkpoints').getOrCreate()
+    try:
+        messages = spark.createDataFrame(
+            [('m1', SOURCE_A, '2024-01-02 10:00'), ('m2', SOURCE_A, '2024-01-02 12:00'),
+             ('m3', SOURCE_A, '2024-01-02 13:00'), ('m4', SOURCE_A, None),
+             ('m5', SOURCE_B, None), ('m6', 's3a://bucket/new.json', None)],
+            'id string, sourcekey string, updatedat string')
+        checkpoints = spark.createDataFrame(
+            [(SOURCE_A, '2024-01-02 12:00'), (SOURCE_B, None)],
+            'source string, updatedat string')
+
+        new = etl_checkpoint.filter_new_messages(messages, checkpoints)
+        new_ids = sorted(row.id for row in new.collect())
+    finally:
+        spark.stop()
+
+    # m1 and m2 were loaded with the 12:00 checkpoint, only the later m3 is new
+    assert new_ids == ['m3', 'm6']
@@ -0,0 +1,58 @@
+"""A failed staging upsert must surface its own error and drop the staging table
+"""
+
+import pytest
+
+class AbortedTransaction(Exception):
+    """stands in for psycopg2.errors.InFailedSqlTransaction
+    """
+
+class FakeConnection:
+    """psycopg2 connection/cursor, DELETE fails and aborts the transaction
+    """
+
+    def __init__(self):
+        self.statements = []
+        self.aborted = False
+
+    def execute(self, sql, args=None):
+        if self.aborted:
+            raise AbortedTransaction('current transaction is aborted')
+        self.statements.append(sql)
+        if sql.startswith('DELETE'):
+            self.aborted = True
+            raise RuntimeError('deadlock detected')
+
+    def rollback(self):
+        self.aborted = False
+
+    def commit(self):
+        if self.aborted:
+            raise AbortedTransaction('current transaction is aborted')
+
+    def close(self):
+        pass
+
+class ParsedRdd:
+    def mapPartitions(self, func):
+        return self
+
+    def collect(self):
+        return [2]
+
+class ParsedFrame:
+    columns = ['patientid', 'pt_visit_number']
+    rdd = ParsedRdd()
+
+def test_failed_upsert_rolls_back_before_drop(etl_dir, template_config, monkeypatch):
+    import s3_redis_json_to_psql_etl as v5
+
+    conn = FakeConnection()
+    monkeypatch.setattr(v5, 'read_config', lambda path: template_config)
+    monkeypatch.setattr(v5, 'psql_connection', lambda config: (conn, conn))
+    monkeypatch.setattr(v5, 'create_table', lambda table, columns, cur: None)
+
+    with pytest.raises(RuntimeError, match='deadlock'):
+        v5.df_to_copy(ParsedFrame(), 'acme', staging=True, upsert_keys=v5.UPSERT_KEYS)
+
+    assert conn.statements[-1].startswith('DROP TABLE IF EXISTS v5_acme_staging_')
@@ -0,0 +1,67 @@
+"""Driver mode incremental runs checkpoint every message they read
+    out of state messages never reach a batch, and the filtered DataFrame is
+    unpersisted even when the run fails
+"""
+
+import pytest
+
+class MessagesFrame:
+    """the DataFrame filter_new_messages returns, records persist/unpersist
+    """
+
+    persisted = False
+
+    def persist(self):
+        self.persisted = True
+        return self
+
+    def unpersist(self):
+        self.persisted = False
+        return self
+
+class FakeConnection:
+    def close(self):
+        pass
+
+@pytest.fixture
+def incremental_run(etl_dir, template_config, monkeypatch):
+    import s3_redis_json_to_psql_etl as v5
+
+    messages = MessagesFrame()
+    saved = []
+    monkeypatch.setattr(v5, 'read_config', lambda path: template_config)
+    monkeypatch.setattr(v5, 'get_s3_jsons', lambda *args: 'raw')
+    monkeypatch.setattr(v5, 'lower_case_col_names', lambda d_f: d_f)
+    monkeypatch.setattr(v5, 'psql_connection', lambda config: (FakeConnection(), None))
+    monkeypatch.setattr(v5, 'create_checkpoint_table', lambda cur: None)
+    monkeypatch.setattr(v5, 'read_checkpoints', lambda *args: None)
+    monkeypatch.setattr(v5, 'filter_new_messages', lambda d_f, checkpoints: messages)
+    monkeypatch.setattr(v5, 'save_df_checkpoints',
+                        lambda d_f, feed, db_config: saved.append((d_f, feed)))
+
+    def run(parse_on_driver):
+        monkeypatch.setattr(v5, 'parse_on_driver', parse_on_driver)
+        v5.df_etl(None, 'acme', ['pid'], 'bucket/JSON/acme/',
+                  {'parse_mode': 'driver', 'incremental': True})
+
+    return run, messages, saved
+
+def test_checkpoints_the_messages_before_the_state_filter(incremental_run):
+    run, messages, saved = incremental_run
+
+    run(lambda d_f, *args: None)
+
+    assert saved == [(messages, 'acme')]
+    assert not messages.persisted
+
+def test_unpersists_when_the_run_fails(incremental_run):
+    run, messages, saved = incremental_run
+
+    def parse_on_driver(*args):
+        raise RuntimeError('write failed')
+
+    with pytest.raises(RuntimeError):
+        run(parse_on_driver)
+
+    assert saved == []
+    assert not messages.persisted
@@ -0,0 +1,60 @@
+"""The executor parse path must unpickle on a worker that never ran the script
+    spark-submit runs the ETL script as __main__, cloudpickle sends the
+    mapPartitions function to executors whose __main__ is the Spark worker
+"""
+
+import json
+import subprocess
+import sys
+
+# driver: run the script body as __main__, pickle the same lambda process_data_on_executors uses
+DRIVER = '''
+import ast, configparser, sys
+from pyspark import cloudpickle
+from pyspark.sql import Row
+
+source = open('s3_redis_json_to_psql_etl.py', encoding='utf-8').read()
+exec(compile(source.split('if __name__ == "__main__":')[0], 's3_redis_json_to_psql_etl.py',
+             'exec'), globals())
+
+config = configparser.RawConfigParser()
+config.read('etl.config.template')
+IGNORE_SEG_FIELDS = ast.literal_eval(config.get('constants', 'IGNORE_SEG_FIELDS'))
+IGNORE_COMPONENT_FIELDS = ast.literal_eval(config.get('constants', 'IGNORE_COMPONENT_FIELDS'))
+segments = ast.literal_eval(config.get('constants', 'HL7_SEGMENTS'))
+
+class Broadcast:
+    def __init__(self, value):
+        self.value = value
+
+class Counter:
+    def add(self, amount):
+        pass
+
+ignore_lists_bc = Broadcast(ignore_lists_from_globals())
+counters = (Counter(), Counter())
+record = json.load(open('sample.json', encoding='utf-8'))
+rows = [Row(**{key.lower(): value for key, value in record.items()})]
+func = lambda rows: process_partition(rows, segments, ignore_lists_bc, counters, None)
+sys.stdout.buffer.write(cloudpickle.dumps((func, rows)))
+'''
+
+# executor: a fresh interpreter whose __main__ knows nothing about the script
+EXECUTOR = '''
+import pickle, sys
+func, rows = pickle.loads(sys.stdin.buffer.read())
+for line in func(iter(rows)):
+    print(line)
+'''
+
+def run_python(code, cwd, stdin=None):
+    return subprocess.run([sys.executable, '-c', code], cwd=cwd, input=stdin,
+                          capture_output=True, check=True).stdout
+
+def test_process_partition_runs_from_main_pickle(etl_dir):
+    pickled = run_python(DRIVER, etl_dir)
+    output = run_python(EXECUTOR, etl_dir, pickled).decode('utf-8')
+
+    parsed = [json.loads(line) for line in output.splitlines()]
+    assert len(parsed) == 1
+    assert any(col.startswith('pid_') for col in parsed[0])
@@ -0,0 +1,66 @@
+"""The pipe-delimited fast parser must produce exactly what hl7apy does
+    and hand back to hl7apy whatever it can't split on its own
+"""
+
+import pytest
+
+import hl7_fast_parser
+
+# fast path segments next to the sample.json ones
+IN1_SEGMENT = 'IN1|1|PLAN1^Plan One|12345^^^^NA|ACME INSURANCE||||GRP42'
+# MSH-2 with the usual escape character, so MSH-1/MSH-2 go through hl7apy
+MSH_ESCAPE_CHAR = 'MSH|^~\\&|EPICCARE|EH^EHEM|||20230901055456||ADT^A08^ADT_A01|987654321|P|2.3'
+# \T\ escape sequence in the patient name
+PID_ESCAPED = 'PID|1||2666093^^^^EPI||O\\T\\BRIEN^FIRSTNAME||19900101|F|||1 MAIN ST^^CITY^CA^12345'
+# PID-3.4 assigning authority with subcomponents
+PID_SUBCOMPONENTS = 'PID|1||2666093^^^EPIC&1.2.840&ISO^MR||LASTNAME^FIRSTNAME||19900101|F'
+# not one of FAST_SEGMENTS
+NK1_SEGMENT = 'NK1|1|LASTNAME^SPOUSE|SPO^Spouse||(555)555-1234'
+
+@pytest.fixture
+def seg_args(etl_dir, template_config):
+    """(seg_fields, component_fields, fields) as the ETL passes them
+    """
+
+    from bench_hl7_parse import ignore_lists_from_config
+
+    ignore_lists = ignore_lists_from_config(template_config)
+    return ignore_lists['seg_fields'], ignore_lists['component_fields'], ignore_lists['fields']
+
+def hl7apy_fields(segment_data, seg_args):
+    pairs, error = hl7_fast_parser.parse_hl7apy_segment_fields(segment_data, *seg_args)
+    assert error is None
+    return dict(pairs)
+
+@pytest.mark.parametrize('segment', ['msh', 'evn', 'pid', 'pv1'])
+def test_sample_segments_match_hl7apy(segment, sample_record, seg_args):
+    segment_data = sample_record[segment]
+
+    fast = hl7_fast_parser.parse_segment_fields(segment_data, *seg_args)
+
+    assert fast is not None
+    assert dict(fast) == hl7apy_fields(segment_data, seg_args)
+
+def test_in1_matches_hl7apy(seg_args):
+    fast = hl7_fast_parser.parse_segment_fields(IN1_SEGMENT, *seg_args)
+
+    assert fast is not None
+    assert dict(fast) == hl7apy_fields(IN1_SEGMENT, seg_args)
+
+def test_msh_1_and_2_numbering(sample_record, seg_args):
+    fast = dict(hl7_fast_parser.parse_segment_fields(sample_record['msh'], *seg_args))
+
+    # the field separator is MSH-1, so MSH-3 is the sending application
+    assert fast['msh_1_field_separator_st_none'] == '\\F\\'
+    assert fast['msh_2_encoding_characters_st_none'] == '\\S\\\\R\\\\T\\'
+    assert fast['msh_3_sending_application_hd_1_namespace_id'] == 'EPICCARE'
+
+@pytest.mark.parametrize('segment_data', [MSH_ESCAPE_CHAR, PID_ESCAPED, PID_SUBCOMPONENTS,
+                                          NK1_SEGMENT])
+def test_falls_back_to_hl7apy(segment_data, seg_args):
+    assert hl7_fast_parser.parse_segment_fields(segment_data, *seg_args) is None
+
+    pairs, error = hl7_fast_parser.parse_hl7_segment_fields.__wrapped__(segment_data, *seg_args)
+
+    assert error is None
+    assert dict(pairs) == hl7apy_fields(segment_data, seg_args)
@@ -0,0 +1,46 @@
+"""One feed with a missing S3 prefix must not stop the other feeds
+    get_s3_jsons raises, run_feed records the feed as failed
+"""
+
+import pytest
+from pyspark.sql.utils import AnalysisException
+
+class MissingPrefixReader:
+    """spark.read for a prefix with no files
+    """
+
+    def json(self, path, **_):
+        raise AnalysisException(f'Path does not exist: {path}')
+
+class FakeSparkContext:
+    def setLocalProperty(self, key, value):
+        pass
+
+class FakeSession:
+    """only what get_s3_jsons and run_feed touch, no JVM needed
+    """
+
+    read = MissingPrefixReader()
+    sparkContext = FakeSparkContext()
+
+def test_missing_prefix_raises():
+    import s3_redis_json_to_psql_etl as v5
+
+    with pytest.raises(AnalysisException):
+        v5.get_s3_jsons(FakeSession(), 'bucket/JSON/adt_feed1/', days=1)
+
+def test_missing_prefix_fails_only_that_feed(monkeypatch):
+    import s3_redis_json_to_psql_etl as v5
+
+    loaded = []
+    def df_etl(sparksession, adtfeedname, segments, s3bucketprefix, options=None):
+        if adtfeedname == 'adt_feed2':
+            v5.get_s3_jsons(sparksession, s3bucketprefix + adtfeedname, segments)
+        loaded.append(adtfeedname)
+    monkeypatch.setattr(v5, 'df_etl', df_etl)
+
+    failed = v5.run_feeds(FakeSession(), ['adt_feed1', 'adt_feed2', 'adt_feed3'], ['pid'],
+                          'bucket/JSON/', {}, parallel=2)
+
+    assert failed == ['adt_feed2']
+    assert sorted(loaded) == ['adt_feed1', 'adt_feed3']
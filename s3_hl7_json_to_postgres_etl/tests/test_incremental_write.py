@@ -0,0 +1,108 @@
+"""Incremental runs must upsert, never fall back to a plain append
+"""
+
+import pytest
+
+from test_missing_segments import set_ignore_globals
+
+class ParsedColumns:
+    """write_df only looks at the columns before choosing a sink
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+
+def test_incremental_without_upsert_keys_fails():
+    import s3_redis_json_to_psql_etl as v5
+
+    with pytest.raises(ValueError, match='pt_visit_number'):
+        v5.write_df(ParsedColumns(['patientid', 'dob']), 'acme', 'copy', incremental=True)
+
+def test_v4_incremental_without_upsert_keys_fails(etl_dir):
+    import s3_json_to_psql_etl as v4
+
+    with pytest.raises(ValueError, match='pt_visit_number'):
+        v4.df_to_jdbc_upsert(ParsedColumns(['patientid', 'dob']), 'acme', {})
+
+def test_v4_no_messages_is_not_a_dataframe(etl_dir, template_config):
+    import s3_json_to_psql_etl as v4
+    set_ignore_globals(v4, template_config)
+
+    class NoRows:
+        def collect(self):
+            return []
+
+    assert v4.process_data(NoRows(), ['pid'], None) is None
+
+def test_v4_upsert_needs_message_time(etl_dir):
+    import s3_json_to_psql_etl as v4
+
+    with pytest.raises(ValueError, match=v4.MESSAGE_TIME_FIELD):
+        v4.df_to_jdbc_upsert(ParsedColumns(['patientid', 'pt_visit_number']), 'acme', {})
+
+def test_v4_message_time_without_msh_segment(etl_dir, template_config, template_segments,
+                                             sample_record):
+    import s3_json_to_psql_etl as v4
+    set_ignore_globals(v4, template_config)
+
+    class Rows:
+        def collect(self):
+            return [sample_record]
+
+    class Session:
+        def createDataFrame(self, rows):
+            return rows
+
+    assert 'msh' not in template_segments
+    rows = v4.process_data(Rows(), [], Session(), with_message_time=True)
+    assert rows[0][v4.MESSAGE_TIME_FIELD] == '20230901055456'
+    assert v4.MESSAGE_TIME_FIELD not in v4.process_data(Rows(), [], Session())[0]
+
+class RecordingCursor:
+    """psycopg2 cursor/connection that records SQL, the feed table has two columns
+    """
+
+    def __init__(self):
+        self.statements = []
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, args=None):
+        self.statements.append(sql)
+
+    def fetchall(self):
+        return [('patientid',), ('pt_visit_number',)]
+
+    def commit(self):
+        pass
+
+    rollback = close = commit
+
+class JdbcWriter:
+    def jdbc(self, url, table, mode, properties):
+        pass
+
+def test_v4_upsert_adds_columns_and_orders_by_message_time(etl_dir, monkeypatch):
+    import s3_json_to_psql_etl as v4
+
+    recorder = RecordingCursor()
+    monkeypatch.setattr(v4.psycopg2, 'connect', lambda **_: recorder)
+    monkeypatch.setattr(v4, 'jdbc_settings', lambda config: ('jdbc:postgresql://db/etl', {}))
+    parsed = ParsedColumns(['patientid', 'pt_visit_number', v4.MESSAGE_TIME_FIELD, 'dob'])
+    parsed.write = JdbcWriter()
+
+    assert v4.df_to_jdbc_upsert(parsed, 'acme', {})
+
+    alter = [sql for sql in recorder.statements if sql.startswith('ALTER TABLE v4_acme')]
+    assert alter == [f'ALTER TABLE v4_acme ADD COLUMN IF NOT EXISTS "{v4.MESSAGE_TIME_FIELD}" text, '
+                     'ADD COLUMN IF NOT EXISTS "dob" text;']
+    insert = [sql for sql in recorder.statements if sql.startswith('INSERT INTO v4_acme')]
+    assert insert[0].endswith(f'"{v4.MESSAGE_TIME_FIELD}" DESC NULLS LAST;')
+    assert recorder.statements[-1].startswith('DROP TABLE IF EXISTS v4_acme_staging_')
@@ -0,0 +1,59 @@
+"""A message without an optional segment must still load
+    the explicit read schema returns None for segments a message doesn't have
+"""
+
+import ast
+
+def set_ignore_globals(module, config):
+    """the scripts set these globals in __main__
+    """
+
+    module.IGNORE_SEG_FIELDS = ast.literal_eval(config.get('constants', 'IGNORE_SEG_FIELDS'))
+    module.IGNORE_COMPONENT_FIELDS = ast.literal_eval(config.get('constants',
+                                                                 'IGNORE_COMPONENT_FIELDS'))
+
+def test_v4_missing_segment_is_skipped(etl_dir, template_config, template_segments,
+                                       sample_record):
+    import s3_json_to_psql_etl as v4
+    set_ignore_globals(v4, template_config)
+
+    record = dict(sample_record, in1=None)
+    data_dict = {'patientid': record['patientid'], 'dob': record['dob']}
+    results = {s_g: v4.process_hl7_segment(s_g, record, data_dict)
+               for s_g in template_segments + ['in1']}
+
+    assert results['in1'] is False
+    assert results['pid']
+    assert not any(col.startswith('in1_') for col in data_dict)
+    assert any(col.startswith('pid_') for col in data_dict)
+
+def test_v5_missing_segment_is_skipped(etl_dir, template_config, template_segments,
+                                       sample_record):
+    import s3_redis_json_to_psql_etl as v5
+    set_ignore_globals(v5, template_config)
+
+    record = dict(sample_record, in1=None)
+    errors = []
+    data_dict = v5.process_record(record, template_segments + ['in1'],
+                                  v5.ignore_lists_from_globals(), errors)
+
+    assert data_dict is not None
+    assert errors == []
+    assert any(col.startswith('pid_') for col in data_dict)
+
+def test_v4_hl7apy_error_is_skipped(etl_dir, template_config, monkeypatch):
+    import hl7_fast_parser
+    import s3_json_to_psql_etl as v4
+    set_ignore_globals(v4, template_config)
+
+    def parse_segment(segment_data):
+        raise AttributeError('malformed segment')
+
+    # NK1 isn't one of the fast parser's segments, it always goes to hl7apy
+    monkeypatch.setattr(hl7_fast_parser, 'parse_segment', parse_segment)
+    hl7_fast_parser.parse_hl7_segment_fields.cache_clear()
+    data_dict = {}
+
+    assert v4.process_hl7_segment('nk1', {'nk1': 'NK1|1|LASTNAME^SPOUSE'}, data_dict) is False
+    assert data_dict == {}
+    hl7_fast_parser.parse_hl7_segment_fields.cache_clear()
@@ -0,0 +1,55 @@
+"""Parquet output is partitioned by feed and MSH-7 message date
+    msh is not in the shipped HL7_SEGMENTS, the date comes from the raw segment
+"""
+
+import shutil
+
+import pytest
+
+from test_missing_segments import set_ignore_globals
+
+def test_message_time_without_msh_segment(etl_dir, template_config, template_segments,
+                                          sample_record):
+    import s3_redis_json_to_psql_etl as v5
+    set_ignore_globals(v5, template_config)
+
+    assert 'msh' not in template_segments
+    data_dict = v5.process_record(sample_record, template_segments,
+                                  v5.ignore_lists_from_globals(message_time=True))
+
+    assert data_dict[v5.MESSAGE_TIME_FIELD] == '20230901055456'
+
+def test_no_message_time_column_by_default(etl_dir, template_config, template_segments,
+                                           sample_record):
+    import s3_redis_json_to_psql_etl as v5
+    set_ignore_globals(v5, template_config)
+
+    data_dict = v5.process_record(sample_record, template_segments,
+                                  v5.ignore_lists_from_globals())
+
+    assert v5.MESSAGE_TIME_FIELD not in data_dict
+
+def test_message_time_missing_msh():
+    import s3_redis_json_to_psql_etl as v5
+
+    assert v5.message_time({'msh': None}) is None
+    assert v5.message_time({'msh': 'MSH|^~&|EPICCARE'}) is None
+
+@pytest.mark.skipif(shutil.which('java') is None, reason='Spark needs a JVM')
+def test_parquet_partition_directories(etl_dir, template_config, template_segments,
+                                       sample_record, tmp_path):
+    from pyspark.sql import SparkSession
+    import s3_redis_json_to_psql_etl as v5
+    set_ignore_globals(v5, template_config)
+
+    spark = SparkSession.builder.master('local[1]').appName('parquet_partitions').getOrCreate()
+    try:
+        data_dict = v5.process_record(sample_record, template_segments,
+                                      v5.ignore_lists_from_globals(message_time=True))
+        parsed_df = v5.rename_df_columns(spark.createDataFrame([data_dict]))
+        v5.df_to_parquet(parsed_df, 'acme', str(tmp_path))
+    finally:
+        spark.stop()
+
+    assert (tmp_path / 'feed=acme' / 'message_date=2023-09-01').is_dir()
+    assert not list(tmp_path.glob('feed=acme/message_date=__HIVE_DEFAULT_PARTITION__'))
@@ -0,0 +1,18 @@
+"""The ETL scripts and tests must stay free of pyflakes warnings
+    unused imports and locals have crept in before, e.g. in create_sample_data.py
+"""
+
+import io
+
+import pytest
+
+from conftest import ETL_DIR
+
+def test_no_pyflakes_warnings():
+    api = pytest.importorskip('pyflakes.api')
+    reporter_mod = pytest.importorskip('pyflakes.reporter')
+
+    out = io.StringIO()
+    warnings = api.checkRecursive([str(ETL_DIR)], reporter_mod.Reporter(out, out))
+
+    assert warnings == 0, out.getvalue()
@@ -0,0 +1,26 @@
+"""--engine python has no checkpoints, Parquet or dead letter sink,
+    options that need them must be rejected before anything runs
+"""
+
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ETL_DIR
+
+@pytest.mark.parametrize('options', [['--dead-letter', 'ndjson'],
+                                     ['--dead-letter-path', '/var/tmp/dead'],
+                                     ['--dead-letter', 'postgres', '--replay-dead-letters']])
+def test_python_engine_rejects_dead_letter_options(options, tmp_path):
+    # the script reads its config and ignore lists from the working directory
+    shutil.copy(ETL_DIR / 'etl.config.template', tmp_path / 'etl.config')
+    shutil.copy(ETL_DIR / 'hl7_field_names_to_ignore.txt', tmp_path)
+
+    result = subprocess.run([sys.executable, str(ETL_DIR / 's3_redis_json_to_psql_etl.py'),
+                             '--adt-feed-name', 'acme', '--engine', 'python', *options],
+                            cwd=tmp_path, capture_output=True, text=True, check=False)
+
+    assert result.returncode == 2
+    assert 'need --engine spark' in result.stderr
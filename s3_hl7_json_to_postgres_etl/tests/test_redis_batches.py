@@ -0,0 +1,36 @@
+"""Streaming RedisJSON reads - SCAN then one JSON.MGET per batch of keys
+"""
+
+class FakeRedis:
+    """SCAN and JSON.MGET over a dict, records the size of every MGET
+    """
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.mgets = []
+
+    def scan_iter(self, match, count):
+        return iter(self.docs)
+
+    def json(self):
+        return self
+
+    def mget(self, keys, path):
+        self.mgets.append(len(keys))
+        return [self.docs[key] for key in keys]
+
+def test_iter_redis_json_batches(monkeypatch):
+    import s3_redis_json_to_psql_etl as v5
+
+    docs = {f'pid_{num}': {'patientid': str(num)} for num in range(5)}
+    docs['pid_gone'] = None
+    fake = FakeRedis(docs)
+    monkeypatch.setattr(v5.redis, 'Redis', lambda **_: fake)
+    settings = {'search_for': 'pid_*', 'scan_count': 100, 'batch_size': 2}
+
+    batches = list(v5.iter_redis_json_batches('localhost', 6379, settings))
+
+    assert fake.mgets == [2, 2, 2]
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert [doc['sourceKey'] for batch in batches for doc in batch] == [
+        f'pid_{num}' for num in range(5)]
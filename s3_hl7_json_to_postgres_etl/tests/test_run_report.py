@@ -0,0 +1,36 @@
+"""Run report stages and row counts
+"""
+
+from etl_metrics import RunReport
+
+class CountOnly:
+    """DataFrame stand-in that records whether it was persisted
+    """
+
+    persisted = False
+
+    def persist(self):
+        self.persisted = True
+        return self
+
+    def count(self):
+        return 3
+
+def test_rows_does_not_persist(tmp_path):
+    report = RunReport('acme', str(tmp_path))
+    data = CountOnly()
+
+    assert report.rows(data) == 3
+    assert not data.persisted
+    assert report.rows([{'a': 1}, {'a': 2}]) == 2
+    assert report.rows([[{'a': 1}], [{'a': 2}, {'a': 3}]]) == 3
+
+def test_timed_batches_records_each_fetch(tmp_path):
+    report = RunReport('acme', str(tmp_path))
+
+    batches = list(report.timed_batches('df_to_dict_batches', iter([[1, 2], [3]])))
+
+    assert batches == [[1, 2], [3]]
+    fetches = [stage for stage in report.stages if stage['stage'] == 'df_to_dict_batches']
+    assert [stage['rows_out'] for stage in fetches] == [2, 1, None]
+    assert 'df_to_dict_batches' in report.as_dict()['totals']
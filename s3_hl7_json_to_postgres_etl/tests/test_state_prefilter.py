@@ -0,0 +1,82 @@
+"""The raw PID-11.4 pre-filter must keep exactly the messages the STATES check
+    on the parsed row keeps - a message it drops is lost, one it keeps is parsed for nothing
+"""
+
+import shutil
+
+import pytest
+
+from test_missing_segments import set_ignore_globals
+
+STATES = ['CA', 'OR']
+
+# PID-11 values, None leaves PID-11 out of the segment
+ADDRESSES = {
+    'in_state': '1 MAIN ST^^CITY^CA^12345',
+    'out_of_state': '1 MAIN ST^^CITY^NY^12345',
+    'state_is_last_component': '1 MAIN ST^^CITY^OR',
+    'repeated_same_state': '1 MAIN ST^^CITY^CA^12345~1 MAIN ST^^CITY^CA^12345',
+    'repeated_in_state_last': '1 MAIN ST^^CITY^NY^10001~2 OAK ST^^TOWN^CA^90001',
+    'repeated_in_state_first': '1 MAIN ST^^CITY^CA^90001~2 OAK ST^^TOWN^NY^10001',
+    'repeated_last_without_state': '1 MAIN ST^^CITY^CA^90001~2 OAK ST^^TOWN^^10001',
+    'repeated_last_short': '1 MAIN ST^^CITY^CA^90001~2 OAK ST^^TOWN',
+    'fewer_than_4_components': '1 MAIN ST^^CITY',
+    'blank_state': '1 MAIN ST^^CITY^^12345',
+    'empty': '',
+    'missing': None,
+}
+
+def pid_segment(address):
+    fields = ['PID', '1', '', '2666093^^^^EPI', '', 'LASTNAME^FIRSTNAME', '', '19900101', 'F',
+              '', '']
+    if address is not None:
+        fields.append(address)
+    return '|'.join(fields)
+
+@pytest.fixture
+def records(sample_record):
+    return {name: dict(sample_record, pid=pid_segment(address))
+            for name, address in ADDRESSES.items()}
+
+@pytest.mark.parametrize('name', list(ADDRESSES))
+def test_prefilter_matches_parsed_state(name, records, etl_dir, template_config,
+                                        template_segments):
+    import s3_redis_json_to_psql_etl as v5
+    set_ignore_globals(v5, template_config)
+    ignore_lists = v5.ignore_lists_from_globals(STATES)
+
+    parsed = v5.process_record(records[name], template_segments, ignore_lists)
+
+    assert v5.passes_state_prefilter(records[name], ignore_lists['states']) == \
+        (parsed is not None)
+
+def test_prefilter_cases_keep_and_drop(records, etl_dir):
+    import s3_redis_json_to_psql_etl as v5
+
+    kept = {name for name, record in records.items()
+            if v5.passes_state_prefilter(record, frozenset(STATES))}
+
+    assert kept == {'in_state', 'state_is_last_component', 'repeated_same_state',
+                    'repeated_in_state_last', 'repeated_last_without_state',
+                    'repeated_last_short'}
+
+@pytest.mark.skipif(shutil.which('java') is None, reason='Spark needs a JVM')
+def test_spark_state_filter_matches_prefilter(records, etl_dir):
+    from pyspark.sql import SparkSession
+    import s3_json_to_psql_etl as v4
+    import s3_redis_json_to_psql_etl as v5
+
+    spark = SparkSession.builder.master('local[1]').appName('state_prefilter').getOrCreate()
+    try:
+        pid_df = spark.createDataFrame([(name, record['pid']) for name, record in records.items()]
+                                       + [('null_pid', None)], 'name string, pid string')
+        kept = {module: {row['name'] for row in
+                         pid_df.filter(module.state_filter_column(STATES)).collect()}
+                for module in (v4, v5)}
+    finally:
+        spark.stop()
+
+    expected = {name for name, record in records.items()
+                if v5.passes_state_prefilter(record, frozenset(STATES))}
+    assert kept[v4] == expected
+    assert kept[v5] == expected